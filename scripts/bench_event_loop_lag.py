@@ -0,0 +1,111 @@
+"""
+Benchmark: atraso do event loop sob carga de webhooks (sessão síncrona vs assíncrona).
+
+Simula N webhooks concorrentes fazendo a busca do casal por group_jid, como o
+process_webhook_task, enquanto um monitor mede quanto o event loop atrasa um
+sleep de 1 ms. Com a sessão síncrona cada query trava o loop inteiro; com a
+assíncrona (aiosqlite) o loop continua livre para outros webhooks.
+
+Uso (a partir da raiz do repo):
+  python scripts/bench_event_loop_lag.py --couples 50000 --webhooks 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlmodel import Session, SQLModel, create_engine, select  # noqa: E402
+from sqlmodel.ext.asyncio.session import AsyncSession  # noqa: E402
+
+from models import Couple, User  # noqa: E402
+
+
+def seed(path: str, couples: int):
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        owner = User(email="bench@nosai.online", full_name="Bench", phone_number="5511999999999", hashed_password="x")
+        session.add(owner)
+        session.commit()
+        session.refresh(owner)
+        session.add_all(
+            Couple(user_id=owner.id, partner_name=f"P{i}", partner_phone="5511988887777",
+                   group_jid=f"{i}-group@g.us", status="active")
+            for i in range(couples)
+        )
+        session.commit()
+    engine.dispose()
+
+
+async def monitor_lag(stop: asyncio.Event, samples: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        samples.append((loop.time() - start - 0.001) * 1000)
+
+
+async def run(mode: str, path: str, couples: int, webhooks: int) -> dict:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_lag(stop, samples))
+    jids = [f"{(i * 7919) % couples}-group@g.us" for i in range(webhooks)]
+
+    if mode == "sync":
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+        async def webhook(jid: str):
+            with Session(engine) as session:
+                session.exec(select(Couple).where(Couple.group_jid == jid)).first()
+            await asyncio.sleep(0)
+    else:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def webhook(jid: str):
+            async with factory() as session:
+                (await session.exec(select(Couple).where(Couple.group_jid == jid))).first()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(webhook(jid) for jid in jids))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    if mode == "sync":
+        engine.dispose()
+    else:
+        await engine.dispose()
+
+    samples.sort()
+    return {
+        "mode": mode,
+        "total_s": round(elapsed, 3),
+        "lag_p50_ms": round(statistics.median(samples), 2) if samples else 0.0,
+        "lag_p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2) if samples else 0.0,
+        "lag_max_ms": round(samples[-1], 2) if samples else 0.0,
+        "lag_samples": len(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--couples", type=int, default=50000)
+    parser.add_argument("--webhooks", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, args.couples)
+        for mode in ("sync", "async"):
+            print(asyncio.run(run(mode, path, args.couples, args.webhooks)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: rajada de logins (argon2 no event loop vs no pool de threads).
+
+Dispara N verificações de senha concorrentes, como N POST /api/auth/token ao
+mesmo tempo, enquanto um monitor mede quanto o event loop atrasa um sleep de
+1 ms (é esse atraso que os webhooks sentem). No modo "inline" o argon2 roda
+direto na coroutine; no modo "pool" passa pelo PasswordHasher do auth.py.
+
+Uso (a partir da raiz do repo):
+  python scripts/bench_login_storm.py --logins 64 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from auth import PasswordHasher, get_password_hash, verify_password  # noqa: E402
+
+
+async def monitor_lag(stop: asyncio.Event, samples: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        samples.append((loop.time() - start - 0.001) * 1000)
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def run(mode: str, hashed: str, logins: int, workers: int) -> dict:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_lag(stop, samples))
+    hasher = PasswordHasher(workers=workers) if mode == "pool" else None
+    latencies: list[float] = []
+
+    async def login():
+        started = time.perf_counter()
+        if hasher is None:
+            verify_password("senha-do-bench", hashed)
+            await asyncio.sleep(0)
+        else:
+            await hasher.verify("senha-do-bench", hashed)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    samples.sort()
+    latencies.sort()
+    result = {
+        "mode": mode,
+        "total_s": round(elapsed, 3),
+        "login_p50_ms": round(statistics.median(latencies), 1),
+        "login_p99_ms": round(percentile(latencies, 0.99), 1),
+        "lag_p50_ms": round(statistics.median(samples), 2) if samples else 0.0,
+        "lag_p99_ms": round(percentile(samples, 0.99), 2),
+        "lag_max_ms": round(samples[-1], 2) if samples else 0.0,
+    }
+    if hasher is not None:
+        result["hasher"] = hasher.stats()
+        hasher.shutdown()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    hashed = get_password_hash("senha-do-bench")
+    for mode in ("inline", "pool"):
+        print(asyncio.run(run(mode, hashed, args.logins, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark e relatório de precisão do cache semântico (MinHash + LSH).
+
+1. Custo do lookup x tamanho do índice: enche um único casal com N prompts
+   sintéticos e mede assinatura + lookup (p50/p99 em µs) contra a varredura
+   linear de Jaccard que o LSH evita.
+2. Precisão/recall nos pares rotulados: para cada par, indexa "a" e consulta
+   com "b" (mesmo casal), em vários limites. O limite é escolhido olhando só
+   o corpus de calibração (scripts/fixtures/near_duplicates.jsonl); o held-out
+   (scripts/fixtures/near_duplicates_holdout.jsonl) não entra no ajuste e é o
+   número que vale: trocas de um termo ("frango" x "peixe", "namorada" x
+   "namorado") e reformulações que nunca foram vistas na calibração.
+
+Uso (a partir da raiz do repo):
+  python scripts/bench_semantic_cache.py --sizes 100 1000 10000 --lookups 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from logging_config import setup_logging  # noqa: E402
+from semantic_cache import SemanticCache, jaccard  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "near_duplicates.jsonl")
+HOLDOUT = os.path.join(os.path.dirname(__file__), "fixtures", "near_duplicates_holdout.jsonl")
+
+VOCAB = (
+    "dica jantar almoço filme série viagem presente aniversário namoro passeio restaurante receita música "
+    "domingo sábado noite manhã praia cinema parque casa chuva frio romântico barato surpresa brinde jogo "
+    "livro dança academia cozinhar viajar conversar planejar sonho família amigos cachorro gato festa"
+).split()
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def synthetic_prompt(rng: random.Random) -> str:
+    return "me dá uma ideia de " + " ".join(rng.sample(VOCAB, rng.randint(3, 6)))
+
+
+def bench_size(size: int, lookups: int, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    cache = SemanticCache(enabled=True, max_per_scope=size)
+    for _ in range(size):
+        probe = cache.probe(synthetic_prompt(rng), "bench@g.us", "Ana", {"couple_id": 1})
+        cache.add(probe, "resposta")
+    entries = list(cache._scopes["casal:1"].entries.values())
+
+    probe_us, lookup_us, linear_us = [], [], []
+    for _ in range(lookups):
+        text = synthetic_prompt(rng)
+        started = time.perf_counter()
+        probe = cache.probe(text, "bench@g.us", "Ana", {"couple_id": 1})
+        probe_us.append((time.perf_counter() - started) * 1_000_000)
+        started = time.perf_counter()
+        cache.lookup(probe)
+        lookup_us.append((time.perf_counter() - started) * 1_000_000)
+        if len(linear_us) < 200:  # A varredura linear é cara: amostra menor
+            started = time.perf_counter()
+            max(jaccard(probe.terms, entry.terms) for entry in entries)
+            linear_us.append((time.perf_counter() - started) * 1_000_000)
+
+    for values in (probe_us, lookup_us, linear_us):
+        values.sort()
+    stats = cache.stats()
+    return {
+        "index_size": size,
+        "signature_p50_us": round(statistics.median(probe_us), 1),
+        "lookup_p50_us": round(statistics.median(lookup_us), 1),
+        "lookup_p99_us": round(percentile(lookup_us, 0.99), 1),
+        "avg_candidates": stats["avg_candidates"],
+        "linear_scan_p50_us": round(statistics.median(linear_us), 1),
+        "hit_rate": stats["hit_rate"],
+    }
+
+
+def precision_report(thresholds: list[float], path: str = FIXTURES) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    report = []
+    for threshold in thresholds:
+        tp = fp = fn = tn = 0
+        false_positives = []
+        for i, pair in enumerate(pairs):
+            cache = SemanticCache(enabled=True, threshold=threshold)
+            context = {"couple_id": i}
+            stored = cache.probe(pair["a"], "bench@g.us", "Ana", context)
+            if stored is not None:
+                cache.add(stored, "resposta para: " + pair["a"])
+            probe = cache.probe(pair["b"], "bench@g.us", "Ana", context)
+            hit = probe is not None and stored is not None and cache.lookup(probe) is not None
+            if hit and pair["duplicate"]:
+                tp += 1
+            elif hit:
+                fp += 1
+                false_positives.append(f'{pair["a"]!r} ~ {pair["b"]!r}')
+            elif pair["duplicate"]:
+                fn += 1
+            else:
+                tn += 1
+        report.append({
+            "threshold": threshold,
+            "precision": round(tp / (tp + fp), 3) if tp + fp else 1.0,
+            "recall": round(tp / (tp + fn), 3) if tp + fn else 0.0,
+            "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+            "false_positives": false_positives,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.65, 0.75, 0.9])
+    args = parser.parse_args()
+
+    setup_logging()
+    logging.getLogger().setLevel(logging.WARNING)  # Sem o log de cada hit
+    print("# Custo do lookup x tamanho do índice")
+    for size in args.sizes:
+        print(bench_size(size, args.lookups))
+    print("# Precisão no corpus de calibração")
+    for row in precision_report(args.thresholds):
+        print(row)
+    print("# Precisão no held-out (não usado para escolher o limite)")
+    for row in precision_report(args.thresholds, HOLDOUT):
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
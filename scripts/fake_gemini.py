@@ -0,0 +1,182 @@
+"""
+Servidor Gemini falso para testes locais (sem gastar cota).
+
+Responde aos endpoints usados pelo bot:
+  POST /v1beta/models/<model>:generateContent
+  POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+
+Injeção de falhas (para circuit breaker / fallback / hedging), por flag ou em
+tempo de execução via POST /control com o mesmo JSON das flags:
+  --delay 2.5                  atraso antes de responder (todos os modelos)
+  --error-rate 0.3             fração de respostas 503
+  --status 429                 status usado nas falhas injetadas
+  --model-delay m=12           atraso só para um modelo (repetível)
+  --model-error-rate m=1.0     taxa de erro só para um modelo (repetível)
+
+Uso:
+  python scripts/fake_gemini.py --port 8090
+  GEMINI_BASE_URL=http://localhost:8090 GEMINI_STREAMING=true uvicorn main:app
+  curl -X POST localhost:8090/control -d '{"model_error_rate": {"gemini-2.0-flash-exp": 1.0}}'
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "Entendo, isso pesa mesmo.<QUEBRA>"
+    "Faz tempo que vocês estão sentindo essa distância?<QUEBRA>"
+    "Me conta um pouco mais de como foi o último fim de semana de vocês."
+)
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+def _usage(prompt: str, output: str) -> dict:
+    """usageMetadata no formato do Gemini (contagem aproximada, ~4 caracteres por token)."""
+    prompt_tokens, output_tokens = len(prompt) // 4, len(output) // 4
+    return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens}
+
+
+def _prompt_text(body: bytes) -> str:
+    try:
+        return "".join(part.get("text", "") for content in json.loads(body)["contents"] for part in content["parts"])
+    except (ValueError, KeyError, TypeError):
+        return ""
+
+
+_MODEL_RE = re.compile(r"/models/([^:/]+):")
+
+
+class FaultConfig:
+    """Falhas injetadas; alteradas por flag ou por POST /control."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        self.error_rate = 0.0
+        self.status = 503
+        self.model_delay: dict[str, float] = {}
+        self.model_error_rate: dict[str, float] = {}
+        self.requests: dict[str, int] = {}
+
+    def update(self, changes: dict):
+        with self.lock:
+            for key in ("delay", "error_rate", "status"):
+                if key in changes:
+                    setattr(self, key, type(getattr(self, key))(changes[key]))
+            for key in ("model_delay", "model_error_rate"):
+                if key in changes:
+                    setattr(self, key, {m: float(v) for m, v in changes[key].items()})
+
+    def for_model(self, model: str) -> tuple[float, bool, int]:
+        """(atraso, deve_falhar, status) para uma requisição desse modelo."""
+        with self.lock:
+            self.requests[model] = self.requests.get(model, 0) + 1
+            delay = self.model_delay.get(model, self.delay)
+            error_rate = self.model_error_rate.get(model, self.error_rate)
+            return delay, random.random() < error_rate, self.status
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "delay": self.delay, "error_rate": self.error_rate, "status": self.status,
+                "model_delay": self.model_delay, "model_error_rate": self.model_error_rate,
+                "requests": self.requests,
+            }
+
+
+FAULTS = FaultConfig()
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    reply = DEFAULT_REPLY
+    chunk_size = 12          # Caracteres por evento SSE
+    chunk_delay = 0.05       # Segundos entre eventos SSE
+
+    def do_GET(self):
+        if self.path.startswith("/control"):
+            self._json(200, FAULTS.snapshot())
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if self.path.startswith("/control"):
+            FAULTS.update(json.loads(body or b"{}"))
+            self._json(200, FAULTS.snapshot())
+            return
+
+        match = _MODEL_RE.search(self.path)
+        delay, fail, status = FAULTS.for_model(match.group(1) if match else "")
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self._json(status, {"error": {"code": status, "message": "injected failure"}})
+            return
+
+        prompt = _prompt_text(body)
+        if ":streamGenerateContent" in self.path:
+            self._stream(prompt)
+        elif ":generateContent" in self.path:
+            self._json(200, {**_candidate(self.reply), "usageMetadata": _usage(prompt, self.reply)})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def _json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, prompt: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i in range(0, len(self.reply), self.chunk_size):
+            # Como no Gemini, cada pedaço traz o usageMetadata acumulado até ali
+            end = i + self.chunk_size
+            event = json.dumps({**_candidate(self.reply[i:end]), "usageMetadata": _usage(prompt, self.reply[:end])})
+            self.wfile.write(f"data: {event}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.chunk_delay)
+
+    def log_message(self, format, *args):
+        print(f"[fake_gemini] {self.command} {self.path.split('?')[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Gemini falso (REST + SSE)")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--chunk-delay", type=float, default=FakeGeminiHandler.chunk_delay)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--status", type=int, default=503)
+    parser.add_argument("--model-delay", action="append", default=[], metavar="MODELO=SEGUNDOS")
+    parser.add_argument("--model-error-rate", action="append", default=[], metavar="MODELO=TAXA")
+    args = parser.parse_args()
+
+    FakeGeminiHandler.chunk_delay = args.chunk_delay
+    FAULTS.update({
+        "delay": args.delay,
+        "error_rate": args.error_rate,
+        "status": args.status,
+        "model_delay": dict(item.split("=", 1) for item in args.model_delay),
+        "model_error_rate": dict(item.split("=", 1) for item in args.model_error_rate),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeGeminiHandler)
+    print(f"Fake Gemini ouvindo em http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
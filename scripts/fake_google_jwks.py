@@ -0,0 +1,103 @@
+"""
+Stand-in local das chaves públicas do Google (JWKS) para testar o login com Google.
+
+Gera um par RSA na inicialização e responde:
+  GET /oauth2/v3/certs          -> JWKS com Cache-Control: max-age
+  GET /token?email=..&name=..   -> ID token assinado com a chave atual (aud = --client-id)
+  POST /rotate                  -> troca a chave (tokens antigos passam a ter 'kid' desconhecido)
+
+Uso:
+  python scripts/fake_google_jwks.py --port 8091 --client-id teste.apps.googleusercontent.com
+  GOOGLE_CLIENT_ID=teste.apps.googleusercontent.com \\
+  GOOGLE_CERTS_URL=http://127.0.0.1:8091/oauth2/v3/certs uvicorn main:app
+"""
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+
+def _new_key() -> tuple[str, str, dict]:
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    kid = uuid.uuid4().hex
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    public.update({"kid": kid, "use": "sig", "alg": "RS256"})
+    return kid, pem, public
+
+
+class FakeJWKSHandler(BaseHTTPRequestHandler):
+    client_id = "teste.apps.googleusercontent.com"
+    max_age = 3600
+    kid, pem, public = _new_key()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/oauth2/v3/certs":
+            self._json(200, {"keys": [self.public]}, {"Cache-Control": f"public, max-age={self.max_age}"})
+        elif url.path == "/token":
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self._json(200, {"token": mint_token(query.get("email", "teste@nosai.online"), query.get("name", "Teste"))})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path == "/rotate":
+            FakeJWKSHandler.kid, FakeJWKSHandler.pem, FakeJWKSHandler.public = _new_key()
+            self._json(200, {"kid": self.kid})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def _json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[fake_google_jwks] {self.command} {self.path.split('?')[0]}")
+
+
+def mint_token(email: str, name: str, ttl: int = 3600) -> str:
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": FakeJWKSHandler.client_id,
+        "sub": str(abs(hash(email))),
+        "email": email,
+        "email_verified": True,
+        "name": name,
+        "iat": now,
+        "exp": now + ttl,
+    }
+    return jwt.encode(claims, FakeJWKSHandler.pem, algorithm="RS256", headers={"kid": FakeJWKSHandler.kid})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JWKS do Google falso para o login com Google")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--client-id", default=FakeJWKSHandler.client_id)
+    parser.add_argument("--max-age", type=int, default=FakeJWKSHandler.max_age)
+    args = parser.parse_args()
+
+    FakeJWKSHandler.client_id = args.client_id
+    FakeJWKSHandler.max_age = args.max_age
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeJWKSHandler)
+    print(f"Fake JWKS ouvindo em http://127.0.0.1:{args.port}/oauth2/v3/certs")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Stand-in local do Redis para testar MEMORY_BACKEND=redis sem instalar o servidor.
+
+Fala RESP2 e RESP3 (HELLO, padrão do redis-py recente) com o subconjunto de
+comandos que o RedisMemoryBackend usa (GET, SET ... EX, DEL, EXPIRE, TTL,
+PING), com pipeline e expiração das chaves. Guarda tudo em memória: sobrevive
+a restarts do bot, não do script.
+
+Uso:
+  python scripts/fake_redis.py --port 6390
+  MEMORY_BACKEND=redis REDIS_URL=redis://127.0.0.1:6390/0 uvicorn main:app
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+_store: dict[bytes, tuple[bytes, float]] = {}  # chave -> (valor, vence_em; 0 = sem expiração)
+_lock = threading.Lock()
+
+
+def _alive(key: bytes):
+    item = _store.get(key)
+    if item is not None and item[1] and item[1] <= time.time():
+        del _store[key]
+        return None
+    return item
+
+
+def _bulk(value, proto: int = 2) -> bytes:
+    if value is None:
+        return b"_\r\n" if proto == 3 else b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _hello(proto: int) -> bytes:
+    """Resposta do HELLO: mapa no RESP3, lista plana de chave/valor no RESP2."""
+    fields = {b"server": b"redis", b"version": b"7.2.0", b"mode": b"standalone", b"role": b"master"}
+    pairs = b"".join(_bulk(k) + _bulk(v) for k, v in fields.items()) + _bulk(b"proto") + b":%d\r\n" % proto
+    count = len(fields) + 1
+    header = b"%%%d\r\n" % count if proto == 3 else b"*%d\r\n" % (count * 2)
+    return header + pairs
+
+
+def execute(args: list[bytes], proto: int = 2) -> bytes:
+    command = args[0].upper()
+    with _lock:
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET":
+            item = _alive(args[1])
+            return _bulk(item[0] if item else None, proto)
+        if command == b"SET":
+            expires_at = 0.0
+            options = [a.upper() for a in args[3:]]
+            if b"EX" in options:
+                expires_at = time.time() + int(args[3 + options.index(b"EX") + 1])
+            _store[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            removed = sum(1 for key in args[1:] if _alive(key) is not None and _store.pop(key, None))
+            return b":%d\r\n" % removed
+        if command == b"EXPIRE":
+            item = _alive(args[1])
+            if item is None:
+                return b":0\r\n"
+            _store[args[1]] = (item[0], time.time() + int(args[2]))
+            return b":1\r\n"
+        if command == b"TTL":
+            item = _alive(args[1])
+            if item is None:
+                return b":-2\r\n"
+            return b":%d\r\n" % (int(item[1] - time.time()) if item[1] else -1)
+        if command in (b"CLIENT", b"SELECT"):  # Handshake do redis-py
+            return b"+OK\r\n"
+    return b"-ERR unknown command '%s'\r\n" % command
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        proto = 2
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b"*"):  # Comando inline (ex.: "PING" via telnet)
+                args = line.split()
+            else:
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(size + 2)[:-2])
+            if args and args[0].upper() == b"HELLO":
+                proto = int(args[1]) if len(args) > 1 else proto
+                self.wfile.write(_hello(proto))
+            elif args:
+                self.wfile.write(execute(args, proto))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in local do Redis (RESP2, em memória)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    server = FakeRedisServer((args.host, args.port), RESPHandler)
+    print(f"Fake Redis ouvindo em redis://{args.host}:{args.port}/0")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
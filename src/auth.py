@@ -1,13 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import asyncio
 import os
+import time
 
 # Configurações (devem vir do .env em produção)
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey123") # Trocar em produção!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Argon2 é caro de propósito (CPU + memória): roda fora do event loop, com teto de concorrência
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 
@@ -17,6 +22,73 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+
+class PasswordHasher:
+    """
+    Executa hash/verify do argon2 num pool de threads (o argon2-cffi libera o GIL).
+    O semáforo limita quantos hashes rodam ao mesmo tempo; o resto espera na fila
+    sem travar o event loop, e essa espera aparece nas métricas.
+    """
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
+        self._semaphore = asyncio.Semaphore(workers)
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_hash_ms = 0.0
+        self.max_hash_ms = 0.0
+
+    async def _run(self, fn, *args):
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+        wait_ms = (started - queued_at) * 1000
+        hash_ms = (time.perf_counter() - started) * 1000
+        self.calls += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.total_hash_ms += hash_ms
+        self.max_hash_ms = max(self.max_hash_ms, hash_ms)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "avg_wait_ms": round(self.total_wait_ms / self.calls, 2) if self.calls else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "avg_hash_ms": round(self.total_hash_ms / self.calls, 2) if self.calls else 0.0,
+            "max_hash_ms": round(self.max_hash_ms, 2),
+        }
+
+
+# Instância global
+password_hasher = PasswordHasher()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -0,0 +1,125 @@
+"""
+Cache de Autenticação
+Toda rota autenticada decodifica o JWT e busca o usuário no banco (o frontend
+faz polling em /api/me). Aqui ficam, com TTL curto, os tokens já decodificados
+e os dados do usuário por subject. Rotas que alteram o usuário invalidam na hora.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from jose import jwt
+
+from auth import SECRET_KEY, ALGORITHM
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+
+def subject_is_user_id(subject: str) -> bool:
+    """Tokens novos usam o id do usuário como subject; os antigos usam o email."""
+    return subject.isdigit()
+
+
+class AuthCache:
+    def __init__(self, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # { token: (expira_em, payload) }
+        self._tokens: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        # { subject: (expira_em, colunas do usuário) }
+        self._users: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        # Índice reverso { id do usuário: subjects em _users } (id e email de tokens antigos)
+        self._subjects_by_user: dict[int, set[str]] = {}
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+        self.invalidations = 0
+
+    def _lookup(self, entries: OrderedDict, key: str) -> Optional[dict]:
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            del entries[key]
+            self._removed(entries, key, entry[1])
+            return None
+        entries.move_to_end(key)
+        return entry[1]
+
+    def _store(self, entries: OrderedDict, key: str, value: dict, ttl: float):
+        previous = entries.get(key)
+        if previous is not None:
+            self._removed(entries, key, previous[1])
+        entries[key] = (time.monotonic() + ttl, value)
+        entries.move_to_end(key)
+        if entries is self._users:
+            self._subjects_by_user.setdefault(value["id"], set()).add(key)
+        while len(entries) > self.max_entries:
+            evicted_key, (_, evicted) = entries.popitem(last=False)
+            self._removed(entries, evicted_key, evicted)
+
+    def _removed(self, entries: OrderedDict, key: str, value: dict):
+        """Mantém o índice reverso em dia quando um usuário sai do cache (TTL, LRU ou troca)."""
+        if entries is not self._users:
+            return
+        subjects = self._subjects_by_user.get(value["id"])
+        if subjects is not None:
+            subjects.discard(key)
+            if not subjects:
+                del self._subjects_by_user[value["id"]]
+
+    def decode(self, token: str) -> dict:
+        """Payload do token (levanta JWTError se inválido). Tokens inválidos nunca são cacheados."""
+        payload = self._lookup(self._tokens, token)
+        if payload is not None:
+            self.token_hits += 1
+            return payload
+        self.token_misses += 1
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Nunca guarda além da expiração do próprio token
+        ttl = min(self.ttl, payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            self._store(self._tokens, token, payload, ttl)
+        return payload
+
+    def get_user(self, subject: str) -> Optional[dict]:
+        data = self._lookup(self._users, subject)
+        if data is None:
+            self.user_misses += 1
+        else:
+            self.user_hits += 1
+        return data
+
+    def put_user(self, subject: str, data: dict):
+        self._store(self._users, subject, data, self.ttl)
+
+    def invalidate_user(self, user_id: int):
+        """Remove o usuário em todas as chaves (id e email de tokens antigos), via índice reverso."""
+        stale = self._subjects_by_user.pop(user_id, set())
+        for key in stale:
+            self._users.pop(key, None)
+        self.invalidations += len(stale)
+
+    def stats(self) -> dict:
+        token_total = self.token_hits + self.token_misses
+        user_total = self.user_hits + self.user_misses
+        return {
+            "tokens": len(self._tokens),
+            "users": len(self._users),
+            "token_hit_rate": round(self.token_hits / token_total, 4) if token_total else 0.0,
+            "user_hit_rate": round(self.user_hits / user_total, 4) if user_total else 0.0,
+            "user_hits": self.user_hits,
+            "user_misses": self.user_misses,
+            "invalidations": self.invalidations,
+        }
+
+
+# Instância global
+auth_cache = AuthCache()
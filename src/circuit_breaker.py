@@ -0,0 +1,298 @@
+"""
+Circuit Breaker e Fallback de Modelos do Gemini
+Cada modelo da cadeia (GEMINI_MODEL + GEMINI_FALLBACK_MODELS) tem um breaker
+que abre quando a taxa de erro ou o p95 de latência da janela recente passa do
+limite. Com o breaker aberto a chamada vai direto para o próximo modelo (sem
+esperar o timeout de 30 s). Depois de GEMINI_BREAKER_OPEN_SECONDS o breaker
+fica meio-aberto e deixa passar uma única chamada de teste: se ela der certo,
+o modelo principal volta sozinho.
+Hedging: se o modelo da vez passar de GEMINI_HEDGE_AFTER_MS sem responder, o
+próximo da cadeia é disparado em paralelo e vale a primeira resposta boa.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip()]
+GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))        # Últimas N chamadas por modelo
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "5"))   # Mínimo na janela para avaliar
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv("GEMINI_BREAKER_ERROR_RATE", "0.5"))
+GEMINI_BREAKER_LATENCY_P95_MS = float(os.getenv("GEMINI_BREAKER_LATENCY_P95_MS", "15000"))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", "30"))
+GEMINI_HEDGE_AFTER_MS = float(os.getenv("GEMINI_HEDGE_AFTER_MS", "8000"))     # 0 desliga o hedging
+
+# Estados do breaker
+STATE_CLOSED = "closed"        # Normal
+STATE_OPEN = "open"            # Falhando: ninguém passa até o fim do cooldown
+STATE_HALF_OPEN = "half_open"  # Uma chamada de teste por vez
+
+
+class CircuitOpenError(Exception):
+    """Nenhum modelo da cadeia está aceitando chamadas agora."""
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """Erros que indicam modelo indisponível (contam no breaker e justificam fallback)."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = GEMINI_BREAKER_WINDOW, min_calls: int = GEMINI_BREAKER_MIN_CALLS,
+                 error_rate: float = GEMINI_BREAKER_ERROR_RATE, latency_p95_ms: float = GEMINI_BREAKER_LATENCY_P95_MS,
+                 open_seconds: float = GEMINI_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.latency_p95_ms = latency_p95_ms
+        self.open_seconds = open_seconds
+        self._outcomes: deque[tuple[bool, float]] = deque(maxlen=window)  # (sucesso, latência em ms)
+        self.state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """True se a chamada pode seguir. No meio-aberto reserva a vaga da chamada de teste."""
+        if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = STATE_HALF_OPEN
+            logger.info("circuit_half_open", model=self.name)
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """Chamada liberada por allow() que acabou não acontecendo (ex: hedge cancelado)."""
+        self._probe_in_flight = False
+
+    def record(self, ok: bool, latency_ms: float):
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+        if self.state == STATE_HALF_OPEN:
+            self._probe_in_flight = False
+            if ok and latency_ms < self.latency_p95_ms:
+                self.state = STATE_CLOSED
+                self._outcomes.clear()
+                logger.info("circuit_closed", model=self.name)
+            else:
+                self._open("probe_failed")
+            return
+        self._outcomes.append((ok, latency_ms))
+        if self.state == STATE_CLOSED and len(self._outcomes) >= self.min_calls:
+            if self._error_rate() >= self.error_rate:
+                self._open("error_rate")
+            elif self._p95() >= self.latency_p95_ms:
+                self._open("latency")
+
+    def _open(self, reason: str):
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        logger.warning("circuit_opened", model=self.name, reason=reason,
+                       error_rate=round(self._error_rate(), 2), p95_ms=round(self._p95()))
+
+    def _error_rate(self) -> float:
+        return sum(1 for ok, _ in self._outcomes if not ok) / len(self._outcomes) if self._outcomes else 0.0
+
+    def _p95(self) -> float:
+        latencies = sorted(latency for _, latency in self._outcomes)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "window_error_rate": round(self._error_rate(), 3),
+            "window_p95_ms": round(self._p95(), 1),
+            "opened": self.opened,
+        }
+
+
+def _outcome(task: asyncio.Task) -> object:
+    """Resultado, exceção ou CancelledError de uma tentativa já terminada."""
+    if task.cancelled():
+        return asyncio.CancelledError()
+    return task.exception() or task.result()
+
+
+class ModelRouter:
+    """Escolhe o modelo de cada chamada pela cadeia de fallback, respeitando os breakers."""
+
+    def __init__(self, models: list[str], hedge_after_ms: float = GEMINI_HEDGE_AFTER_MS):
+        self.models = list(dict.fromkeys(models))  # Sem repetidos, na ordem de preferência
+        self.breakers = {model: CircuitBreaker(model) for model in self.models}
+        self.hedge_after = hedge_after_ms / 1000
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0  # Hedge com modelo disponível mas sem cota livre
+        self.rejected = 0
+
+    def _next_allowed(self, start: int) -> tuple[int, Optional[str]]:
+        for i in range(start, len(self.models)):
+            if self.breakers[self.models[i]].allow():
+                return i, self.models[i]
+        return len(self.models), None
+
+    async def _attempt(self, model: str, request_fn: Callable[[str], Awaitable]):
+        breaker = self.breakers[model]
+        started = time.monotonic()
+        try:
+            result = await request_fn(model)
+        except asyncio.CancelledError:
+            # Perdeu o hedge: não é falha, mas a lentidão conta no p95
+            if breaker.state == STATE_HALF_OPEN:
+                breaker.release()
+            else:
+                breaker.record(True, (time.monotonic() - started) * 1000)
+            raise
+        except Exception as e:
+            if is_model_failure(e):
+                breaker.record(False, (time.monotonic() - started) * 1000)
+            elif breaker.state == STATE_HALF_OPEN:
+                breaker.release()
+            raise
+        breaker.record(True, (time.monotonic() - started) * 1000)
+        return result
+
+    async def call(self, request_fn: Callable[[str], Awaitable], hedge_allowed: Callable[[], bool] = lambda: True,
+                   settle: Optional[Callable[[bool, object], None]] = None):
+        """
+        Executa request_fn(modelo) no primeiro modelo disponível da cadeia.
+        Falha de modelo (rede, timeout, 429, 5xx) passa para o próximo; outros erros sobem na hora.
+        hedge_allowed() só é consultado quando existe um modelo para o hedge (ele reserva cota).
+        settle(hedge, desfecho) é chamado uma vez por reserva: a da cadeia principal (hedge=False,
+        no fim da chamada) e a de cada hedge disparado (hedge=True). O desfecho é o resultado da
+        própria tentativa, a exceção dela ou um CancelledError (perdeu a corrida): o consumo de
+        uma tentativa nunca é cobrado na reserva da outra.
+        """
+        primary: Optional[asyncio.Task] = None
+        try:
+            index, model = self._next_allowed(0)
+            if model is None:
+                self.rejected += 1
+                raise CircuitOpenError("all models open")
+            if model != self.models[0]:
+                self.fallbacks += 1
+            last_error: Optional[BaseException] = None
+
+            while model is not None:
+                primary = asyncio.create_task(self._attempt(model, request_fn))
+                running = {primary: model}
+                hedge_index = index
+                try:
+                    if self.hedge_after > 0 and index + 1 < len(self.models):
+                        done, _ = await asyncio.wait(running, timeout=self.hedge_after)
+                        if not done:
+                            # Primeiro o breaker (não custa nada), depois a cota: sem modelo livre não reserva nada
+                            next_index, hedge_model = self._next_allowed(index + 1)
+                            if hedge_model is not None and not hedge_allowed():
+                                self.breakers[hedge_model].release()  # Devolve a vaga de teste, se era meio-aberto
+                                self.hedges_denied += 1
+                            elif hedge_model is not None:
+                                hedge_index = next_index
+                                self.hedges += 1
+                                logger.info("gemini_hedge_started", slow_model=model, hedge_model=hedge_model)
+                                hedge = asyncio.create_task(self._attempt(hedge_model, request_fn))
+                                if settle is not None:
+                                    hedge.add_done_callback(lambda task: settle(True, _outcome(task)))
+                                running[hedge] = hedge_model
+
+                    while running:
+                        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            winner = running.pop(task)
+                            error = task.exception()
+                            if error is None:
+                                if task is not primary:
+                                    self.hedges_won += 1
+                                return task.result()
+                            if not is_model_failure(error):
+                                raise error
+                            last_error = error
+                            logger.warning("gemini_model_failed", model=winner, error=str(error))
+                finally:
+                    for task in running:
+                        task.cancel()
+                    if running:
+                        await asyncio.gather(*running, return_exceptions=True)
+
+                index, model = self._next_allowed(hedge_index + 1)
+                if model is not None:
+                    self.fallbacks += 1
+            raise last_error or CircuitOpenError("all models open")
+        finally:
+            if settle is not None:
+                # A reserva principal cobre a cadeia (tentativas em sequência): vale a última tentativa
+                settle(False, _outcome(primary) if primary is not None else CircuitOpenError("all models open"))
+
+    async def stream(self, stream_fn: Callable[[str], AsyncIterator]) -> AsyncIterator:
+        """
+        Versão streaming: troca de modelo só se a falha vier antes do primeiro pedaço
+        (depois disso o usuário já recebeu parte da resposta). Sem hedging: duplicar
+        um stream custaria a geração inteira em dobro. A latência registrada é a do
+        primeiro pedaço.
+        """
+        last_error: Optional[BaseException] = None
+        index, model = self._next_allowed(0)
+        if model is None:
+            self.rejected += 1
+            raise CircuitOpenError("all models open")
+        while model is not None:
+            if model != self.models[0]:
+                self.fallbacks += 1
+            breaker = self.breakers[model]
+            started = time.monotonic()
+            first_chunk_ms = None
+            try:
+                async for chunk in stream_fn(model):
+                    if first_chunk_ms is None:
+                        first_chunk_ms = (time.monotonic() - started) * 1000
+                    yield chunk
+            except Exception as e:
+                if is_model_failure(e):
+                    breaker.record(False, (time.monotonic() - started) * 1000)
+                elif breaker.state == STATE_HALF_OPEN:
+                    breaker.release()
+                if first_chunk_ms is not None or not is_model_failure(e):
+                    raise
+                last_error = e
+                logger.warning("gemini_model_failed", model=model, error=str(e))
+                index, model = self._next_allowed(index + 1)
+                continue
+            except BaseException:
+                # Cancelado ou gerador fechado pelo consumidor: sem veredito sobre o modelo
+                if breaker.state == STATE_HALF_OPEN:
+                    breaker.release()
+                raise
+            breaker.record(True, first_chunk_ms if first_chunk_ms is not None else (time.monotonic() - started) * 1000)
+            return
+        raise last_error or CircuitOpenError("all models open")
+
+    def stats(self) -> dict:
+        return {
+            "models": {model: breaker.stats() for model, breaker in self.breakers.items()},
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "hedges_denied": self.hedges_denied,
+            "rejected": self.rejected,
+        }
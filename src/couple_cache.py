@@ -0,0 +1,177 @@
+"""
+Cache de Contexto do Casal
+Toda mensagem de grupo precisa do casal dono do group_jid e do nome do usuário.
+Esses dados quase nunca mudam, então ficam em memória (read-through com TTL) e
+são invalidados explicitamente pelas rotas que alteram casal ou usuário.
+"""
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlmodel import select
+
+from database import async_session_factory
+from logging_config import get_logger
+from mediation_writer import mediation_writer
+from models import Couple, User
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+COUPLE_CACHE_TTL_SECONDS = float(os.getenv("COUPLE_CACHE_TTL_SECONDS", "300"))
+# Grupos sem casal cadastrado (negative caching): TTL menor
+COUPLE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("COUPLE_CACHE_NEGATIVE_TTL_SECONDS", "60"))
+COUPLE_CACHE_MAX_ENTRIES = int(os.getenv("COUPLE_CACHE_MAX_ENTRIES", "10000"))
+
+
+async def load_couple_context(group_jid: str) -> Optional[dict]:
+    """Busca no banco o casal do grupo e o dono. Retorna None se o grupo não é de um casal."""
+    async with async_session_factory() as session:
+        couple = (await session.exec(select(Couple).where(Couple.group_jid == group_jid))).first()
+        if not couple:
+            return None
+        # Precisamos buscar o User dono do casal para saber o nome dele
+        user_owner = await session.get(User, couple.user_id)
+        if not user_owner:
+            return None
+        context = {
+            "couple_id": couple.id,
+            "user_id": user_owner.id,
+            "user_name": user_owner.full_name,
+            "user_phone": user_owner.phone_number,
+            "partner_name": couple.partner_name,
+            "partner_phone": couple.partner_phone,
+            "first_name": user_owner.full_name.split()[0],  # Pega só o primeiro nome
+            # Estado da mediação (cooldown)
+            "last_mediation_at": couple.last_mediation_at,
+            "mediation_count": couple.mediation_count,
+        }
+    # Mediações ainda não gravadas pelo write-behind valem sobre o que está no banco
+    pending = mediation_writer.pending_for(context["couple_id"])
+    if pending:
+        n, at = pending
+        context["mediation_count"] += n
+        context["last_mediation_at"] = max(filter(None, (context["last_mediation_at"], at)))
+    return context
+
+
+class CoupleContextCache:
+    """
+    Cache LRU+TTL de contextos resolvidos por group_jid, com negative caching.
+    Misses simultâneos do mesmo grupo compartilham uma única ida ao banco.
+    Uma invalidação durante essa ida ao banco vira uma geração nova: o resultado
+    da leitura antiga ainda é devolvido a quem esperava, mas não entra no cache.
+    """
+    def __init__(self, ttl_seconds: float = COUPLE_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds: float = COUPLE_CACHE_NEGATIVE_TTL_SECONDS,
+                 max_entries: int = COUPLE_CACHE_MAX_ENTRIES, loader=load_couple_context):
+        self.ttl = ttl_seconds
+        self.negative_ttl = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.loader = loader
+        # { group_jid: (expira_em, contexto ou None) }
+        self._entries: "OrderedDict[str, tuple[float, Optional[dict]]]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        # Relógio lógico: geração de cada leitura e da última invalidação por grupo (e por usuário, global)
+        self._clock = itertools.count(1)
+        self._generations: dict[str, int] = {}
+        self._user_generation = 0
+        self._loading = 0  # Leituras em andamento, inclusive as já invalidadas
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+
+    async def get(self, group_jid: str) -> Optional[dict]:
+        entry = self._entries.get(group_jid)
+        if entry is not None:
+            expires_at, context = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(group_jid)
+                self.hits += 1
+                return context
+            del self._entries[group_jid]
+
+        self.misses += 1
+        inflight = self._inflight.get(group_jid)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[group_jid] = future
+        generation = next(self._clock)
+        self._loading += 1
+        try:
+            context = await self.loader(group_jid)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Marca como lida para não poluir o log se ninguém estiver esperando
+            raise
+        finally:
+            self._loading -= 1
+            if self._inflight.get(group_jid) is future:  # Uma invalidação pode já ter tirado (e outra leitura entrado)
+                del self._inflight[group_jid]
+
+        future.set_result(context)
+        if generation > max(self._generations.get(group_jid, 0), self._user_generation):
+            self._store(group_jid, context)
+        else:
+            # Invalidado enquanto lia do banco: o resultado pode ser anterior à mudança (inclusive um None)
+            self.stale_loads += 1
+        if not self._loading:
+            self._generations.clear()  # Nenhuma leitura anterior às invalidações segue em andamento
+        return context
+
+    def _store(self, group_jid: str, context: Optional[dict]):
+        ttl = self.ttl if context is not None else self.negative_ttl
+        self._entries[group_jid] = (time.monotonic() + ttl, context)
+        self._entries.move_to_end(group_jid)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, group_jid: str) -> Optional[dict]:
+        """Contexto em cache sem ir ao banco (None se ausente, vencido ou negativo)."""
+        entry = self._entries.get(group_jid)
+        if entry is None or time.monotonic() >= entry[0]:
+            return None
+        return entry[1]
+
+    def invalidate(self, group_jid: Optional[str]):
+        if not group_jid:
+            return
+        if self._loading:
+            # Leitura em andamento pode ter visto o banco antes da mudança: nova geração, e quem
+            # chegar agora faz uma leitura nova em vez de esperar a antiga
+            self._generations[group_jid] = next(self._clock)
+            self._inflight.pop(group_jid, None)
+        if self._entries.pop(group_jid, None) is not None:
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """Remove todos os grupos do usuário (ex: mudou nome ou telefone)."""
+        stale = [jid for jid, (_, ctx) in self._entries.items() if ctx is not None and ctx["user_id"] == user_id]
+        for jid in stale:
+            del self._entries[jid]
+        self.invalidations += len(stale)
+        if self._loading:
+            # Ainda não se sabe de quem são os grupos em leitura: nenhuma delas entra no cache
+            self._user_generation = next(self._clock)
+            self._inflight.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "stale_loads": self.stale_loads,
+        }
+
+
+# Instância global
+couple_cache = CoupleContextCache()
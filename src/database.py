@@ -1,14 +1,106 @@
-from sqlmodel import SQLModel, create_engine, Session
+import asyncio
+import os
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from logging_config import get_logger
+from migrations import run_migrations
+
+logger = get_logger(__name__)
 
 SQLITE_FILE_NAME = "database.db"
-SQLITE_URL = f"sqlite:///{SQLITE_FILE_NAME}"
+# Único banco da aplicação (rotas, webhook, schema e migrações): aiosqlite por padrão;
+# para Postgres use postgresql+asyncpg://...
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{SQLITE_FILE_NAME}")
+
+# --- Perfil de Tuning do SQLite (padrões de produção) ---
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")        # Leitores não bloqueiam o escritor
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")       # Seguro com WAL, bem mais rápido que FULL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # Espera o lock em vez de "database is locked"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))    # Negativo = KiB (64 MiB)
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "10"))
+SQLITE_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("SQLITE_CHECKPOINT_INTERVAL_SECONDS", "300"))
+
+# Engine assíncrono usado pelas rotas e pelo webhook (não bloqueia o event loop)
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, pool_size=SQLITE_POOL_SIZE, max_overflow=SQLITE_MAX_OVERFLOW
+    )
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+# expire_on_commit=False: objetos continuam legíveis após o commit sem lazy-load (proibido em async)
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Aplica o perfil de tuning em cada conexão nova do pool."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA temp_store={SQLITE_TEMP_STORE}")
+    cursor.close()
+
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(SQLITE_URL, connect_args=connect_args)
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
-def get_session():
-    with Session(engine) as session:
+async def create_db_and_tables():
+    # Mesmo engine das rotas: o schema e as migrações vão para o banco que a aplicação usa de fato
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    # create_all não altera tabelas existentes: índices/colunas novos vêm das migrações
+    async with async_engine.connect() as conn:
+        await conn.run_sync(run_migrations)
+
+async def get_async_session():
+    async with async_session_factory() as session:
         yield session
+
+
+# --- Manutenção Periódica (checkpoint do WAL + PRAGMA optimize) ---
+_maintenance_task: Optional[asyncio.Task] = None
+
+async def run_sqlite_maintenance():
+    """Trunca o WAL (evita crescimento sem limite) e atualiza as estatísticas do planner."""
+    if async_engine.dialect.name != "sqlite":
+        return
+    async with async_engine.connect() as conn:
+        busy, wal_pages, checkpointed = (await conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))).one()
+        await conn.execute(text("PRAGMA optimize"))
+    logger.info("sqlite_maintenance_done", busy=busy, wal_pages=wal_pages, checkpointed=checkpointed)
+
+async def _maintenance_forever(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_sqlite_maintenance()
+        except Exception as e:
+            logger.error("sqlite_maintenance_failed", error=str(e))
+
+def start_db_maintenance(interval: float = SQLITE_CHECKPOINT_INTERVAL_SECONDS):
+    global _maintenance_task
+    if _maintenance_task is None and interval > 0:
+        _maintenance_task = asyncio.create_task(_maintenance_forever(interval))
+
+async def stop_db_maintenance():
+    global _maintenance_task
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        await asyncio.gather(_maintenance_task, return_exceptions=True)
+        _maintenance_task = None
+    # Último checkpoint no shutdown para deixar o .db autocontido
+    try:
+        await run_sqlite_maintenance()
+    except Exception as e:
+        logger.error("sqlite_maintenance_failed", error=str(e))
@@ -0,0 +1,124 @@
+"""
+Deduplicador de Mensagens
+A Evolution reenvia o mesmo messages.upsert em retries; guardamos os IDs vistos
+por uma janela de TTL e descartamos os repetidos.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+# "memory" (padrão, por processo) ou "sqlite" (compartilhado entre workers do uvicorn)
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory").lower()
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH") or os.getenv("JOB_QUEUE_DB", "queue.db")
+
+
+class SQLiteDedupBackend:
+    """
+    Conjunto de IDs compartilhado via SQLite, para quando rodamos mais de um worker do uvicorn.
+    Um único UPSERT decide atomicamente se o ID é novo (ou expirado) ou duplicado.
+    """
+    def __init__(self, path: str = DEDUP_SQLITE_PATH, ttl_seconds: float = DEDUP_TTL_SECONDS,
+                 purge_every: int = 1000):
+        self.ttl = ttl_seconds
+        self.purge_every = purge_every
+        self._calls = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_messages (msg_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_seen_messages_seen_at ON seen_messages (seen_at)")
+
+    def check_and_add(self, msg_id: str, now: float) -> bool:
+        """Retorna True se o ID já foi visto dentro do TTL; senão registra e retorna False."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO seen_messages (msg_id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT(msg_id) DO UPDATE SET seen_at = excluded.seen_at "
+                "WHERE seen_messages.seen_at <= ?",
+                (msg_id, now, now - self.ttl),
+            )
+            is_duplicate = cursor.rowcount == 0
+
+            # Limpeza periódica em vez de a cada chamada
+            self._calls += 1
+            if self._calls % self.purge_every == 0:
+                self._conn.execute("DELETE FROM seen_messages WHERE seen_at <= ?", (now - self.ttl,))
+        return is_duplicate
+
+
+class Deduplicator:
+    """
+    Conjunto de IDs com expiração preguiçosa.
+
+    Como o TTL é fixo, a ordem de inserção do OrderedDict é também a ordem de
+    expiração: basta remover do início enquanto a entrada mais antiga estiver
+    vencida, o que dá custo amortizado O(1) por mensagem. `max_entries` limita a
+    memória descartando os IDs mais antigos em rajadas muito grandes.
+    """
+    def __init__(self, ttl_seconds: float = DEDUP_TTL_SECONDS, max_entries: int = DEDUP_MAX_ENTRIES,
+                 backend: Optional[SQLiteDedupBackend] = None):
+        self.seen: "OrderedDict[str, float]" = OrderedDict()
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expire(self, now: float):
+        while self.seen:
+            if now - next(iter(self.seen.values())) < self.ttl:
+                break
+            self.seen.popitem(last=False)
+
+    def is_duplicate(self, msg_id: str) -> bool:
+        now = time.time()
+        self._expire(now)
+
+        if msg_id in self.seen:
+            self.hits += 1
+            return True
+
+        # Backend compartilhado: outro worker pode já ter visto este ID
+        is_duplicate = self.backend is not None and self.backend.check_and_add(msg_id, now)
+        if is_duplicate:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        self.seen[msg_id] = now
+        if len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+            self.evictions += 1
+        return is_duplicate
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.seen),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "backend": "sqlite" if self.backend is not None else "memory",
+        }
+
+
+def build_deduplicator() -> Deduplicator:
+    backend = SQLiteDedupBackend() if DEDUP_BACKEND == "sqlite" else None
+    return Deduplicator(backend=backend)
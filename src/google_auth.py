@@ -0,0 +1,156 @@
+"""
+Verificação Assíncrona do ID Token do Google
+As chaves públicas (JWKS) do Google ficam em memória pelo tempo que o
+Cache-Control manda e são renovadas em segundo plano antes de vencer. Com isso
+a verificação do token é local (assinatura + claims), sem rede no hot path.
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Optional
+
+from jose import jwt
+from jose.exceptions import JOSEError
+
+from http_clients import http_clients
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+# Usado quando a resposta não traz max-age
+GOOGLE_CERTS_DEFAULT_MAX_AGE_SECONDS = float(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE_SECONDS", "3600"))
+# Renova as chaves quando faltar esse tanto para vencer
+GOOGLE_CERTS_REFRESH_MARGIN_SECONDS = float(os.getenv("GOOGLE_CERTS_REFRESH_MARGIN_SECONDS", "300"))
+# Intervalo mínimo entre buscas forçadas por 'kid' desconhecido (evita martelar o Google com tokens falsos)
+GOOGLE_CERTS_MIN_REFETCH_SECONDS = float(os.getenv("GOOGLE_CERTS_MIN_REFETCH_SECONDS", "30"))
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def parse_max_age(cache_control: str) -> Optional[float]:
+    match = _MAX_AGE_RE.search(cache_control or "")
+    return float(match.group(1)) if match else None
+
+
+class GoogleIdTokenVerifier:
+    def __init__(self, certs_url: str = GOOGLE_CERTS_URL):
+        self.certs_url = certs_url
+        self._keys: dict[str, dict] = {}  # { kid: jwk }
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresher: Optional[asyncio.Task] = None
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.verified = 0
+        self.rejected = 0
+
+    async def _fetch(self):
+        response = await http_clients.get("google").get(self.certs_url)
+        response.raise_for_status()
+        keys = {key["kid"]: key for key in response.json()["keys"]}
+        max_age = parse_max_age(response.headers.get("cache-control", ""))
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + (max_age if max_age is not None else GOOGLE_CERTS_DEFAULT_MAX_AGE_SECONDS)
+        self.fetches += 1
+        logger.info("google_certs_fetched", keys=len(keys), max_age=max_age)
+
+    async def _refresh(self, force: bool = False):
+        # Uma busca por vez; quem chegar durante a busca reaproveita o resultado
+        async with self._lock:
+            if not force and time.monotonic() < self._expires_at:
+                return
+            if force and time.monotonic() - self._fetched_at < GOOGLE_CERTS_MIN_REFETCH_SECONDS:
+                return
+            try:
+                await self._fetch()
+            except Exception as e:
+                self.fetch_failures += 1
+                logger.error("google_certs_fetch_failed", error=str(e))
+                if not self._keys:
+                    raise
+                # Segue com as chaves antigas e tenta de novo em breve, sem travar cada login
+                self._expires_at = time.monotonic() + GOOGLE_CERTS_MIN_REFETCH_SECONDS
+
+    async def _get_key(self, kid: str) -> Optional[dict]:
+        if time.monotonic() >= self._expires_at:
+            await self._refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            # Google pode ter rotacionado as chaves antes do max-age
+            await self._refresh(force=True)
+            key = self._keys.get(kid)
+        return key
+
+    async def verify(self, token: str, audience: str) -> dict:
+        """Valida assinatura, audience, issuer e expiração. Levanta ValueError se o token for inválido."""
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except JOSEError as e:
+            self.rejected += 1
+            raise ValueError(f"Malformed Google token: {e}") from e
+        key = await self._get_key(kid) if kid else None
+        if key is None:
+            self.rejected += 1
+            raise ValueError("Google token signed with unknown key")
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=["RS256"], audience=audience, issuer=GOOGLE_ISSUERS,
+                options={"verify_at_hash": False},
+            )
+        except JOSEError as e:
+            self.rejected += 1
+            raise ValueError(f"Invalid Google token: {e}") from e
+        self.verified += 1
+        return claims
+
+    async def _refresh_forever(self):
+        while True:
+            delay = self._expires_at - time.monotonic() - GOOGLE_CERTS_REFRESH_MARGIN_SECONDS
+            # Após falha (chaves ainda válidas) tenta de novo em pouco tempo
+            await asyncio.sleep(max(delay, GOOGLE_CERTS_MIN_REFETCH_SECONDS))
+            try:
+                async with self._lock:
+                    await self._fetch()
+            except Exception as e:
+                self.fetch_failures += 1
+                logger.error("google_certs_fetch_failed", error=str(e))
+
+    def start(self):
+        """Agenda a renovação em segundo plano (o primeiro fetch acontece no primeiro login ou aqui)."""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._warm_and_refresh())
+
+    async def _warm_and_refresh(self):
+        try:
+            await self._refresh()
+        except Exception:
+            pass  # Já logado; o primeiro login tenta de novo
+        await self._refresh_forever()
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "expires_in_s": round(max(self._expires_at - time.monotonic(), 0.0), 1),
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "verified": self.verified,
+            "rejected": self.rejected,
+        }
+
+
+# Instância global
+google_verifier = GoogleIdTokenVerifier()
@@ -0,0 +1,134 @@
+"""
+Clientes HTTP Compartilhados
+Um httpx.AsyncClient por upstream (Gemini, Evolution), criado no lifespan e
+reaproveitado em todas as chamadas para não pagar TCP+TLS a cada mensagem.
+"""
+import os
+from typing import Optional
+
+import httpx
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import h2  # noqa: F401  (habilita HTTP/2 no httpx quando instalado)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _upstream_config(prefix: str, max_connections: int, max_keepalive: int, timeout: float) -> dict:
+    """Lê os limites de um upstream do ambiente (ex: GEMINI_HTTP_MAX_CONNECTIONS)."""
+    return {
+        "max_connections": int(os.getenv(f"{prefix}_HTTP_MAX_CONNECTIONS", str(max_connections))),
+        "max_keepalive_connections": int(os.getenv(f"{prefix}_HTTP_MAX_KEEPALIVE", str(max_keepalive))),
+        "keepalive_expiry": float(os.getenv(f"{prefix}_HTTP_KEEPALIVE_EXPIRY", "30")),
+        "timeout": float(os.getenv(f"{prefix}_HTTP_TIMEOUT", str(timeout))),
+        "connect_timeout": float(os.getenv(f"{prefix}_HTTP_CONNECT_TIMEOUT", "5")),
+        "http2": os.getenv(f"{prefix}_HTTP2", "true").lower() == "true" and HTTP2_AVAILABLE,
+    }
+
+
+# --- Configurações por Upstream ---
+UPSTREAMS = {
+    "gemini": _upstream_config("GEMINI", max_connections=20, max_keepalive=10, timeout=30.0),
+    "evolution": _upstream_config("EVOLUTION", max_connections=20, max_keepalive=10, timeout=30.0),
+    # Só busca as chaves públicas do login com Google (algumas vezes por hora)
+    "google": _upstream_config("GOOGLE", max_connections=2, max_keepalive=1, timeout=10.0),
+}
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Transport do httpx que conta requisições e esperas por conexão livre no pool."""
+    def __init__(self, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections = max_connections
+        self.requests = 0
+        self.in_flight = 0
+        self.waits = 0  # Requisições que chegaram com o pool inteiro ocupado
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.in_flight >= self.max_connections:
+            self.waits += 1
+        self.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+    def _connection_counts(self) -> tuple[Optional[int], Optional[int]]:
+        """
+        (abertas, em uso) lidas do pool do httpcore. O `_pool` é interno do httpx: se uma
+        versão nova mudar isso, as métricas de conexão viram None em vez de derrubar o /metrics.
+        """
+        try:
+            connections = list(getattr(getattr(self, "_pool", None), "connections", None))
+            return len(connections), sum(1 for conn in connections if not conn.is_idle())
+        except (TypeError, AttributeError):
+            return None, None
+
+    def stats(self) -> dict:
+        connections_open, connections_in_use = self._connection_counts()
+        return {
+            "connections_open": connections_open,
+            "connections_in_use": connections_in_use,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "pool_waits": self.waits,
+        }
+
+
+class HTTPClientRegistry:
+    """Registro de clientes por upstream. Cria sob demanda se usado fora do lifespan (scripts)."""
+    def __init__(self, upstreams: dict = UPSTREAMS):
+        self.upstreams = upstreams
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._transports: dict[str, InstrumentedTransport] = {}
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        config = self.upstreams[name]
+        transport = InstrumentedTransport(
+            max_connections=config["max_connections"],
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_keepalive_connections"],
+                keepalive_expiry=config["keepalive_expiry"],
+            ),
+            http2=config["http2"],
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+        )
+        self._transports[name] = transport
+        self._clients[name] = client
+        logger.info("http_client_created", upstream=name, http2=config["http2"],
+                    max_connections=config["max_connections"])
+        return client
+
+    def start(self):
+        for name in self.upstreams:
+            if name not in self._clients:
+                self._build(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._build(name)
+        return client
+
+    async def aclose(self):
+        for name, client in list(self._clients.items()):
+            await client.aclose()
+        self._clients.clear()
+        self._transports.clear()
+
+    def stats(self) -> dict:
+        return {name: transport.stats() for name, transport in self._transports.items()}
+
+
+# Instância global, iniciada/fechada no lifespan do FastAPI
+http_clients = HTTPClientRegistry()
@@ -0,0 +1,327 @@
+"""
+Fila Persistente de Ingestão
+Guarda os payloads do webhook em SQLite (WAL) para que nenhuma mensagem se perca
+em restart/crash. Um pool de workers no próprio processo drena a fila com
+semântica de ack + visibility timeout.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Awaitable, Callable, Iterable, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações da Fila ---
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "queue.db")  # Fica ao lado do database.db
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_LANES = int(os.getenv("JOB_LANES", "8"))  # Lanes paralelas (chats diferentes)
+JOB_LANE_DEPTH = int(os.getenv("JOB_LANE_DEPTH", "100"))  # Jobs em memória por lane
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", "10"))
+
+# Estados possíveis de um job
+STATUS_READY = "ready"        # Aguardando um worker
+STATUS_INFLIGHT = "inflight"  # Reservado por um worker (invisível até visible_at)
+STATUS_DEAD = "dead"          # Estourou JOB_MAX_ATTEMPTS, fica para inspeção manual
+
+
+def lane_key(key: str) -> int:
+    # crc32 é estável entre processos (hash() do Python é randomizado)
+    return zlib.crc32((key or "").encode("utf-8"))
+
+
+class JobQueue:
+    """
+    Fila de jobs em uma tabela SQLite com WAL.
+
+    - enqueue(): grava o payload bruto (um INSERT, sem esperar processamento)
+    - claim(): reserva o próximo job visível e o esconde por `visibility_timeout`
+    - ack(): remove o job concluído
+    - nack(): devolve o job para a fila com backoff (ou marca como dead)
+    - recover(): no startup, devolve para a fila jobs que estavam em voo quando o processo morreu
+    """
+    def __init__(self, path: str = JOB_QUEUE_DB, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ready',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT,
+                lane_key INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Bancos criados antes da coluna lane_key (jobs antigos ficam na lane 0)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "lane_key" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lane_key INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_visible ON jobs (status, visible_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_lane_key ON jobs (lane_key, id)")
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def bind_loop(self):
+        """Cria o Event usado para acordar os workers (precisa rodar dentro do event loop)."""
+        self._wakeup = asyncio.Event()
+
+    def enqueue(self, payload: dict, key: str = "") -> int:
+        """Grava o job. `key` (ex: remoteJid) define a lane: jobs da mesma chave são processados em ordem."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (payload, status, attempts, visible_at, created_at, lane_key) VALUES (?, ?, 0, ?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), STATUS_READY, now, now, lane_key(key)),
+            )
+            job_id = cursor.lastrowid
+        self.wake()
+        return job_id
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def claim(self, lane_count: int = 1, skip_lanes: Iterable[int] = ()) -> Optional[tuple[int, dict, int, int]]:
+        """
+        Reserva o job visível mais antigo, ignorando os das lanes em `skip_lanes`
+        (lane = lane_key % lane_count). Retorna (id, payload, tentativa, lane) ou None.
+        Só sai o job mais antigo não concluído de cada chave: enquanto um job anterior
+        do mesmo chat estiver em processamento ou em backoff (nack), os seguintes esperam.
+        """
+        now = time.time()
+        skip_lanes = sorted(skip_lanes)
+        lane_filter = f" AND lane_key % ? NOT IN ({','.join('?' * len(skip_lanes))})" if skip_lanes else ""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload, attempts, lane_key FROM jobs "
+                    f"WHERE status IN (?, ?) AND visible_at <= ?{lane_filter} "
+                    "AND NOT EXISTS (SELECT 1 FROM jobs AS earlier WHERE earlier.lane_key = jobs.lane_key "
+                    "AND earlier.id < jobs.id AND earlier.status IN (?, ?)) "
+                    "ORDER BY id LIMIT 1",
+                    (STATUS_READY, STATUS_INFLIGHT, now, *((lane_count, *skip_lanes) if skip_lanes else ()),
+                     STATUS_READY, STATUS_INFLIGHT),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, payload, attempts, key = row
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = ?, visible_at = ? WHERE id = ?",
+                    (STATUS_INFLIGHT, attempts + 1, now + self.visibility_timeout, job_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id, json.loads(payload), attempts + 1, key % lane_count
+
+    def touch(self, job_id: int):
+        """Renova o visibility timeout de um job em processamento."""
+        self.touch_many([job_id])
+
+    def touch_many(self, job_ids: Iterable[int]):
+        """Renova o visibility timeout de vários jobs reservados (em processamento ou esperando na lane)."""
+        visible_at = time.time() + self.visibility_timeout
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET visible_at = ? WHERE id = ? AND status = ?",
+                [(visible_at, job_id, STATUS_INFLIGHT) for job_id in job_ids],
+            )
+
+    def ack(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def nack(self, job_id: int, attempt: int, error: str = ""):
+        """Devolve o job para a fila com backoff exponencial, ou marca como dead."""
+        with self._lock:
+            if attempt >= self.max_attempts:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, last_error = ? WHERE id = ?",
+                    (STATUS_DEAD, error[:500], job_id),
+                )
+                logger.error("job_dead_lettered", job_id=job_id, attempts=attempt, error=error)
+                return
+            retry_at = time.time() + min(2 ** attempt, 60)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, visible_at = ?, last_error = ? WHERE id = ?",
+                (STATUS_READY, retry_at, error[:500], job_id),
+            )
+
+    def recover(self) -> int:
+        """Torna visíveis imediatamente os jobs que ficaram 'inflight' de um processo anterior."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, visible_at = ? WHERE status = ?",
+                (STATUS_READY, time.time(), STATUS_INFLIGHT),
+            )
+            recovered = cursor.rowcount
+        if recovered:
+            logger.warning("job_queue_recovered_inflight", count=recovered)
+        return recovered
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {STATUS_READY: 0, STATUS_INFLIGHT: 0, STATUS_DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    async def wait_for_work(self, timeout: float):
+        """Dorme até um enqueue acordar os workers ou o timeout de polling estourar."""
+        if self._wakeup is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueueWorkerPool:
+    """
+    Pool de workers asyncio que drena a JobQueue em "lanes" ordenadas.
+
+    Um dispatcher reserva os jobs em ordem de chegada e os distribui pela chave
+    gravada no enqueue (remoteJid) entre `lanes` filas asyncio limitadas a
+    `lane_depth` itens. Cada lane tem um único consumidor, então mensagens do
+    mesmo chat são processadas estritamente em ordem, enquanto chats diferentes
+    rodam em paralelo. O claim() só entrega um job por chat de cada vez (o próximo
+    sai depois do ack, ou depois do backoff do nack), então uma falha transitória
+    não deixa as mensagens seguintes passarem na frente. Uma lane cheia não trava
+    as outras: o claim() pula os jobs dela, que esperam em disco até a lane andar.
+    Jobs reservados (na lane ou em processamento) têm o visibility timeout
+    renovado periodicamente, para o claim() nunca pegá-los uma segunda vez.
+    """
+    def __init__(self, queue: JobQueue, handler: Callable[[dict], Awaitable[None]],
+                 lanes: int = JOB_LANES, lane_depth: int = JOB_LANE_DEPTH,
+                 poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.queue = queue
+        self.handler = handler
+        self.lane_count = max(1, lanes)
+        self.lane_depth = max(1, lane_depth)
+        self.poll_interval = poll_interval
+        self._lanes: list[asyncio.Queue] = []
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._lane_tasks: list[asyncio.Task] = []
+        self._held: set[int] = set()  # Jobs reservados por este processo e ainda não confirmados
+        self._busy = 0
+        self._stopping = False
+
+    def start(self):
+        self.queue.bind_loop()
+        self.queue.recover()
+        self._stopping = False
+        self._lanes = [asyncio.Queue(maxsize=self.lane_depth) for _ in range(self.lane_count)]
+        self._lane_tasks = [asyncio.create_task(self._lane_worker(lane)) for lane in self._lanes]
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        logger.info("job_workers_started", lanes=self.lane_count, lane_depth=self.lane_depth, db=self.queue.path)
+
+    async def _dispatch(self):
+        touch_every = self.queue.visibility_timeout / 3
+        last_touch = time.monotonic()
+        while not self._stopping:
+            if self._held and time.monotonic() - last_touch >= touch_every:
+                self.queue.touch_many(list(self._held))
+                last_touch = time.monotonic()
+            # Lanes cheias ficam de fora do claim (o excedente delas espera em disco, sem travar as outras)
+            saturated = [i for i, lane in enumerate(self._lanes) if lane.full()]
+            job = self.queue.claim(self.lane_count, saturated) if len(saturated) < self.lane_count else None
+            if job is None:
+                await self.queue.wait_for_work(min(self.poll_interval, touch_every))
+                continue
+            job_id, payload, attempt, lane = job
+            if job_id in self._held:
+                continue  # Já está numa lane ou em processamento
+            self._held.add(job_id)
+            self._lanes[lane].put_nowait((job_id, payload, attempt))
+
+    async def _lane_worker(self, lane: asyncio.Queue):
+        while True:
+            was_full = lane.full()
+            job = await lane.get()
+            if job is None:  # Sentinela de shutdown
+                return
+            if was_full:
+                self.queue.wake()  # A lane voltou a ter vaga: o dispatcher pode reservar jobs dela
+            job_id, payload, attempt = job
+            self._busy += 1
+            try:
+                # O job pode ter esperado na lane; renova a visibilidade antes de processar
+                self.queue.touch(job_id)
+                await self.handler(payload)
+            except asyncio.CancelledError:
+                # Shutdown no meio do job: fica 'inflight' e o recover() do próximo startup reprocessa
+                raise
+            except Exception as e:
+                logger.error("job_failed", job_id=job_id, attempt=attempt, error=str(e), exc_info=True)
+                self.queue.nack(job_id, attempt, str(e))
+            else:
+                self.queue.ack(job_id)
+            finally:
+                self._held.discard(job_id)
+                self._busy -= 1
+                self.queue.wake()  # O próximo job do mesmo chat já pode ser reservado
+
+    async def stop(self, timeout: float = JOB_SHUTDOWN_GRACE_SECONDS):
+        """Para de reservar jobs novos e espera as lanes esvaziarem até `timeout` segundos."""
+        self._stopping = True
+        self.queue.wake()
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        for lane in self._lanes:
+            # Jobs ainda na lane continuam 'inflight' no disco; descarta para não atrasar o shutdown
+            while not lane.empty():
+                job = lane.get_nowait()
+                if job is not None:
+                    self._held.discard(job[0])
+            lane.put_nowait(None)
+        done, pending = await asyncio.wait(self._lane_tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("job_workers_cancelled_inflight", count=len(pending))
+        self._dispatcher = None
+        self._lane_tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "lanes": self.lane_count,
+            "lane_depth": self.lane_depth,
+            "busy": self._busy,
+            "held": len(self._held),
+            "lane_backlog": [lane.qsize() for lane in self._lanes],
+            **self.queue.stats(),
+        }
+
+
+# Instância global (mesmo padrão do conversation_manager)
+job_queue = JobQueue()
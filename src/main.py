@@ -1,8 +1,10 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, BackgroundTasks, Depends, HTTPException, status
+from fastapi import FastAPI, Request, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware  # Import CORS
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -10,13 +12,41 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Imports Locais
-from services import process_message, send_text, send_text_human, create_whatsapp_group, update_group_picture
+from services import (
+    process_message,
+    process_message_stream,
+    send_text,
+    create_whatsapp_group,
+    update_group_picture,
+    GEMINI_STREAMING,
+    gemini_router,
+)
 from logging_config import setup_logging, get_logger
-from database import create_db_and_tables, get_session, engine
+from database import (
+    create_db_and_tables,
+    get_async_session,
+    async_engine,
+    start_db_maintenance,
+    stop_db_maintenance,
+)
+from job_queue import job_queue, QueueWorkerPool
+from dedup import build_deduplicator
+from http_clients import http_clients
+from safety import safety_pipeline
+from memory import conversation_manager
+from couple_cache import couple_cache
+from mediation_writer import mediation_writer
+from auth_cache import auth_cache, subject_is_user_id
+from google_auth import google_verifier, GOOGLE_CLIENT_ID
+from outbound import outbound_scheduler, schedule_text_human, schedule_stream_human
+from outbox import outbox
+from prompt_budget import prompt_usage
+from response_cache import response_cache
+from semantic_cache import semantic_cache
+from rate_limiter import gemini_limiter, PRIORITY_CHAT, PRIORITY_AUTO_MEDIATION, PRIORITY_MANUAL_MEDIATION
 from models import User, UserCreate, UserUpdate, Couple, CoupleCreate, CoupleRead
 from auth import (
-    get_password_hash, 
-    verify_password, 
+    password_hasher,
     create_access_token, 
     ACCESS_TOKEN_EXPIRE_MINUTES,
     SECRET_KEY, ALGORITHM
@@ -24,6 +54,7 @@ from auth import (
 import time
 import asyncio
 import os
+from typing import Optional
 from jose import JWTError, jwt
 from mediation import (
     analyze_conflict_level,
@@ -36,33 +67,40 @@ from mediation import (
 setup_logging()
 logger = get_logger(__name__)
 
-# --- Deduplicador (Mantido) ---
-class Deduplicator:
-    def __init__(self, ttl_seconds=600):
-        self.seen = {}
-        self.ttl = ttl_seconds
-
-    def is_duplicate(self, msg_id: str) -> bool:
-        now = time.time()
-        self.seen = {k: v for k, v in self.seen.items() if now - v < self.ttl}
-        if msg_id in self.seen:
-            return True
-        self.seen[msg_id] = now
-        return False
-
-deduplicator = Deduplicator()
-active_tasks = set()
+# --- Deduplicador ---
+deduplicator = build_deduplicator()
 
 # --- Configuração de Ciclo de Vida ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("startup_initiated")
-    create_db_and_tables() # Cria tabelas do SQLite
+    await create_db_and_tables()  # Cria as tabelas e aplica as migrações no banco de ASYNC_DATABASE_URL
+    start_db_maintenance()  # Checkpoint periódico do WAL + PRAGMA optimize
+    http_clients.start()  # Pools keep-alive para Gemini, Evolution e Google
+    if GOOGLE_CLIENT_ID:
+        google_verifier.start()  # Busca e renova as chaves do login com Google
+    conversation_manager.start_sweeper()  # Expira históricos inativos em segundo plano
+    conversation_manager.start_flusher()  # Write-behind do histórico (se MEMORY_BACKEND != memory)
+    mediation_writer.start()  # Write-behind dos contadores de mediação
+    outbound_scheduler.start()  # Envio dos balões no horário planejado (retoma o que ficou no outbox)
+    # Workers da fila persistente (recupera jobs que ficaram em voo no último crash)
+    # Lanes por remoteJid: mesmo chat em ordem, chats diferentes em paralelo
+    worker_pool = QueueWorkerPool(job_queue, process_webhook_task)
+    worker_pool.start()
+    app.state.worker_pool = worker_pool
     yield
-    logger.info("shutdown_initiated", active_tasks=len(active_tasks))
-    if active_tasks:
-        logger.info("waiting_for_background_tasks")
-        done, pending = await asyncio.wait(active_tasks, timeout=2.0)
+    logger.info("shutdown_initiated", **worker_pool.stats())
+    # Jobs não concluídos ficam no disco e são retomados no próximo startup
+    await worker_pool.stop()
+    await outbound_scheduler.stop()  # Termina os envios em andamento; o resto fica pendente no outbox
+    await conversation_manager.stop_sweeper()
+    await conversation_manager.stop_flusher()  # Grava o histórico pendente antes de sair
+    await mediation_writer.stop()  # Grava as mediações pendentes antes de fechar o engine
+    await stop_db_maintenance()
+    await async_engine.dispose()
+    await google_verifier.stop()
+    await http_clients.aclose()
+    password_hasher.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -96,38 +134,51 @@ app.add_middleware(
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token") # URL atualizada para /api
 
 # --- Dependências de Autenticação ---
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        payload = auth_cache.decode(token)
+        subject: str = payload.get("sub")
+        # Token de reset de senha não serve como token de acesso
+        if subject is None or payload.get("type") == "reset":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
-    statement = select(User).where(User.email == email)
-    user = session.exec(statement).first()
+
+    cached = auth_cache.get_user(subject)
+    if cached is not None:
+        # Instância nova por request, anexada à sessão como se tivesse vindo do banco (sem SELECT)
+        user = User(**cached)
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+
+    if subject_is_user_id(subject):
+        user = await session.get(User, int(subject))
+    else:
+        # Tokens antigos (subject = email)
+        user = (await session.exec(select(User).where(User.email == subject))).first()
     if user is None:
         raise credentials_exception
+    auth_cache.put_user(subject, user.model_dump())
     return user
 
 # --- Rotas de Autenticação (Prefixo /api) ---
 
 @app.post("/api/auth/signup", response_model=dict)
-async def signup(user: UserCreate, session: Session = Depends(get_session)):
+async def signup(user: UserCreate, session: AsyncSession = Depends(get_async_session)):
     # Check existing
     statement = select(User).where(User.email == user.email)
-    existing_user = session.exec(statement).first()
+    existing_user = (await session.exec(statement)).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
-    hashed_pwd = get_password_hash(user.password)
+    hashed_pwd = await password_hasher.hash(user.password)
     db_user = User(
         email=user.email, 
         full_name=user.full_name, 
@@ -135,8 +186,8 @@ async def signup(user: UserCreate, session: Session = Depends(get_session)):
         hashed_password=hashed_pwd
     )
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await session.commit()
+    await session.refresh(db_user)
     return {"status": "created", "user_id": db_user.id}
 
 from pydantic import BaseModel
@@ -152,22 +203,15 @@ class GoogleRequest(BaseModel):
     token: str
 
 @app.post("/api/auth/google")
-async def google_login(request: GoogleRequest, session: Session = Depends(get_session)):
+async def google_login(request: GoogleRequest, session: AsyncSession = Depends(get_async_session)):
     import traceback
-    from google.oauth2 import id_token
-    from google.auth.transport import requests as google_requests
 
-    GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     if not GOOGLE_CLIENT_ID:
         raise HTTPException(status_code=500, detail="Server config error: GOOGLE_CLIENT_ID missing")
 
     try:
-        # Verify the token
-        idinfo = id_token.verify_oauth2_token(
-            request.token, 
-            google_requests.Request(), 
-            GOOGLE_CLIENT_ID
-        )
+        # Verify the token (chaves do Google em cache, sem rede no caminho normal)
+        idinfo = await google_verifier.verify(request.token, GOOGLE_CLIENT_ID)
 
         email = idinfo.get("email")
         name = idinfo.get("name")
@@ -177,12 +221,12 @@ async def google_login(request: GoogleRequest, session: Session = Depends(get_se
             raise HTTPException(status_code=400, detail="Google token missing email")
 
         # Check existing user
-        user = session.exec(select(User).where(User.email == email)).first()
+        user = (await session.exec(select(User).where(User.email == email))).first()
         
         if not user:
             # Create new user
             random_pwd = os.urandom(16).hex()
-            hashed_pwd = get_password_hash(random_pwd)
+            hashed_pwd = await password_hasher.hash(random_pwd)
             
             user = User(
                 email=email,
@@ -191,13 +235,13 @@ async def google_login(request: GoogleRequest, session: Session = Depends(get_se
                 hashed_password=hashed_pwd
             )
             session.add(user)
-            session.commit()
-            session.refresh(user)
+            await session.commit()
+            await session.refresh(user)
 
         # Login success -> Generate Token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data={"sub": str(user.id)}, expires_delta=access_token_expires
         )
         return {"access_token": access_token, "token_type": "bearer"}
 
@@ -212,21 +256,21 @@ async def google_login(request: GoogleRequest, session: Session = Depends(get_se
         raise HTTPException(status_code=500, detail=f"Internal Google Login Error: {str(e)}")
 
 @app.post("/api/auth/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
     statement = select(User).where(User.email == form_data.username)
-    user = session.exec(statement).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = (await session.exec(statement)).first()
+    if not user or not await password_hasher.verify(form_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": str(user.id)}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/api/auth/forgot-password")
-async def forgot_password(request: PasswordResetRequest, session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.email == request.email)).first()
+async def forgot_password(request: PasswordResetRequest, session: AsyncSession = Depends(get_async_session)):
+    user = (await session.exec(select(User).where(User.email == request.email))).first()
     if not user:
         # Padrão de segurança: não revelar se existe, mas para debug/MVP vamos retornar erro se não achar
         raise HTTPException(status_code=404, detail="Email não encontrado.")
@@ -241,7 +285,7 @@ async def forgot_password(request: PasswordResetRequest, session: Session = Depe
     return {"message": "Token gerado! Verifique os logs do servidor.", "debug_token": reset_token}
 
 @app.post("/api/auth/reset-password")
-async def reset_password(request: PasswordResetConfirm, session: Session = Depends(get_session)):
+async def reset_password(request: PasswordResetConfirm, session: AsyncSession = Depends(get_async_session)):
     try:
         payload = jwt.decode(request.token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -251,21 +295,22 @@ async def reset_password(request: PasswordResetConfirm, session: Session = Depen
     except JWTError:
         raise HTTPException(status_code=400, detail="Token inválido ou expirado")
         
-    user = session.exec(select(User).where(User.email == email)).first()
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
         
-    user.hashed_password = get_password_hash(request.new_password)
+    user.hashed_password = await password_hasher.hash(request.new_password)
     session.add(user)
-    session.commit()
+    await session.commit()
+    auth_cache.invalidate_user(user.id)
     
     return {"message": "Senha alterada com sucesso!"}
 
 @app.get("/api/me")
-def get_my_info(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+async def get_my_info(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     """Retorna dados do usuário logado e do seu casal (se houver)."""
     statement = select(Couple).where(Couple.user_id == current_user.id)
-    couple = session.exec(statement).first()
+    couple = (await session.exec(statement)).first()
     
     return {
         "user": {
@@ -278,10 +323,10 @@ def get_my_info(current_user: User = Depends(get_current_user), session: Session
     }
 
 @app.put("/api/me")
-def update_my_info(
+async def update_my_info(
     user_update: UserUpdate,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Atualiza dados do perfil do usuário."""
     if user_update.full_name:
@@ -289,18 +334,20 @@ def update_my_info(
     if user_update.email:
         # Check if email is taken by another user
         if user_update.email != current_user.email:
-            existing_user = session.exec(select(User).where(User.email == user_update.email)).first()
+            existing_user = (await session.exec(select(User).where(User.email == user_update.email))).first()
             if existing_user:
                 raise HTTPException(status_code=400, detail="Email already registered")
         current_user.email = user_update.email
     if user_update.phone_number:
         current_user.phone_number = user_update.phone_number
     if user_update.password:
-        current_user.hashed_password = get_password_hash(user_update.password)
+        current_user.hashed_password = await password_hasher.hash(user_update.password)
         
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
+    await session.commit()
+    await session.refresh(current_user)
+    couple_cache.invalidate_user(current_user.id)  # Nome/telefone aparecem no contexto do casal
+    auth_cache.invalidate_user(current_user.id)
     return {"status": "updated", "user": {
         "id": current_user.id,
         "full_name": current_user.full_name,
@@ -314,7 +361,7 @@ def update_my_info(
 async def create_couple(
     couple_data: CoupleCreate, 
     current_user: User = Depends(get_current_user), 
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     Cria o registro do casal e INICIA A CRIAÇÃO DO GRUPO NO WHATSAPP.
@@ -405,8 +452,9 @@ async def create_couple(
         status="active"
     )
     session.add(db_couple)
-    session.commit()
-    session.refresh(db_couple)
+    await session.commit()
+    await session.refresh(db_couple)
+    couple_cache.invalidate(group_jid)  # Descarta um eventual cache negativo do grupo
     
     # TODO: Mandar mensagem de boas-vindas no grupo recém-criado
     try:
@@ -420,13 +468,13 @@ async def create_couple(
     return db_couple
 
 @app.delete("/api/couples/me")
-def delete_my_couple(
+async def delete_my_couple(
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Remove a conexão de casal do usuário atual."""
     statement = select(Couple).where(Couple.user_id == current_user.id)
-    couple = session.exec(statement).first()
+    couple = (await session.exec(statement)).first()
     
     if not couple:
         raise HTTPException(status_code=404, detail="Nenhum grupo ativo encontrado para este usuário.")
@@ -434,8 +482,9 @@ def delete_my_couple(
     # Aqui poderíamos tentar sair do grupo no WhatsApp via API também, se desejado
     # await leave_whatsapp_group(couple.group_jid) 
 
-    session.delete(couple)
-    session.commit()
+    await session.delete(couple)
+    await session.commit()
+    couple_cache.invalidate(couple.group_jid)
     
     return {"status": "deleted", "message": "Grupo desconectado com sucesso."}
 
@@ -449,30 +498,80 @@ from datetime import datetime
 last_bot_reply_time: dict[str, datetime] = {}
 BOT_ACTIVE_WINDOW_SECONDS = 120  # Janela de 2 minutos para conversa contínua
 
+def _malformed_payload_reason(data) -> Optional[str]:
+    """Confere uma vez o formato do payload da Evolution; retorna o problema encontrado ou None."""
+    if not isinstance(data, dict):
+        return "payload is not an object"
+    key = data.get("key")
+    if not isinstance(key, dict):
+        return "key is not an object"
+    if not isinstance(key.get("remoteJid"), str) or not key["remoteJid"]:
+        return "key.remoteJid is missing"
+    if not isinstance(key.get("id"), (str, type(None))):
+        return "key.id is not a string"
+    if not isinstance(data.get("pushName", ""), (str, type(None))):
+        return "pushName is not a string"
+    message = data.get("message")
+    if message is None:
+        return None
+    if not isinstance(message, dict):
+        return "message is not an object"
+    if not isinstance(message.get("conversation"), (str, type(None))):
+        return "message.conversation is not a string"
+    extended = message.get("extendedTextMessage")
+    if extended is None:
+        return None
+    if not isinstance(extended, dict):
+        return "message.extendedTextMessage is not an object"
+    if not isinstance(extended.get("text"), (str, type(None))):
+        return "message.extendedTextMessage.text is not a string"
+    context_info = extended.get("contextInfo")
+    if not isinstance(context_info, (dict, type(None))):
+        return "message.extendedTextMessage.contextInfo is not an object"
+    if context_info and not isinstance(context_info.get("mentionedJid") or [], list):
+        return "message.extendedTextMessage.contextInfo.mentionedJid is not a list"
+    return None
+
 async def process_webhook_task(data: dict):
     # Logica original do webhook mantida para compatibilidade
     # Pode ser expandida para checar se a mensagem vem de um grupo cadastrado no banco
-    task = asyncio.current_task()
-    active_tasks.add(task)
+    reason = _malformed_payload_reason(data)
+    if reason:
+        # Payload malformado: tentar de novo não muda nada, então o job é confirmado (ack)
+        logger.error("task_failed_malformed_payload", reason=reason)
+        return
+
     try:
         message_type = data.get("messageType")
-        push_name = data.get("pushName", "Usuário")
-        remote_jid = data.get("key", {}).get("remoteJid") # Pode ser User ou Grupo
+        push_name = data.get("pushName") or "Usuário"
+        remote_jid = data["key"]["remoteJid"] # Pode ser User ou Grupo
+        message_id = data["key"].get("id")
+        message = data.get("message") or {}
+        extended = message.get("extendedTextMessage") or {}
 
         log = logger.bind(remote_jid=remote_jid, push_name=push_name, message_type=message_type)
 
         user_text = None
         if message_type == "conversation":
-            user_text = data.get("message", {}).get("conversation")
+            user_text = message.get("conversation")
         elif message_type == "extendedTextMessage":
-            user_text = data.get("message", {}).get("extendedTextMessage", {}).get("text")
+            user_text = extended.get("text")
 
         if user_text:
+            # Job reprocessado (crash/restart): se a resposta inteira já foi planejada, o outbox entrega,
+            # sem gerar de novo. Se só parte foi (stream interrompido), gera de novo e planeja o que falta
+            if message_id:
+                planned, complete = outbox.progress(message_id)
+                if complete:
+                    log.info("reply_already_in_outbox", message_id=message_id)
+                    return
+                if planned:
+                    log.warning("reply_incomplete_in_outbox", message_id=message_id, planned_balloons=planned)
+
             log.info("processing_message", text_length=len(user_text))
 
             # --- COMANDO DE ADMINISTRAÇÃO ---
             if user_text.strip().lower() == "/reset":
-                from memory import conversation_manager
                 conversation_manager.clear_history(remote_jid)
                 await send_text(remote_jid, "🧠 Memória reiniciada! Esqueci tudo o que conversamos. Vamos começar do zero? ✨")
                 return
@@ -488,8 +587,8 @@ async def process_webhook_task(data: dict):
                 is_text_triggered = any(t in user_text_lower for t in triggers)
                 
                 # 2. Verifica Menções (@)
-                context_info = data.get("message", {}).get("extendedTextMessage", {}).get("contextInfo", {})
-                mentioned_jids = context_info.get("mentionedJid", [])
+                context_info = extended.get("contextInfo") or {}
+                mentioned_jids = context_info.get("mentionedJid") or []
                 is_mentioned = len(mentioned_jids) > 0
                 
                 # 3. Conversa Ativa (Janela de Tempo)
@@ -506,30 +605,19 @@ async def process_webhook_task(data: dict):
                     should_respond = False
                     log.info("group_message_ignored_no_trigger_or_active_window")
 
-            # Busca contexto do casal no banco se for grupo
+            # Busca contexto do casal se for grupo (cache read-through, banco só no miss)
             couple_context = None
-            couple_db_record = None
             if is_group:
-                with Session(engine) as session:
-                    couple = session.exec(select(Couple).where(Couple.group_jid == remote_jid)).first()
-                    if couple:
-                        couple_db_record = couple  # Guardar referência para atualizar depois
-                        # Precisamos buscar o User dono do casal para saber o nome dele
-                        user_owner = session.get(User, couple.user_id)
-                        if user_owner:
-                            couple_context = {
-                                "user_name": user_owner.full_name,
-                                "user_phone": user_owner.phone_number,
-                                "partner_name": couple.partner_name,
-                                "partner_phone": couple.partner_phone
-                            }
-                            # CORREÇÃO CRÍTICA: Sobrescreve o apelido do WhatsApp pelo Nome Real
-                            push_name = user_owner.full_name.split()[0]  # Pega só o primeiro nome
+                couple_context = await couple_cache.get(remote_jid)
+                if couple_context:
+                    # CORREÇÃO CRÍTICA: Sobrescreve o apelido do WhatsApp pelo Nome Real
+                    push_name = couple_context["first_name"]
             
             # --- MEDIAÇÃO ATIVA ---
             
             mediation_triggered = False
-            if couple_context and couple_db_record:
+            priority = PRIORITY_CHAT
+            if couple_context:
                 # Verifica se é comando manual
                 manual_trigger = is_manual_mediation_trigger(user_text)
                 
@@ -538,8 +626,10 @@ async def process_webhook_task(data: dict):
                 log.info("conflict_analysis", level=conflict_level, manual=manual_trigger)
                 
                 # Decide se deve mediar
-                if should_mediate(conflict_level, couple_db_record.last_mediation_at, manual_trigger):
+                if should_mediate(conflict_level, couple_context["last_mediation_at"], manual_trigger):
                     mediation_triggered = True
+                    # /sos passa na frente de tudo no limitador do Gemini
+                    priority = PRIORITY_MANUAL_MEDIATION if manual_trigger else PRIORITY_AUTO_MEDIATION
                     log.info("mediation_triggered", reason="manual" if manual_trigger else "auto")
                     
                     # Gera prompt especializado de mediação
@@ -557,14 +647,10 @@ async def process_webhook_task(data: dict):
                     user_text = mediation_prompt
                     should_respond = True  # Força resposta
                     
-                    # Atualiza registro no banco
-                    with Session(engine) as session:
-                        couple_to_update = session.get(Couple, couple_db_record.id)
-                        if couple_to_update:
-                            couple_to_update.last_mediation_at = datetime.utcnow()
-                            couple_to_update.mediation_count += 1
-                            session.add(couple_to_update)
-                            session.commit()
+                    # Atualiza o cache na hora (cooldown); o banco recebe o incremento em lote
+                    couple_context["last_mediation_at"] = datetime.utcnow()
+                    couple_context["mediation_count"] += 1
+                    mediation_writer.record(couple_context["couple_id"], couple_context["last_mediation_at"])
 
 
             if should_respond:
@@ -572,11 +658,18 @@ async def process_webhook_task(data: dict):
                 log = logger.bind(remote_jid=remote_jid, push_name=push_name)
                 log.info("task_responding_with_context", is_active_window=is_active_conversation if 'is_active_conversation' in locals() else False)
                 
-                ai_response = await process_message(user_text, push_name, remote_jid, couple_context)
-                
-                # Envia resposta com delay humano e quebra automática
-                # send_text_human já processa <QUEBRA>, calcula delays e envia múltiplos balões
-                await send_text_human(remote_jid, ai_response)
+                if GEMINI_STREAMING:
+                    # Balões são agendados conforme o Gemini gera (primeiro balão sem esperar o resto)
+                    await schedule_stream_human(
+                        remote_jid, process_message_stream(user_text, push_name, remote_jid, couple_context, priority),
+                        message_id=message_id,
+                    )
+                else:
+                    ai_response = await process_message(user_text, push_name, remote_jid, couple_context, priority)
+                    
+                    # Agenda a resposta com delay humano e quebra automática (<QUEBRA>)
+                    # O worker fica livre na hora; o outbound_scheduler cuida do ritmo dos balões
+                    schedule_text_human(remote_jid, ai_response, message_id=message_id)
                 
                 # Atualiza timestamp da última resposta
                 last_bot_reply_time[remote_jid] = datetime.utcnow()
@@ -585,12 +678,36 @@ async def process_webhook_task(data: dict):
         else:
             log.info("ignored_message_no_text")
     except Exception as e:
-        logger.error("task_failed", error=str(e), exc_info=True)
-    finally:
-        active_tasks.discard(task)
+        # Falha transitória (banco, Evolution, ...): sobe para o QueueWorkerPool dar nack (backoff/dead letter)
+        logger.error("task_failed", error=str(e))  # O traceback sai no job_failed do pool
+        raise
+
+@app.get("/metrics")
+def get_metrics():
+    """Métricas internas do pipeline (fila, workers, deduplicador, pools HTTP, segurança, memória, casais, mediações, hash de senha, autenticação, chaves do Google, envios, outbox, limitador e modelos do Gemini, caches de respostas, orçamento do prompt)."""
+    worker_pool = getattr(app.state, "worker_pool", None)
+    return {
+        "job_queue": worker_pool.stats() if worker_pool else job_queue.stats(),
+        "deduplicator": deduplicator.stats(),
+        "http_pools": http_clients.stats(),
+        "safety": safety_pipeline.stats(),
+        "memory": conversation_manager.stats(),
+        "couple_cache": couple_cache.stats(),
+        "mediation_writer": mediation_writer.stats(),
+        "password_hasher": password_hasher.stats(),
+        "auth_cache": auth_cache.stats(),
+        "google_certs": google_verifier.stats(),
+        "outbound": outbound_scheduler.stats(),
+        "outbox": outbox.stats(),
+        "gemini_limiter": gemini_limiter.stats(),
+        "gemini_models": gemini_router.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "prompt_usage": prompt_usage.stats(),
+    }
 
 @app.post("/webhook")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
+async def receive_webhook(request: Request):
     body = await request.json()
     logger.info("webhook_raw_hit", webhook_event=body.get("event"), headers=dict(request.headers))
     log = logger.bind(webhook_event=body.get("event"))
@@ -607,8 +724,10 @@ async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
                 log.info("duplicate_message_skipped", msg_id=msg_id)
                 return {"status": "duplicate"}
 
-            background_tasks.add_task(process_webhook_task, data)
-            log.info("webhook_accepted_for_processing")
+            # Persiste o payload bruto; os workers da fila fazem o resto
+            # A lane é pelo chat: mensagens do mesmo remoteJid são processadas em ordem
+            job_id = job_queue.enqueue(data, key=data.get("key", {}).get("remoteJid", ""))
+            log.info("webhook_accepted_for_processing", job_id=job_id)
     except Exception as e:
         log.error("webhook_dispatch_failed", error=str(e))
         return {"status": "error_logged"}
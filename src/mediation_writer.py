@@ -0,0 +1,106 @@
+"""
+Gravação Write-Behind dos Contadores de Mediação
+Quando a mediação dispara, o contexto do casal em memória é atualizado na hora
+(o cooldown do should_mediate continua correto) e o banco recebe os incrementos
+agregados por casal em lotes periódicos e no shutdown.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from database import async_engine
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+MEDIATION_FLUSH_INTERVAL_SECONDS = float(os.getenv("MEDIATION_FLUSH_INTERVAL_SECONDS", "5"))
+
+_UPDATE_SQL = text(
+    "UPDATE couple SET mediation_count = mediation_count + :n, last_mediation_at = :at WHERE id = :id"
+)
+
+
+class MediationCounterWriter:
+    """Acumula {couple_id: (incremento, última mediação)} e aplica tudo numa única transação."""
+
+    def __init__(self, engine=async_engine):
+        self.engine = engine
+        self._pending: dict[int, tuple[int, datetime]] = {}
+        self._inflight: dict[int, tuple[int, datetime]] = {}  # Lote sendo gravado (ainda sem COMMIT)
+        # Horários do último lote gravado: um contexto lido do banco antes do COMMIT e
+        # completado depois dele ainda vê o cooldown (max() de horário não conta em dobro)
+        self._committed_at: dict[int, datetime] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.recorded_count = 0
+        self.flushed_count = 0
+        self.batches = 0
+
+    def record(self, couple_id: int, at: datetime):
+        n, last_at = self._pending.get(couple_id, (0, at))
+        self._pending[couple_id] = (n + 1, max(last_at, at))
+        self.recorded_count += 1
+
+    def pending_for(self, couple_id: int) -> Optional[tuple[int, datetime]]:
+        """Incremento ainda não gravado, pendente ou em gravação (para sobrepor a um contexto recém-lido do banco)."""
+        parts = [part for part in (self._pending.get(couple_id), self._inflight.get(couple_id)) if part]
+        committed_at = self._committed_at.get(couple_id)
+        if not parts and committed_at is None:
+            return None
+        at = max([at for _, at in parts] + ([committed_at] if committed_at else []))
+        return sum(n for n, _ in parts), at
+
+    async def flush(self):
+        if not self._pending:
+            return
+        # O lote continua visível no pending_for até o COMMIT (ou até voltar para _pending)
+        batch, self._pending = self._pending, {}
+        self._inflight = batch
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(
+                    _UPDATE_SQL, [{"id": cid, "n": n, "at": at} for cid, (n, at) in batch.items()]
+                )
+            self._committed_at = {cid: at for cid, (_, at) in batch.items()}
+            self.flushed_count += sum(n for n, _ in batch.values())
+            self.batches += 1
+        except Exception as e:
+            # Devolve para a próxima rodada somando com o que chegou nesse meio tempo
+            for cid, (n, at) in batch.items():
+                newer_n, newer_at = self._pending.get(cid, (0, at))
+                self._pending[cid] = (n + newer_n, max(at, newer_at))
+            logger.error("mediation_flush_failed", couples=len(batch), error=str(e))
+        finally:
+            self._inflight = {}
+
+    async def _flush_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self, interval: float = MEDIATION_FLUSH_INTERVAL_SECONDS):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever(interval))
+
+    async def stop(self):
+        """Para o flusher e grava o que estiver pendente (chamado no shutdown)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded_count,
+            "flushed": self.flushed_count,
+            "batches": self.batches,
+            "pending_couples": len(self._pending),
+        }
+
+
+# Instância global
+mediation_writer = MediationCounterWriter()
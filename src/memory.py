@@ -1,81 +1,345 @@
+import asyncio
+import itertools
 import time
-from collections import deque
+from collections import OrderedDict, deque
 from typing import Dict, List, Optional
 import json
 import os
 
 from logging_config import get_logger
+from memory_backends import MemoryBackend, build_memory_backend
+from prompt_budget import estimate_tokens
 
 logger = get_logger(__name__)
 
+# --- Configurações ---
+MEMORY_HISTORY_LIMIT = int(os.getenv("MEMORY_HISTORY_LIMIT", "20"))
+MEMORY_TTL_SECONDS = int(os.getenv("MEMORY_TTL_SECONDS", "3600"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "50000"))
+MEMORY_SWEEP_INTERVAL_SECONDS = float(os.getenv("MEMORY_SWEEP_INTERVAL_SECONDS", "60"))
+MEMORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("MEMORY_FLUSH_INTERVAL_SECONDS", "2"))
+# Quanto tempo um chat sem nada no backend fica sem nova consulta (chat novo não vai ao Redis a cada mensagem)
+MEMORY_NEGATIVE_CACHE_SECONDS = float(os.getenv("MEMORY_NEGATIVE_CACHE_SECONDS", "300"))
+
+HISTORY_HEADER = "--- Histórico Recente ---\n"
+HISTORY_FOOTER = "-------------------------"
+HISTORY_WRAPPER_TOKENS = estimate_tokens(HISTORY_HEADER + HISTORY_FOOTER)
+
 class ConversationManager:
     """
     Gerencia o histórico de conversas em memória.
-    Futuramente pode ser migrado para Redis para persistência entre restarts.
+    Com um `backend` (SQLite ou Redis) o histórico sobrevive a restarts: as
+    alterações são gravadas em lote por um flusher (write-behind, o hot path
+    nunca espera o disco) e cada chat é hidratado do backend por `load()`,
+    numa thread, antes do primeiro acesso. Os demais métodos só leem a RAM.
     """
-    def __init__(self, history_limit: int = 20, ttl_seconds: int = 3600):
+    def __init__(self, history_limit: int = MEMORY_HISTORY_LIMIT, ttl_seconds: int = MEMORY_TTL_SECONDS,
+                 max_sessions: int = MEMORY_MAX_SESSIONS, backend: Optional[MemoryBackend] = None,
+                 negative_ttl: float = MEMORY_NEGATIVE_CACHE_SECONDS):
         self.history_limit = history_limit
         self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self._misses: "OrderedDict[str, float]" = OrderedDict()  # Chats sem sessão no backend -> vence em
+        self._dirty: set[str] = set()    # Sessões alteradas desde o último flush
+        self._deleted: set[str] = set()  # Sessões apagadas (/reset) desde o último flush
+        self._evicted_unsaved: dict[str, dict] = {}  # Removidas da RAM pelo limite antes do flush
+        self._flusher: Optional[asyncio.Task] = None
+        self.hydrated_count = 0
+        self.hydrate_misses = 0
+        self.negative_hits = 0
+        self.flushed_count = 0
         # Estrutura: { remote_jid: { "history": deque([...]), "updated_at": timestamp } }
-        self.conversations: Dict[str, dict] = {}
+        # A ordem do OrderedDict é a ordem de último uso (move_to_end a cada toque),
+        # então as sessões mais antigas (e as vencidas) ficam sempre no início.
+        self.conversations: "OrderedDict[str, dict]" = OrderedDict()
+        self.expired_count = 0
+        self.evicted_count = 0
+        self._sweeper: Optional[asyncio.Task] = None
 
-    def _cleanup_old_sessions(self):
-        """Remove sessões inativas para economizar memória"""
+    def _cleanup_old_sessions(self) -> int:
+        """Remove sessões inativas do início da fila. Custo O(vencidas), não O(todas)."""
         now = time.time()
-        keys_to_remove = []
-        for jid, data in self.conversations.items():
-            if now - data["updated_at"] > self.ttl:
-                keys_to_remove.append(jid)
-        
-        for k in keys_to_remove:
-            del self.conversations[k]
+        removed = 0
+        while self.conversations:
+            oldest = next(iter(self.conversations.values()))
+            if now - oldest["updated_at"] <= self.ttl:
+                break
+            self.conversations.popitem(last=False)
+            removed += 1
+        self.expired_count += removed
+        return removed
+
+    def _new_session(self, updated_at: float) -> dict:
+        return {
+            "history": deque(maxlen=self.history_limit),
+            "updated_at": updated_at,
+            "partner_names": set(), # Tentativa de rastrear nomes no chat
+            "rendered_body": "",    # Linhas já renderizadas do histórico, na ordem do deque
+            "formatted": "",        # Histórico pronto para o prompt (cache de get_formatted_history)
+            "history_tokens": 0,    # Soma das estimativas de tokens das mensagens do deque
+        }
+
+    def _insert_session(self, remote_jid: str, session: dict):
+        self.conversations[remote_jid] = session
+        # Limite rígido de sessões: descarta a menos usada recentemente (LRU)
+        while len(self.conversations) > self.max_sessions:
+            evicted_jid, evicted = self.conversations.popitem(last=False)
+            self.evicted_count += 1
+            if evicted_jid in self._dirty:
+                # Ainda não foi gravada: guarda o snapshot para o próximo flush
+                self._dirty.discard(evicted_jid)
+                self._evicted_unsaved[evicted_jid] = self._serialize(evicted)
+
+    def _session_from_data(self, data: dict) -> dict:
+        session = self._new_session(data["updated_at"])
+        session["partner_names"].update(data.get("partner_names", []))
+        for stored in data.get("messages", [])[-self.history_limit:]:
+            self._append(session, self._make_message(stored["role"], stored["content"], stored["name"],
+                                                     stored["timestamp"]))
+        return session
+
+    def _restore_evicted(self, remote_jid: str) -> Optional[dict]:
+        """Sessão tirada da RAM pelo limite antes do flush: o snapshot é mais novo que o backend."""
+        data = self._evicted_unsaved.pop(remote_jid, None)
+        if data is None:
+            return None
+        session = self._session_from_data(data)
+        self._insert_session(remote_jid, session)
+        self._dirty.add(remote_jid)  # Continua pendente de gravação
+        return session
+
+    def _negative_cached(self, remote_jid: str) -> bool:
+        expires_at = self._misses.get(remote_jid)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._misses[remote_jid]
+            return False
+        return True
+
+    def _remember_miss(self, remote_jid: str):
+        self._misses[remote_jid] = time.monotonic() + self.negative_ttl
+        self._misses.move_to_end(remote_jid)
+        while len(self._misses) > self.max_sessions:
+            self._misses.popitem(last=False)
+
+    async def load(self, remote_jid: str):
+        """
+        Garante que a sessão do chat (se existir) está na RAM antes de usar os métodos síncronos.
+        Ordem: RAM -> snapshot ainda não gravado -> /reset pendente -> cache negativo -> backend (numa thread).
+        """
+        if self.backend is None or remote_jid in self.conversations:
+            return
+        if self._restore_evicted(remote_jid) is not None or remote_jid in self._deleted:
+            return
+        if self._negative_cached(remote_jid):
+            self.negative_hits += 1
+            return
+        try:
+            # Redis/SQLite são I/O bloqueante: fora do event loop
+            data = await asyncio.to_thread(self.backend.load, remote_jid)
+        except Exception as e:
+            logger.error("memory_hydrate_failed", remote_jid=remote_jid, error=str(e))
+            return
+        # Durante o await o chat pode ter ganhado sessão, sido apagado ou despejado de novo
+        if remote_jid in self.conversations or remote_jid in self._deleted:
+            return
+        if self._restore_evicted(remote_jid) is not None:
+            return
+        if not data or time.time() - data["updated_at"] > self.ttl:
+            self.hydrate_misses += 1
+            self._remember_miss(remote_jid)
+            return
+
+        session = self._session_from_data(data)
+        # A hidratação conta como uso: mantém o início do OrderedDict sempre com as sessões mais antigas
+        session["updated_at"] = time.time()
+        self._insert_session(remote_jid, session)
+        self.hydrated_count += 1
+
+    def _get_session(self, remote_jid: str) -> Optional[dict]:
+        session = self.conversations.get(remote_jid)
+        if session is None:
+            session = self._restore_evicted(remote_jid)
+        return session
+
+    @staticmethod
+    def _make_message(role: str, content: str, name: str, timestamp: float) -> dict:
+        return {
+            "role": role, # 'user' ou 'model'
+            "content": content,
+            "name": name,
+            "timestamp": timestamp,
+            # Renderização da linha feita uma única vez e reaproveitada (prompt, contagem de tokens)
+            "rendered": f"[{name}]: {content}\n",
+            "tokens": estimate_tokens(f"[{name}]: {content}\n"),
+        }
 
     def add_message(self, remote_jid: str, role: str, content: str, user_name: str = "Usuário"):
         self._cleanup_old_sessions()
         
-        if remote_jid not in self.conversations:
-            self.conversations[remote_jid] = {
-                "history": deque(maxlen=self.history_limit),
-                "updated_at": time.time(),
-                "partner_names": set() # Tentativa de rastrear nomes no chat
-            }
+        session = self._get_session(remote_jid)
+        if session is None:
+            session = self._new_session(time.time())
+            self._insert_session(remote_jid, session)
         
-        session = self.conversations[remote_jid]
         session["updated_at"] = time.time()
+        self.conversations.move_to_end(remote_jid)
         
         # Adiciona nomes detectados (simples, baseado no pushName)
         if role == "user" and user_name:
             session["partner_names"].add(user_name)
 
-        session["history"].append({
-            "role": role, # 'user' ou 'model'
-            "content": content,
-            "name": user_name if role == "user" else "NósAi",
-            "timestamp": time.time()
-        })
+        name = user_name if role == "user" else "NósAi"
+        self._append(session, self._make_message(role, content, name, time.time()))
+
+        if self.backend is not None:
+            self._dirty.add(remote_jid)
+            self._deleted.discard(remote_jid)
+            self._misses.pop(remote_jid, None)
+
+    def _append(self, session: dict, message: dict):
+        history = session["history"]
+        body = session["rendered_body"]
+        if len(history) == history.maxlen:
+            # O deque vai descartar a mensagem mais antiga: corta a linha dela do início
+            body = body[len(history[0]["rendered"]):]
+            session["history_tokens"] -= history[0]["tokens"]
+        history.append(message)
+        session["history_tokens"] += message["tokens"]
+        session["rendered_body"] = body + message["rendered"]
+        session["formatted"] = f"{HISTORY_HEADER}{session['rendered_body']}{HISTORY_FOOTER}"
 
     def get_history(self, remote_jid: str) -> List[dict]:
-        if remote_jid not in self.conversations:
+        session = self._get_session(remote_jid)
+        if session is None:
             return []
         
         # Converte deque para lista
-        return list(self.conversations[remote_jid]["history"])
+        return list(session["history"])
 
     def get_formatted_history(self, remote_jid: str) -> str:
         """Retorna histórico formatado para o Prompt do Gemini"""
-        history = self.get_history(remote_jid)
-        if not history:
+        session = self._get_session(remote_jid)
+        if session is None:
             return ""
-        
-        formatted = "--- Histórico Recente ---\n"
-        for msg in history:
-            formatted += f"[{msg['name']}]: {msg['content']}\n"
-        formatted += "-------------------------"
-        return formatted
+        # Mantido incrementalmente pelo add_message: O(1) aqui
+        return session["formatted"]
+
+    def get_history_within_budget(self, remote_jid: str, budget: int) -> tuple[str, int, int, int]:
+        """
+        Histórico formatado que cabe em `budget` tokens, das mensagens mais novas para
+        as mais antigas. Para na primeira que não cabe (sem buracos na conversa).
+        Retorna (texto, mensagens incluídas, mensagens descartadas, tokens estimados).
+        """
+        session = self._get_session(remote_jid)
+        if session is None or not session["history"]:
+            return "", 0, 0, 0
+        history = session["history"]
+        total = session["history_tokens"] + HISTORY_WRAPPER_TOKENS
+        if total <= budget:
+            return session["formatted"], len(history), 0, total  # Caso comum: tudo cabe, O(1)
+
+        used = HISTORY_WRAPPER_TOKENS
+        kept = 0
+        for message in reversed(history):
+            if used + message["tokens"] > budget:
+                break
+            used += message["tokens"]
+            kept += 1
+        if not kept:
+            return "", 0, len(history), 0
+        body = "".join(message["rendered"] for message in itertools.islice(history, len(history) - kept, None))
+        return f"{HISTORY_HEADER}{body}{HISTORY_FOOTER}", kept, len(history) - kept, used
 
     def clear_history(self, remote_jid: str):
         if remote_jid in self.conversations:
             del self.conversations[remote_jid]
+        if self.backend is not None:
+            self._dirty.discard(remote_jid)
+            self._evicted_unsaved.pop(remote_jid, None)
+            self._deleted.add(remote_jid)
+
+    def _serialize(self, session: dict) -> dict:
+        return {
+            "messages": [
+                {key: msg[key] for key in ("role", "content", "name", "timestamp")}
+                for msg in session["history"]
+            ],
+            "partner_names": sorted(session["partner_names"]),
+            "updated_at": session["updated_at"],
+        }
+
+    async def flush(self):
+        """Grava em lote as sessões alteradas. O I/O roda numa thread para não travar o event loop."""
+        if self.backend is None or not (self._dirty or self._deleted or self._evicted_unsaved):
+            return
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        # Serializa no loop (rápido) para não ler a sessão de outra thread enquanto ela muda
+        snapshot, self._evicted_unsaved = self._evicted_unsaved, {}
+        snapshot.update({jid: self._serialize(self.conversations[jid]) for jid in dirty if jid in self.conversations})
+        try:
+            await asyncio.to_thread(self.backend.save_many, snapshot, deleted)
+            self.flushed_count += len(snapshot)
+        except Exception as e:
+            # Devolve para a próxima rodada (sem perder alterações mais novas)
+            self._dirty |= dirty & self.conversations.keys()
+            self._evicted_unsaved = {**snapshot, **self._evicted_unsaved}
+            self._deleted |= deleted - self._dirty
+            logger.error("memory_flush_failed", backend=self.backend.name, sessions=len(snapshot), error=str(e))
+
+    async def _flush_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start_flusher(self, interval: float = MEMORY_FLUSH_INTERVAL_SECONDS):
+        if self.backend is not None and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever(interval))
+            logger.info("memory_flusher_started", backend=self.backend.name, interval=interval)
+
+    async def stop_flusher(self):
+        """Para o flusher e grava o que estiver pendente (chamado no shutdown)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    async def _sweep_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            removed = self._cleanup_old_sessions()
+            if removed:
+                logger.info("memory_sessions_expired", count=removed, active=len(self.conversations))
+
+    def start_sweeper(self, interval: float = MEMORY_SWEEP_INTERVAL_SECONDS):
+        """Limpa sessões vencidas em segundo plano, mesmo em chats que pararam de falar."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.conversations),
+            "max_sessions": self.max_sessions,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count,
+            "backend": self.backend.name if self.backend is not None else "memory",
+            "hydrated": self.hydrated_count,
+            "hydrate_misses": self.hydrate_misses,
+            "negative_cache_hits": self.negative_hits,
+            "flushed": self.flushed_count,
+            "pending_writes": len(self._dirty) + len(self._deleted) + len(self._evicted_unsaved),
+        }
 
 # Instância global (Singleton simples para este app stateful)
-conversation_manager = ConversationManager()
+conversation_manager = ConversationManager(backend=build_memory_backend(MEMORY_TTL_SECONDS))
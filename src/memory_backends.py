@@ -0,0 +1,133 @@
+"""
+Backends de Persistência da Memória de Conversa
+O ConversationManager continua servindo tudo da RAM; o backend só recebe
+gravações em lote (write-behind) e é consultado quando um chat aparece pela
+primeira vez depois de um restart (hidratação preguiçosa).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+# "memory" (sem persistência, padrão), "sqlite" ou "redis"
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory").lower()
+MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", "memory.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "nosai:conv:")
+
+
+class MemoryBackend:
+    """
+    Interface dos backends. Todos os métodos são síncronos e rodam numa thread:
+    load() na hidratação de um chat (ConversationManager.load) e save_many() no flusher.
+    Sessões são dicts serializáveis: {"messages": [...], "partner_names": [...], "updated_at": ts}
+    """
+    name = "base"
+
+    def load(self, remote_jid: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save_many(self, sessions: dict[str, dict], deleted: set[str]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteMemoryBackend(MemoryBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = MEMORY_SQLITE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_sessions ("
+            "remote_jid TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def load(self, remote_jid: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM conversation_sessions WHERE remote_jid = ?", (remote_jid,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, sessions: dict[str, dict], deleted: set[str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO conversation_sessions (remote_jid, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(remote_jid) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(jid, json.dumps(data, ensure_ascii=False), data["updated_at"]) for jid, data in sessions.items()],
+                )
+                self._conn.executemany(
+                    "DELETE FROM conversation_sessions WHERE remote_jid = ?", [(jid,) for jid in deleted]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def purge_older_than(self, cutoff: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM conversation_sessions WHERE updated_at < ?", (cutoff,)
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisMemoryBackend(MemoryBackend):
+    """
+    Backend via protocolo Redis (funciona com Redis, KeyDB, Valkey ou scripts/fake_redis.py).
+    O TTL da sessão vira o EXPIRE da chave, então a limpeza fica a cargo do servidor.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, ttl_seconds: int = 3600, prefix: str = REDIS_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("MEMORY_BACKEND=redis requer o pacote 'redis' (pip install redis)") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl_seconds
+        self.prefix = prefix
+
+    def load(self, remote_jid: str) -> Optional[dict]:
+        raw = self._client.get(self.prefix + remote_jid)
+        return json.loads(raw) if raw else None
+
+    def save_many(self, sessions: dict[str, dict], deleted: set[str]):
+        pipe = self._client.pipeline(transaction=False)
+        for jid, data in sessions.items():
+            pipe.set(self.prefix + jid, json.dumps(data, ensure_ascii=False), ex=self.ttl)
+        for jid in deleted:
+            pipe.delete(self.prefix + jid)
+        pipe.execute()
+
+    def close(self):
+        self._client.close()
+
+
+def build_memory_backend(ttl_seconds: int) -> Optional[MemoryBackend]:
+    if MEMORY_BACKEND == "sqlite":
+        backend = SQLiteMemoryBackend()
+        # Sessões que já venceriam não precisam ocupar disco
+        backend.purge_older_than(time.time() - ttl_seconds)
+        return backend
+    if MEMORY_BACKEND == "redis":
+        return RedisMemoryBackend(ttl_seconds=ttl_seconds)
+    return None
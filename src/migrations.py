@@ -0,0 +1,78 @@
+"""
+Migrações de Schema
+O create_all só cria tabelas que não existem; nunca altera as existentes.
+Aqui ficam as mudanças versionadas para bancos já em produção. Cada migração
+roda uma única vez, em ordem, e fica registrada na tabela schema_migrations.
+
+Para adicionar uma nova: escreva uma função que recebe a conexão e inclua
+(próxima_versão, descrição, função) no fim de MIGRATIONS. Nunca renumere.
+"""
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Connection, inspect, text
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _column_names(conn: Connection, table: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _add_couple_mediation_columns(conn: Connection):
+    # Bancos criados antes da Mediação Ativa não têm essas colunas
+    columns = _column_names(conn, "couple")
+    if "last_mediation_at" not in columns:
+        conn.execute(text("ALTER TABLE couple ADD COLUMN last_mediation_at TIMESTAMP"))
+    if "mediation_count" not in columns:
+        conn.execute(text("ALTER TABLE couple ADD COLUMN mediation_count INTEGER NOT NULL DEFAULT 0"))
+
+
+def _index_couple_group_jid(conn: Connection):
+    # Toda mensagem de grupo busca o casal por group_jid
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_couple_group_jid ON couple (group_jid)"))
+
+
+def _index_couple_user_id(conn: Connection):
+    # /api/me e /api/couples/me filtram por user_id
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_couple_user_id ON couple (user_id)"))
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "couple: colunas de mediação", _add_couple_mediation_columns),
+    (2, "couple: índice em group_jid", _index_couple_group_jid),
+    (3, "couple: índice em user_id", _index_couple_user_id),
+]
+
+
+def run_migrations(conn: Connection) -> list[int]:
+    """
+    Aplica as migrações pendentes (cada uma na sua transação). Retorna as versões aplicadas.
+    Recebe a conexão síncrona do async_engine (via run_sync), então roda no mesmo banco das rotas.
+    """
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+    conn.commit()
+
+    newly_applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.utcnow()},
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("schema_migration_applied", version=version, description=description)
+        newly_applied.append(version)
+    return newly_applied
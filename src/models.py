@@ -27,10 +27,10 @@ class UserUpdate(SQLModel):
 
 # Modelo para o Casal/Grupo
 class CoupleBase(SQLModel):
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     partner_name: str
     partner_phone: str # Formato internacional
-    group_jid: Optional[str] = Field(default=None) # ID do grupo no WhatsApp (ex: 12345@g.us)
+    group_jid: Optional[str] = Field(default=None, index=True) # ID do grupo no WhatsApp (ex: 12345@g.us)
     status: str = "pending" # pending, active, archived
 
 class Couple(CoupleBase, table=True):
@@ -0,0 +1,297 @@
+"""
+Agendador de Envios (delay humano fora do worker)
+O webhook só planeja os balões: cada um recebe um horário de envio calculado
+com o delay humano e entra num heap. Um despachante único acorda no próximo
+horário e envia. Assim nenhum worker fica dormindo entre balões, e a ordem por
+chat é garantida (o próximo balão de um chat só sai depois que o anterior saiu).
+Balões com id de mensagem passam pelo outbox (persistente): falhas voltam para o
+heap com backoff e, após um restart, o que não foi entregue é retomado.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from logging_config import get_logger
+from outbox import Outbox, outbox, outbox_id
+from services import calculate_human_delay, deliver_text, split_long_message
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+OUTBOUND_SHUTDOWN_GRACE_SECONDS = float(os.getenv("OUTBOUND_SHUTDOWN_GRACE_SECONDS", "10"))
+OUTBOX_PURGE_INTERVAL_SECONDS = float(os.getenv("OUTBOX_PURGE_INTERVAL_SECONDS", "600"))
+
+MAX_HUMAN_DELAY_SECONDS = 8.0  # Teto do calculate_human_delay
+
+Sender = Callable[[str, str, Optional[list[str]]], Awaitable[None]]
+
+
+class OutboundScheduler:
+    """
+    Heap com o próximo balão de cada chat: [(horário, seq, remote_jid)].
+    Os demais balões do chat esperam numa fila própria e só entram no heap
+    quando o anterior termina de ser enviado.
+    """
+    def __init__(self, sender: Sender = deliver_text, store: Optional[Outbox] = outbox):
+        self.sender = sender
+        self.store = store
+        self._heap: list[tuple[float, int, str]] = []
+        self._queues: dict[str, deque] = {}   # { remote_jid: deque[(horário, texto, menções, id no outbox)] }
+        self._tail_due: dict[str, float] = {}  # Horário do último balão planejado por chat
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._purger: Optional[asyncio.Task] = None
+        self._sending: set[asyncio.Task] = set()
+        self._draining = False
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.resumed = 0
+        self.purged = 0
+        self.total_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def schedule(self, remote_jid: str, chunks: list[str], mentions: list[str] = None, paced_first: bool = False,
+                 message_id: Optional[str] = None, first_index: int = 0) -> float:
+        """
+        Planeja os balões e retorna na hora. O primeiro sai logo após o último já
+        planejado para o chat (ou com delay humano, se paced_first); os seguintes
+        com o delay humano entre eles. Com message_id, os balões são gravados no
+        outbox antes (ids já existentes são ignorados). Retorna o horário previsto
+        do último balão.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        due = self._tail_due.get(remote_jid, now)
+        planned = []
+        for i, chunk in enumerate(chunks):
+            if i > 0 or paced_first:
+                due += calculate_human_delay(len(chunk))
+            due = max(due, now)
+            row_id = outbox_id(message_id, first_index + i) if message_id and self.store else None
+            planned.append((due, chunk, mentions, row_id))
+
+        if message_id and self.store:
+            wall_offset = time.time() - now
+            inserted = self.store.add([
+                (row_id, message_id, remote_jid, chunk, mentions, item_due + wall_offset)
+                for item_due, chunk, mentions, row_id in planned
+            ])
+            planned = [item for item in planned if item[3] in inserted]
+        if not planned:
+            return due
+
+        queue = self._queues.setdefault(remote_jid, deque())
+        was_idle = not queue
+        queue.extend(planned)
+        self.pending += len(planned)
+        self._tail_due[remote_jid] = due
+        if was_idle:
+            self._push(remote_jid)
+        return due
+
+    def complete(self, remote_jid: str, message_id: Optional[str], balloons: int):
+        """Marca no outbox que todos os balões da resposta a message_id já foram planejados."""
+        if message_id and self.store:
+            self.store.mark_complete(message_id, remote_jid, balloons)
+
+    def _push(self, remote_jid: str):
+        due = self._queues[remote_jid][0][0]
+        heapq.heappush(self._heap, (due, next(self._seq), remote_jid))
+        if self._heap[0][2] == remote_jid:
+            self._wakeup.set()  # Novo item é o mais próximo: reagenda o despachante
+
+    async def _dispatch_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            due = self._heap[0][0]
+            delay = 0.0 if self._draining else due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, remote_jid = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._deliver(remote_jid))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _deliver(self, remote_jid: str):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[remote_jid]
+        due, text, mentions, row_id = queue[0]
+        lag_ms = max(loop.time() - due, 0.0) * 1000
+        self.total_lag_ms += lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        delay = None
+        try:
+            await self.sender(remote_jid, text, mentions)
+        except Exception as e:
+            logger.error("outbound_send_failed", remote_jid=remote_jid, outbox_id=row_id, error=str(e))
+            # Com outbox: tenta de novo com backoff, segurando os balões seguintes do chat.
+            # No shutdown não insiste; a linha continua pendente e é retomada no próximo startup
+            if row_id and not self._draining:
+                delay = self.store.retry_delay(row_id, str(e))
+            if delay is None:
+                self.failed += 1
+        else:
+            self.sent += 1
+            if row_id:
+                self.store.mark_sent(row_id)
+
+        if delay is not None:
+            self.retried += 1
+            queue[0] = (loop.time() + delay, text, mentions, row_id)
+            self._push(remote_jid)
+            return
+        queue.popleft()
+        self.pending -= 1
+        if queue:
+            self._push(remote_jid)
+        else:
+            del self._queues[remote_jid]
+            # O horário do último balão ainda serve para espaçar um próximo balão do mesmo
+            # stream; depois do delay máximo já não influencia e pode ser esquecido
+            loop.call_later(MAX_HUMAN_DELAY_SECONDS, self._forget, remote_jid)
+
+    def _forget(self, remote_jid: str):
+        stale_before = asyncio.get_running_loop().time() - MAX_HUMAN_DELAY_SECONDS
+        if remote_jid not in self._queues and self._tail_due.get(remote_jid, 0.0) <= stale_before:
+            self._tail_due.pop(remote_jid, None)
+
+    def resume(self) -> int:
+        """Recoloca no heap os balões que o outbox ainda não entregou (restart/crash)."""
+        if self.store is None:
+            return 0
+        loop = asyncio.get_running_loop()
+        wall_offset = time.time() - loop.time()
+        rows = self.store.pending()
+        for row_id, remote_jid, text, mentions, next_attempt_at in rows:
+            if any(item[3] == row_id for item in self._queues.get(remote_jid, ())):
+                continue
+            queue = self._queues.setdefault(remote_jid, deque())
+            was_idle = not queue
+            queue.append((next_attempt_at - wall_offset, text, mentions, row_id))
+            self.pending += 1
+            self.resumed += 1
+            if was_idle:
+                self._push(remote_jid)
+        if rows:
+            logger.warning("outbound_resumed_from_outbox", count=len(rows))
+        return len(rows)
+
+    def _purge(self):
+        purged = self.store.purge()
+        self.purged += purged
+        if purged:
+            logger.info("outbox_purged", count=purged)
+
+    async def _purge_forever(self, interval: float):
+        # Processo de vida longa: sem isso o outbox só encolheria a cada restart
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._purge()
+            except Exception as e:
+                logger.error("outbox_purge_failed", error=str(e))
+
+    def start(self, purge_interval: float = OUTBOX_PURGE_INTERVAL_SECONDS):
+        if self._dispatcher is None:
+            if self.store is not None:
+                self._purge()
+                self.resume()
+                self._purger = asyncio.create_task(self._purge_forever(purge_interval))
+            self._dispatcher = asyncio.create_task(self._dispatch_forever())
+
+    async def stop(self, timeout: float = OUTBOUND_SHUTDOWN_GRACE_SECONDS):
+        """
+        Com outbox: para de despachar, espera só os envios em andamento (até o timeout)
+        e deixa o resto pendente no disco, para o próximo startup enviar no ritmo certo.
+        Sem outbox: envia o que falta sem o delay humano (mantendo a ordem) até o timeout.
+        """
+        if self._dispatcher is None:
+            return
+        if self._purger is not None:
+            self._purger.cancel()
+            await asyncio.gather(self._purger, return_exceptions=True)
+            self._purger = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if self.store is not None:
+            self._dispatcher.cancel()
+            self._draining = True  # Falha de um envio em andamento não é reagendada: a linha fica pendente
+            while self._sending and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+        else:
+            self._draining = True
+            self._wakeup.set()
+            while (self.pending or self._sending) and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+            self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, *self._sending, return_exceptions=True)
+        self._dispatcher = None
+        if self.pending and self.store is not None:
+            logger.info("outbound_left_in_outbox", pending=self.pending)
+        elif self.pending:
+            logger.warning("outbound_dropped_on_shutdown", pending=self.pending)
+
+    def stats(self) -> dict:
+        # Pode ser chamado fora do loop (rota síncrona); loop.time() usa o mesmo relógio monotônico
+        done = self.sent + self.failed
+        return {
+            "pending": self.pending,
+            "chats": len(self._queues),
+            "in_flight": len(self._sending),
+            "next_due_in_s": round(max(self._heap[0][0] - time.monotonic(), 0.0), 2) if self._heap else None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "resumed": self.resumed,
+            "purged": self.purged,
+            "avg_lag_ms": round(self.total_lag_ms / done, 1) if done else 0.0,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+        }
+
+
+def schedule_text_human(remote_jid: str, text: str, mentions: list[str] = None, message_id: str = None) -> int:
+    """Quebra a resposta em balões (<QUEBRA> ou tamanho) e planeja o envio com delay humano."""
+    chunks = split_long_message(text)
+    outbound_scheduler.schedule(remote_jid, chunks, mentions, message_id=message_id)
+    outbound_scheduler.complete(remote_jid, message_id, len(chunks))
+    logger.info("outbound_scheduled", remote_jid=remote_jid, chunks_count=len(chunks))
+    return len(chunks)
+
+
+async def schedule_stream_human(remote_jid: str, balloons: AsyncIterator[str], mentions: list[str] = None,
+                                message_id: str = None) -> int:
+    """
+    Planeja os balões conforme chegam de um gerador (ex: process_message_stream).
+    O tempo que o Gemini levou gerando já conta como "digitação": o delay é
+    contado a partir do horário previsto do balão anterior. A resposta só é
+    marcada como completa no fim do stream; se ele cair antes, o job
+    reprocessado gera de novo e os índices já planejados são ignorados.
+    """
+    count = 0
+    async for chunk in balloons:
+        outbound_scheduler.schedule(
+            remote_jid, [chunk], mentions, paced_first=count > 0, message_id=message_id, first_index=count
+        )
+        count += 1
+    outbound_scheduler.complete(remote_jid, message_id, count)
+    logger.info("outbound_scheduled", remote_jid=remote_jid, chunks_count=count)
+    return count
+
+
+# Instância global
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,190 @@
+"""
+Outbox Persistente de Envios
+Cada balão planejado vira uma linha em SQLite (WAL) antes de ir para o
+agendador. Assim uma resposta que já custou uma chamada ao Gemini não se perde
+por falha da Evolution nem por restart: o envio é retomado, nunca regerado.
+O id da linha é "<id da mensagem de origem>:<índice do balão>", o que torna o
+planejamento idempotente (replanejar a mesma mensagem não duplica balões).
+A resposta só conta como planejada depois de mark_complete: um stream que caiu
+no meio deixa os primeiros balões no outbox, e o job reprocessado gera de novo
+e planeja só os índices que faltam.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from job_queue import JOB_QUEUE_DB
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações do Outbox ---
+OUTBOX_DB = os.getenv("OUTBOX_DB", JOB_QUEUE_DB)  # Mesmo arquivo da fila de ingestão, tabela própria
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+
+# Estados possíveis de um balão
+STATE_PENDING = "pending"  # Aguardando envio (ou nova tentativa em next_attempt_at)
+STATE_SENT = "sent"        # Entregue à Evolution (fica até a retenção, para idempotência)
+STATE_DEAD = "dead"        # Estourou OUTBOX_MAX_ATTEMPTS, fica para inspeção manual
+
+
+def outbox_id(message_id: str, index: int) -> str:
+    return f"{message_id}:{index}"
+
+
+class Outbox:
+    """
+    Tabela de balões com estado, tentativas e horário da próxima tentativa.
+
+    - add(): grava os balões planejados (INSERT OR IGNORE por id)
+    - mark_sent(): balão entregue
+    - retry_delay(): registra a falha e devolve o backoff (ou None se virou dead)
+    - pending(): balões não entregues, para retomar no startup
+    - mark_complete() / progress(): resposta inteira planejada (ou até onde chegou)
+    """
+    def __init__(self, path: str = OUTBOX_DB, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                message_id TEXT NOT NULL,
+                remote_jid TEXT NOT NULL,
+                text TEXT NOT NULL,
+                mentions TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                sent_at REAL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_state_next ON outbox (state, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_message_id ON outbox (message_id)")
+        # Uma linha por resposta cujos balões foram todos planejados
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_replies (message_id TEXT PRIMARY KEY, remote_jid TEXT NOT NULL, "
+            "balloons INTEGER NOT NULL, completed_at REAL NOT NULL)"
+        )
+
+    def add(self, rows: list[tuple[str, str, str, str, Optional[list[str]], float]]) -> set[str]:
+        """
+        Grava balões (id, message_id, remote_jid, texto, menções, horário previsto em epoch).
+        Retorna os ids realmente inseridos (os que já existiam são ignorados).
+        """
+        now = time.time()
+        inserted = set()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row_id, message_id, remote_jid, text, mentions, due_at in rows:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox (id, message_id, remote_jid, text, mentions, state, attempts, "
+                        "next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                        (row_id, message_id, remote_jid, text,
+                         json.dumps(mentions) if mentions else None, STATE_PENDING, due_at, now),
+                    )
+                    if cursor.rowcount:
+                        inserted.add(row_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def progress(self, message_id: str) -> tuple[int, bool]:
+        """(balões já planejados, resposta completa?) para a resposta a essa mensagem."""
+        with self._lock:
+            planned = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE message_id = ?", (message_id,)
+            ).fetchone()[0]
+            complete = self._conn.execute(
+                "SELECT 1 FROM outbox_replies WHERE message_id = ?", (message_id,)
+            ).fetchone() is not None
+        return planned, complete
+
+    def mark_complete(self, message_id: str, remote_jid: str, balloons: int):
+        """A resposta inteira já está no outbox: um job reprocessado não precisa gerar de novo."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox_replies (message_id, remote_jid, balloons, completed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (message_id, remote_jid, balloons, time.time()),
+            )
+
+    def mark_sent(self, row_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET state = ?, sent_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (STATE_SENT, time.time(), row_id),
+            )
+
+    def retry_delay(self, row_id: str, error: str = "") -> Optional[float]:
+        """Registra a falha. Retorna o backoff (exponencial com jitter) ou None se o balão virou dead."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            if attempts >= self.max_attempts:
+                self._conn.execute(
+                    "UPDATE outbox SET state = ?, attempts = ?, last_error = ? WHERE id = ?",
+                    (STATE_DEAD, attempts, error[:500], row_id),
+                )
+                logger.error("outbox_dead_lettered", outbox_id=row_id, attempts=attempts, error=error)
+                return None
+            # Full jitter: espalha as novas tentativas quando a Evolution volta
+            delay = random.uniform(0, min(OUTBOX_BACKOFF_BASE_SECONDS * 2 ** attempts, OUTBOX_BACKOFF_MAX_SECONDS))
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, error[:500], row_id),
+            )
+        return delay
+
+    def pending(self) -> list[tuple[str, str, str, Optional[list[str]], float]]:
+        """Balões não entregues (id, remote_jid, texto, menções, próxima tentativa), na ordem de envio."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, remote_jid, text, mentions, next_attempt_at FROM outbox WHERE state = ? "
+                "ORDER BY remote_jid, created_at, message_id, CAST(substr(id, length(message_id) + 2) AS INTEGER)",
+                (STATE_PENDING,),
+            ).fetchall()
+        return [(row_id, jid, text, json.loads(mentions) if mentions else None, next_at)
+                for row_id, jid, text, mentions, next_at in rows]
+
+    def purge(self, retention_hours: float = OUTBOX_RETENTION_HOURS) -> int:
+        """Apaga balões entregues (e marcas de resposta completa) mais antigos que a retenção."""
+        cutoff = time.time() - retention_hours * 3600
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox_replies WHERE completed_at < ?", (cutoff,))
+            return self._conn.execute(
+                "DELETE FROM outbox WHERE state = ? AND sent_at < ?", (STATE_SENT, cutoff)
+            ).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall()
+        counts = {STATE_PENDING: 0, STATE_SENT: 0, STATE_DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Instância global
+outbox = Outbox()
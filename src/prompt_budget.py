@@ -0,0 +1,89 @@
+"""
+Orçamento de Tokens do Prompt
+Cada mensagem entra no ConversationManager já com sua estimativa de tokens, e
+o prompt é montado sob PROMPT_TOKEN_BUDGET: SYSTEM_PROMPT, contexto do casal e
+a mensagem atual sempre entram; o histórico entra das mensagens mais novas
+para as mais antigas até o orçamento acabar. Aqui ficam a estimativa, o plano
+de cada prompt e o registro do consumo real (usageMetadata do Gemini).
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # Prompt inteiro (sem a resposta)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata (~4 caracteres por token em português), sem tokenizer."""
+    return len(text) // 4 + 1
+
+
+@dataclass
+class PromptPlan:
+    """Como o prompt de uma chamada foi montado."""
+    prompt_tokens: int         # Estimativa do prompt final
+    history_messages: int      # Mensagens do histórico que couberam
+    dropped_messages: int      # Mensagens mais antigas deixadas de fora pelo orçamento
+    budget: int = PROMPT_TOKEN_BUDGET
+
+
+class PromptUsageTracker:
+    """Acumula, por chamada ao Gemini, o tamanho estimado do prompt, os descartes e o usageMetadata real."""
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self.calls = 0
+        self.truncated_calls = 0
+        self.dropped_messages = 0
+        self.estimated_prompt_tokens = 0
+        self.max_estimated_prompt_tokens = 0
+        self.reported_calls = 0
+        self.reported_prompt_tokens = 0
+        self.estimated_reported_prompt_tokens = 0  # Estimativa só das chamadas com usageMetadata (para a razão)
+        self.output_tokens = 0
+        self.total_tokens = 0
+
+    def record(self, plan: PromptPlan, usage: Optional[dict], log=logger):
+        self.calls += 1
+        self.estimated_prompt_tokens += plan.prompt_tokens
+        self.max_estimated_prompt_tokens = max(self.max_estimated_prompt_tokens, plan.prompt_tokens)
+        if plan.dropped_messages:
+            self.truncated_calls += 1
+            self.dropped_messages += plan.dropped_messages
+        usage = usage or {}
+        if usage:
+            self.reported_calls += 1
+            self.reported_prompt_tokens += usage.get("promptTokenCount", 0)
+            self.estimated_reported_prompt_tokens += plan.prompt_tokens
+            self.output_tokens += usage.get("candidatesTokenCount", 0)
+            self.total_tokens += usage.get("totalTokenCount", 0)
+        log.info("gemini_prompt_usage", estimated_prompt_tokens=plan.prompt_tokens,
+                 history_messages=plan.history_messages, dropped_messages=plan.dropped_messages,
+                 prompt_tokens=usage.get("promptTokenCount"), output_tokens=usage.get("candidatesTokenCount"),
+                 total_tokens=usage.get("totalTokenCount"))
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "calls": self.calls,
+            "truncated_calls": self.truncated_calls,
+            "dropped_messages": self.dropped_messages,
+            "avg_estimated_prompt_tokens": round(self.estimated_prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "max_estimated_prompt_tokens": self.max_estimated_prompt_tokens,
+            "reported_calls": self.reported_calls,
+            "prompt_tokens": self.reported_prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            # Real / estimado: longe de 1.0 indica que a heurística de 4 caracteres por token precisa de ajuste
+            "estimate_ratio": round(self.reported_prompt_tokens / self.estimated_reported_prompt_tokens, 3)
+            if self.estimated_reported_prompt_tokens else None,
+        }
+
+
+# Instância global
+prompt_usage = PromptUsageTracker()
@@ -0,0 +1,250 @@
+"""
+Limitador de Taxa das Chamadas ao Gemini
+Dois token buckets (requisições/min e tokens/min, espelhando a cota do Gemini)
+e uma fila de prioridade na frente deles: /sos manual primeiro, depois mediação
+automática, depois conversa normal. Quando a cota acaba, quem espera é a
+conversa comum; se a espera passar do limite da prioridade (ou a fila lotar),
+o pedido de menor prioridade é descartado em vez de virar um 429.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# --- Prioridades (menor = mais urgente) ---
+PRIORITY_MANUAL_MEDIATION = 0  # /sos
+PRIORITY_AUTO_MEDIATION = 1
+PRIORITY_CHAT = 2
+PRIORITY_NAMES = {PRIORITY_MANUAL_MEDIATION: "manual_mediation", PRIORITY_AUTO_MEDIATION: "auto_mediation", PRIORITY_CHAT: "chat"}
+
+# --- Configurações (0 desliga o limite correspondente) ---
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_LIMITER_MAX_QUEUE = int(os.getenv("GEMINI_LIMITER_MAX_QUEUE", "200"))
+# Reserva para a resposta na estimativa de tokens de cada chamada
+GEMINI_LIMITER_OUTPUT_TOKENS = int(os.getenv("GEMINI_LIMITER_OUTPUT_TOKENS", "400"))
+GEMINI_LIMITER_MAX_WAIT_SECONDS = {
+    PRIORITY_MANUAL_MEDIATION: float(os.getenv("GEMINI_LIMITER_MAX_WAIT_MANUAL_SECONDS", "90")),
+    PRIORITY_AUTO_MEDIATION: float(os.getenv("GEMINI_LIMITER_MAX_WAIT_AUTO_SECONDS", "45")),
+    PRIORITY_CHAT: float(os.getenv("GEMINI_LIMITER_MAX_WAIT_CHAT_SECONDS", "20")),
+}
+
+
+class RateLimitShed(Exception):
+    """Pedido descartado pelo limitador (cota esgotada e prioridade baixa demais)."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0  # Reposição por segundo
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def seconds_until(self, amount: float) -> float:
+        return max(amount - self.tokens, 0.0) / self.rate if self.rate else 0.0
+
+
+class _Waiter:
+    __slots__ = ("priority", "cost", "future", "enqueued_at", "deadline")
+
+    def __init__(self, priority: int, cost: int, future: asyncio.Future, now: float):
+        self.priority = priority
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = now
+        self.deadline = now + GEMINI_LIMITER_MAX_WAIT_SECONDS.get(priority, GEMINI_LIMITER_MAX_WAIT_SECONDS[PRIORITY_CHAT])
+
+
+class GeminiRateLimiter:
+    """
+    acquire(tokens, priority) espera até haver cota para 1 requisição + `tokens`.
+    Um único "pump" libera os pedidos na ordem de prioridade (FIFO dentro da mesma
+    prioridade), então uma conversa comum nunca passa na frente de um /sos.
+    """
+    def __init__(self, rpm: int = GEMINI_RPM, tpm: int = GEMINI_TPM, max_queue: int = GEMINI_LIMITER_MAX_QUEUE):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_queue = max_queue
+        self._heap: list[tuple[int, int, _Waiter]] = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+        self.granted = {p: 0 for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+        self.total_wait_ms = {p: 0.0 for p in PRIORITY_NAMES}
+        self.max_wait_ms = {p: 0.0 for p in PRIORITY_NAMES}
+        self.throttled = 0
+        self.settled = 0
+        self.settled_delta = 0  # Tokens reais - reservados, acumulado
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _can_take(self, cost: int) -> bool:
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+        return (self.requests is None or self.requests.tokens >= 1) and \
+               (self.tokens is None or self.tokens.tokens >= cost)
+
+    def _take(self, cost: int):
+        if self.requests is not None:
+            self.requests.tokens -= 1
+        if self.tokens is not None:
+            self.tokens.tokens -= cost
+
+    def _record_grant(self, priority: int, waited_s: float):
+        waited_ms = waited_s * 1000
+        self.granted[priority] += 1
+        self.total_wait_ms[priority] += waited_ms
+        self.max_wait_ms[priority] = max(self.max_wait_ms[priority], waited_ms)
+
+    def _shed(self, waiter: _Waiter, reason: str):
+        self._queued -= 1
+        self.shed[waiter.priority] += 1
+        logger.warning("gemini_request_shed", priority=PRIORITY_NAMES.get(waiter.priority), reason=reason,
+                       queued=self._queued)
+        if not waiter.future.done():
+            waiter.future.set_exception(RateLimitShed(reason))
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Pega cota só se houver agora e ninguém estiver na fila (usado pelo hedging)."""
+        if not self.enabled:
+            return True
+        cost = min(tokens, int(self.tokens.capacity)) if self.tokens is not None else 0
+        if self._queued or not self._can_take(cost):
+            return False
+        self._take(cost)
+        return True
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_CHAT):
+        if not self.enabled:
+            return
+        # Um pedido maior que a cota inteira nunca caberia no bucket
+        cost = min(tokens, int(self.tokens.capacity)) if self.tokens is not None else 0
+        if not self._heap and self._can_take(cost):
+            self._take(cost)
+            self._record_grant(priority, 0.0)
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._queued >= self.max_queue:
+            # Fila cheia: sai o pedido de menor prioridade (o mais novo entre os iguais)
+            worst = max((entry for entry in self._heap if not entry[2].future.done()), default=None)
+            if worst is None or worst[0] <= priority:
+                self.shed[priority] += 1
+                raise RateLimitShed("queue_full")
+            self._shed(worst[2], "evicted_by_higher_priority")
+
+        waiter = _Waiter(priority, cost, loop.create_future(), time.monotonic())
+        heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        self._queued += 1
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._queued -= 1
+            raise
+
+    async def _run_pump(self):
+        while self._heap:
+            self._wakeup.clear()
+            now = time.monotonic()
+            # Descarta quem estourou a espera máxima da prioridade
+            for _, _, waiter in self._heap:
+                if not waiter.future.done() and now >= waiter.deadline:
+                    self._shed(waiter, "max_wait_exceeded")
+            while self._heap and self._heap[0][2].future.done():
+                heapq.heappop(self._heap)
+            if not self._heap:
+                break
+
+            waiter = self._heap[0][2]
+            if self._can_take(waiter.cost):
+                heapq.heappop(self._heap)
+                self._take(waiter.cost)
+                self._queued -= 1
+                self._record_grant(waiter.priority, now - waiter.enqueued_at)
+                waiter.future.set_result(None)
+                continue
+
+            delay = max(
+                self.requests.seconds_until(1) if self.requests is not None else 0.0,
+                self.tokens.seconds_until(waiter.cost) if self.tokens is not None else 0.0,
+            )
+            next_deadline = min(w.deadline for _, _, w in self._heap if not w.future.done())
+            delay = min(delay, max(next_deadline - now, 0.0)) + 0.001
+            try:
+                # Acorda antes se chegar um pedido novo (pode ser mais urgente)
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def note_throttled(self):
+        """O Gemini respondeu 429: zera o bucket de requisições para a cota se recompor."""
+        self.throttled += 1
+        if self.requests is not None:
+            self.requests.refill(time.monotonic())
+            self.requests.tokens = min(self.requests.tokens, 0.0)
+
+    def settle(self, reserved: int, actual: Optional[int]):
+        """
+        Acerta o bucket de tokens com o consumo real (usageMetadata.totalTokenCount):
+        devolve o que foi reservado a mais ou cobra o que faltou. actual=0 devolve a
+        reserva inteira (chamada que falhou sem gerar); None (consumo desconhecido) mantém.
+        """
+        if self.tokens is None or actual is None:
+            return
+        reserved = min(reserved, int(self.tokens.capacity))
+        self.tokens.refill(time.monotonic())
+        self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + reserved - actual)
+        self.settled += 1
+        self.settled_delta += actual - reserved
+        if self._wakeup is not None and actual < reserved:
+            self._wakeup.set()  # Sobrou cota: o pump pode liberar alguém antes do previsto
+
+    def stats(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, waiter in self._heap:
+            if not waiter.future.done():
+                queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            "enabled": self.enabled,
+            "rpm_available": round(self.requests.tokens, 1) if self.requests is not None else None,
+            "tpm_available": round(self.tokens.tokens) if self.tokens is not None else None,
+            "queued": queued,
+            "granted": {PRIORITY_NAMES[p]: n for p, n in self.granted.items()},
+            "shed": {PRIORITY_NAMES[p]: n for p, n in self.shed.items()},
+            "avg_wait_ms": {
+                PRIORITY_NAMES[p]: round(self.total_wait_ms[p] / self.granted[p], 1) if self.granted[p] else 0.0
+                for p in PRIORITY_NAMES
+            },
+            "max_wait_ms": {PRIORITY_NAMES[p]: round(self.max_wait_ms[p], 1) for p in PRIORITY_NAMES},
+            "throttled": self.throttled,
+            "settled": self.settled,
+            "settled_delta_tokens": self.settled_delta,
+        }
+
+
+# Instância global
+gemini_limiter = GeminiRateLimiter()
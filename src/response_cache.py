@@ -0,0 +1,166 @@
+"""
+Cache de Respostas de Conversa Fiada (opt-in)
+Boa parte do tráfego é "oi", "bom dia", "tudo bem?": o SYSTEM_PROMPT responde
+com um balão curto, mas cada um custava uma chamada inteira ao Gemini com todo
+o histórico. Aqui a resposta fica guardada pela mensagem normalizada + uma
+impressão digital grosseira do contexto (casal/pessoa e período do dia).
+Cada entrada guarda algumas variantes e nunca repete a última enviada, para
+as respostas não parecerem enlatadas.
+Fica de fora tudo que passou pela mediação (prioridade diferente de conversa)
+ou pela segurança (qualquer palavra-chave de risco, mesmo liberada no estágio 2).
+"""
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from logging_config import get_logger
+from safety import find_danger_keywords, fold_text
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "21600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MAX_WORDS = int(os.getenv("RESPONSE_CACHE_MAX_WORDS", "4"))      # Só mensagens curtas
+RESPONSE_CACHE_MAX_REPLY_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_REPLY_CHARS", "300"))
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))        # Variantes por entrada
+# Chance de ir ao Gemini para colher uma variante nova enquanto a entrada não está completa
+RESPONSE_CACHE_EXPLORE_RATE = float(os.getenv("RESPONSE_CACHE_EXPLORE_RATE", "0.3"))
+RESPONSE_CACHE_TIMEZONE = os.getenv("RESPONSE_CACHE_TIMEZONE", "America/Sao_Paulo")
+
+BALLOON_BREAK = "<QUEBRA>"
+
+# Períodos do dia (hora inicial, nome): "bom dia" às 23h não deve reaproveitar a resposta da manhã
+_DAYPARTS = ((0, "madrugada"), (6, "manha"), (12, "tarde"), (18, "noite"))
+
+_NON_WORD = re.compile(r"[^\w\s/]+")
+_REPEATED = re.compile(r"(\w)\1{2,}")  # "oiii" -> "oi", "bommm" -> "bom"
+
+
+def normalize_small_talk(text: str) -> str:
+    """Minúsculas, sem acentos, pontuação ou emoji, e sem letras esticadas."""
+    folded = _NON_WORD.sub(" ", fold_text(text))
+    return " ".join(_REPEATED.sub(r"\1", folded).split())
+
+
+def daypart(now: Optional[datetime] = None, tz: str = RESPONSE_CACHE_TIMEZONE) -> str:
+    hour = (now or datetime.now(ZoneInfo(tz))).hour
+    return next(name for start, name in reversed(_DAYPARTS) if hour >= start)
+
+
+class _Entry:
+    __slots__ = ("variants", "last_served", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.variants: list[str] = []
+        self.last_served: Optional[str] = None
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    LRU + TTL de {chave: variantes de resposta}.
+
+    - key_for(): chave da mensagem, ou None se ela não pode usar o cache
+    - get(): uma variante diferente da última enviada (None = chame o Gemini)
+    - put(): guarda a resposta gerada como mais uma variante
+    """
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, variants: int = RESPONSE_CACHE_VARIANTS,
+                 explore_rate: float = RESPONSE_CACHE_EXPLORE_RATE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_variants = max(variants, 1)
+        self.explore_rate = explore_rate
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.explored = 0
+        self.skipped = 0
+        self.stored = 0
+        self.evictions = 0
+
+    def key_for(self, text: str, remote_jid: str, user_name: str, couple_context: Optional[dict] = None,
+                mediation: bool = False) -> Optional[str]:
+        if not self.enabled:
+            return None
+        normalized = normalize_small_talk(text)
+        if (mediation or not normalized or len(normalized.split()) > RESPONSE_CACHE_MAX_WORDS
+                or find_danger_keywords(text)):
+            self.skipped += 1
+            return None
+        # A resposta costuma chamar a pessoa pelo nome: escopo por casal + quem falou (ou pelo chat, no privado)
+        scope = f"casal:{couple_context['couple_id']}:{user_name}" if couple_context else f"chat:{remote_jid}"
+        return f"{scope}|{daypart()}|{normalized}"
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        candidates = [v for v in entry.variants if v != entry.last_served]
+        if not candidates:
+            # Só existe a variante que acabou de ser enviada: gera outra em vez de repetir
+            self.misses += 1
+            return None
+        if len(entry.variants) < self.max_variants and random.random() < self.explore_rate:
+            self.explored += 1
+            self.misses += 1
+            return None
+        reply = random.choice(candidates)
+        entry.last_served = reply
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return reply
+
+    def put(self, key: str, reply: str):
+        # Resposta com mais de um balão (ou longa) não era conversa fiada
+        reply = reply.strip()
+        if not reply or BALLOON_BREAK in reply or len(reply) > RESPONSE_CACHE_MAX_REPLY_CHARS:
+            return
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            entry = _Entry(time.monotonic() + self.ttl)
+            self._entries[key] = entry
+        if reply not in entry.variants:
+            if len(entry.variants) >= self.max_variants:
+                entry.variants.pop(0)  # Renova a mais antiga
+            entry.variants.append(reply)
+            self.stored += 1
+        entry.last_served = reply
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "variants": sum(len(entry.variants) for entry in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "explored": self.explored,
+            "skipped": self.skipped,
+            "stored": self.stored,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Instância global
+response_cache = ResponseCache()
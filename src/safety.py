@@ -2,33 +2,72 @@
 Módulo de Segurança (Guardrails)
 Detecta conteúdo sensível e perigoso antes de processar com a IA
 """
+import abc
+import asyncio
+import os
 import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from logging_config import get_logger
 
 logger = get_logger(__name__)
 
-# Palavras-chave de alto risco (violência, suicídio, abuso)
-DANGER_KEYWORDS = [
-    # Violência física
-    "bater", "bateu", "batendo", "soco", "chute", "empurr", "agredir", "agrediu",
-    "machuc", "ferido", "sangr", "roxo", "hematoma",
-    
-    # Ameaças e medo
-    "ameaça", "ameaçou", "medo", "com medo", "assustado", "assustada",
-    "polícia", "delegacia", "denúncia", "boletim de ocorrência",
-    
-    # Suicídio e autolesão
-    "suicídio", "suicidar", "me matar", "matar-me", "acabar com tudo",
-    "não aguento mais", "quero morrer", "vou me matar",
-    "cortar os pulsos", "pular da ponte", "overdose",
-    
-    # Abuso e coerção
-    "abuso", "estupro", "forçou", "forçar", "obrigou", "obrigar",
-    "não consigo sair", "me tranca", "me prende",
-    
-    # Drogas pesadas (contexto de dependência grave)
-    "crack", "cocaína", "heroína", "viciado em",
-]
+# Palavras-chave de alto risco por categoria (violência, suicídio, abuso, drogas)
+DANGER_KEYWORDS_BY_CATEGORY = {
+    "violence": [
+        # Violência física
+        "bater", "bateu", "batendo", "soco", "chute", "empurr", "agredir", "agrediu",
+        "machuc", "ferido", "sangr", "roxo", "hematoma",
+
+        # Ameaças e medo
+        "ameaça", "ameaçou", "medo", "com medo", "assustado", "assustada",
+        "polícia", "delegacia", "denúncia", "boletim de ocorrência",
+    ],
+    "suicide": [
+        # Suicídio e autolesão
+        "suicídio", "suicidar", "me matar", "matar-me", "acabar com tudo",
+        "não aguento mais", "quero morrer", "vou me matar",
+        "cortar os pulsos", "pular da ponte", "overdose",
+    ],
+    "abuse": [
+        # Abuso e coerção
+        "abuso", "estupro", "forçou", "forçar", "obrigou", "obrigar",
+        "não consigo sair", "me tranca", "me prende",
+    ],
+    "drugs": [
+        # Drogas pesadas (contexto de dependência grave)
+        "crack", "cocaína", "heroína", "viciado em",
+    ],
+}
+
+# Lista plana (mantida para compatibilidade)
+DANGER_KEYWORDS = [kw for keywords in DANGER_KEYWORDS_BY_CATEGORY.values() for kw in keywords]
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas sem acentos: "Suicídio" -> "suicidio", "ameaça" -> "ameaca"."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _compile_danger_matcher(keywords_by_category: dict) -> tuple[re.Pattern, dict]:
+    """
+    Compila todas as palavras-chave em uma única regex de alternação (uma passada no texto).
+    As alternativas vão da maior para a menor para "com medo" ganhar de "medo".
+    """
+    lookup = {}
+    for category, keywords in keywords_by_category.items():
+        for keyword in keywords:
+            lookup.setdefault(fold_text(keyword), (keyword, category))
+    alternatives = sorted(lookup, key=len, reverse=True)
+    # \b só no início: "machuc" pega "machucou", "empurr" pega "empurrão" (mesma regra de antes)
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(a) for a in alternatives) + ")")
+    return pattern, lookup
+
+
+_DANGER_PATTERN, _DANGER_LOOKUP = _compile_danger_matcher(DANGER_KEYWORDS_BY_CATEGORY)
 
 # Mensagem de emergência estática (não personalizada)
 EMERGENCY_MESSAGE = """⚠️ **Conteúdo Sensível Detectado**
@@ -43,6 +82,18 @@ Se você ou alguém está em perigo imediato:
 Procure ajuda profissional especializada. Você não está sozinho(a).
 """
 
+def find_danger_keywords(text: str) -> list[tuple[str, str]]:
+    """
+    Encontra todas as palavras-chave perigosas do texto em uma única passada.
+    
+    Args:
+        text: Texto da mensagem do usuário
+        
+    Returns:
+        Lista de (palavra_chave, categoria) na ordem em que aparecem
+    """
+    return [_DANGER_LOOKUP[m.group(0)] for m in _DANGER_PATTERN.finditer(fold_text(text))]
+
 def contains_danger_keywords(text: str) -> bool:
     """
     Verifica se o texto contém palavras-chave perigosas.
@@ -53,14 +104,15 @@ def contains_danger_keywords(text: str) -> bool:
     Returns:
         True se contém palavras perigosas, False caso contrário
     """
-    text_lower = text.lower()
-    
-    for keyword in DANGER_KEYWORDS:
-        # Usa regex para detectar palavra completa ou parte dela
-        pattern = r'\b' + re.escape(keyword)
-        if re.search(pattern, text_lower):
-            logger.warning("danger_keyword_detected", keyword=keyword, text_preview=text[:50])
-            return True
+    hits = find_danger_keywords(text)
+    if hits:
+        logger.warning(
+            "danger_keyword_detected",
+            keyword=hits[0][0],
+            categories=sorted({category for _, category in hits}),
+            text_preview=text[:50],
+        )
+        return True
     
     return False
 
@@ -79,3 +131,199 @@ def should_block_message(text: str) -> tuple[bool, str]:
         return (True, EMERGENCY_MESSAGE)
     
     return (False, "")
+
+
+# --- Pipeline em Estágios ---
+# Estágio 1 (léxico, ~0 custo) libera o texto sem nenhuma palavra-chave e bloqueia
+# palavras inequívocas. Só quando TODAS as palavras encontradas são ambíguas
+# ("bater papo", "chute", "medo de barata") o texto vai para o estágio 2, mais caro.
+
+# Palavras de uso figurado comum ("bater papo", "chute no escuro", "medo de barata").
+# Relatos explícitos ("bateu", "soco", "forçou", "polícia"...) NUNCA entram aqui: bloqueiam
+# no estágio 1, sem depender do veredito de um classificador
+AMBIGUOUS_KEYWORDS = {
+    "bater", "chute", "roxo", "medo", "com medo", "assustado", "assustada",
+}
+
+SAFETY_STAGE1_BUDGET_MS = float(os.getenv("SAFETY_STAGE1_BUDGET_MS", "5"))
+SAFETY_STAGE2_BUDGET_MS = float(os.getenv("SAFETY_STAGE2_BUDGET_MS", "1500"))
+# "local" (stub heurístico, padrão) ou "gemini" (classificação por LLM)
+SAFETY_SECOND_STAGE = os.getenv("SAFETY_SECOND_STAGE", "local").lower()
+SAFETY_CACHE_SIZE = int(os.getenv("SAFETY_CACHE_SIZE", "10000"))
+SAFETY_CACHE_TTL_SECONDS = float(os.getenv("SAFETY_CACHE_TTL_SECONDS", "3600"))
+
+
+@dataclass
+class SafetyVerdict:
+    blocked: bool
+    stage: str  # "lexical", "classifier", "cache", "timeout" ou "error"
+    categories: list[str] = field(default_factory=list)
+    latency_ms: float = 0.0
+
+
+class SafetyClassifier(abc.ABC):
+    """Interface do estágio 2. `classify` retorna True se a mensagem deve ser bloqueada."""
+    name = "base"
+
+    @abc.abstractmethod
+    async def classify(self, text: str, hits: list[tuple[str, str]]) -> bool:
+        ...
+
+
+class LocalStubClassifier(SafetyClassifier):
+    """
+    Classificador local (sem rede): remove expressões idiomáticas inofensivas
+    e bloqueia se ainda sobrar alguma palavra-chave.
+    """
+    name = "local"
+
+    BENIGN_PHRASES = [
+        "bater papo", "bater um papo", "bater perna", "bater o ponto", "bater meta", "bater a meta",
+        "bater o martelo", "bater bolo", "bateu saudade", "bateu a saudade", "bateu uma saudade",
+        "bateu o sono", "bateu fome", "bateu uma fome", "coracao batendo", "chute no escuro",
+        "dar um chute", "chutar o balde", "roxo de saudade", "roxo de vontade", "morrendo de medo de barata",
+        "medo de barata", "medo de aviao", "medo de altura", "medo de escuro", "filme de terror",
+        "forcar a barra", "forcou a barra",
+    ]
+
+    def __init__(self):
+        self._benign = re.compile("|".join(re.escape(p) for p in sorted(self.BENIGN_PHRASES, key=len, reverse=True)))
+
+    async def classify(self, text: str, hits: list[tuple[str, str]]) -> bool:
+        return bool(find_danger_keywords(self._benign.sub(" ", fold_text(text))))
+
+
+class GeminiSafetyClassifier(SafetyClassifier):
+    """Pergunta ao Gemini (prompt curto, poucos tokens) se a mensagem indica risco real."""
+    name = "gemini"
+
+    PROMPT = (
+        "Você é um classificador de segurança. A mensagem abaixo foi enviada em um grupo de WhatsApp de um casal. "
+        "Responda apenas BLOQUEAR se ela indicar violência, abuso, risco de suicídio ou dependência química reais; "
+        "caso contrário responda apenas OK.\n\nMensagem: {text}"
+    )
+
+    async def classify(self, text: str, hits: list[tuple[str, str]]) -> bool:
+        from rate_limiter import PRIORITY_MANUAL_MEDIATION
+        from services import call_gemini
+
+        payload = {
+            "contents": [{"parts": [{"text": self.PROMPT.format(text=text)}]}],
+            "generationConfig": {"temperature": 0.0, "maxOutputTokens": 5},
+        }
+        # Mesma cota e mesmos circuit breakers das respostas; a checagem segura a mensagem, então vai na frente
+        data = await call_gemini(payload, PRIORITY_MANUAL_MEDIATION)
+        answer = data["candidates"][0]["content"]["parts"][0]["text"]
+        return "BLOQUEAR" in answer.upper()
+
+
+class SafetyPipeline:
+    """
+    Executa os estágios com orçamento de latência e cache por texto normalizado.
+    Se o estágio 2 estourar o orçamento ou falhar, bloqueia (fail-safe).
+    """
+    def __init__(self, classifier: SafetyClassifier, stage1_budget_ms: float = SAFETY_STAGE1_BUDGET_MS,
+                 stage2_budget_ms: float = SAFETY_STAGE2_BUDGET_MS, cache_size: int = SAFETY_CACHE_SIZE,
+                 cache_ttl: float = SAFETY_CACHE_TTL_SECONDS):
+        self.classifier = classifier
+        self.stage1_budget_ms = stage1_budget_ms
+        self.stage2_budget_ms = stage2_budget_ms
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, tuple[float, bool]]" = OrderedDict()
+        self.counters = {"safe": 0, "blocked_lexical": 0, "ambiguous": 0, "blocked_classifier": 0,
+                         "cache_hits": 0, "stage2_timeouts": 0, "stage2_errors": 0}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(fold_text(text).split())
+
+    def _cache_get(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, blocked = entry
+        if time.monotonic() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return blocked
+
+    def _cache_put(self, key: str, blocked: bool):
+        self._cache[key] = (time.monotonic(), blocked)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def evaluate(self, text: str) -> SafetyVerdict:
+        started = time.perf_counter()
+
+        # --- Estágio 1: léxico ---
+        hits = find_danger_keywords(text)
+        stage1_ms = (time.perf_counter() - started) * 1000
+        if stage1_ms > self.stage1_budget_ms:
+            logger.warning("safety_stage1_over_budget", latency_ms=round(stage1_ms, 2))
+        categories = sorted({category for _, category in hits})
+
+        if not hits:
+            self.counters["safe"] += 1
+            return SafetyVerdict(False, "lexical", latency_ms=stage1_ms)
+        if any(keyword not in AMBIGUOUS_KEYWORDS for keyword, _ in hits):
+            self.counters["blocked_lexical"] += 1
+            logger.warning("danger_keyword_detected", keywords=[k for k, _ in hits], categories=categories,
+                           text_preview=text[:50])
+            return SafetyVerdict(True, "lexical", categories, stage1_ms)
+
+        # --- Estágio 2: só para textos ambíguos ---
+        self.counters["ambiguous"] += 1
+        key = self.normalize(text)
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.counters["cache_hits"] += 1
+            return SafetyVerdict(cached, "cache", categories, (time.perf_counter() - started) * 1000)
+
+        try:
+            blocked = await asyncio.wait_for(self.classifier.classify(text, hits),
+                                             timeout=self.stage2_budget_ms / 1000)
+        except asyncio.TimeoutError:
+            self.counters["stage2_timeouts"] += 1
+            logger.warning("safety_stage2_timeout", classifier=self.classifier.name, budget_ms=self.stage2_budget_ms)
+            return SafetyVerdict(True, "timeout", categories, (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            self.counters["stage2_errors"] += 1
+            logger.error("safety_stage2_failed", classifier=self.classifier.name, error=str(e))
+            return SafetyVerdict(True, "error", categories, (time.perf_counter() - started) * 1000)
+
+        self._cache_put(key, blocked)
+        if blocked:
+            self.counters["blocked_classifier"] += 1
+        latency_ms = (time.perf_counter() - started) * 1000
+        logger.info("safety_stage2_verdict", classifier=self.classifier.name, blocked=blocked,
+                    categories=categories, latency_ms=round(latency_ms, 2))
+        return SafetyVerdict(blocked, "classifier", categories, latency_ms)
+
+    def stats(self) -> dict:
+        return {"classifier": self.classifier.name, "cache_size": len(self._cache), **self.counters}
+
+
+def build_safety_pipeline() -> SafetyPipeline:
+    classifier = GeminiSafetyClassifier() if SAFETY_SECOND_STAGE == "gemini" else LocalStubClassifier()
+    return SafetyPipeline(classifier)
+
+
+# Instância global; troque o estágio 2 com safety_pipeline.classifier = MeuClassificador()
+safety_pipeline = build_safety_pipeline()
+
+
+async def evaluate_message(text: str) -> tuple[bool, str]:
+    """
+    Versão em estágios do should_block_message (usada no fluxo do Gemini).
+    
+    Returns:
+        Tupla (should_block: bool, emergency_msg: str)
+    """
+    verdict = await safety_pipeline.evaluate(text)
+    if verdict.blocked:
+        logger.critical("message_blocked_safety", stage=verdict.stage, categories=verdict.categories)
+        return (True, EMERGENCY_MESSAGE)
+    return (False, "")
@@ -0,0 +1,270 @@
+"""
+Cache Semântico de Quase-Duplicatas (opt-in)
+Muitas mensagens são paráfrases ("me dá uma dica de jantar", "dica de jantar
+pra hoje?"). Cada prompt vira uma assinatura MinHash calculada localmente
+(sem modelo externo) sobre os termos normalizados; um índice LSH por casal
+guarda os pares prompt→resposta recentes e, se um prompt novo tiver
+similaridade (Jaccard) acima do limite e no máximo SEMANTIC_CACHE_MAX_TERM_DIFF
+termos de diferença, a resposta é reaproveitada sem chamar o Gemini. Trocar
+um termo por outro ("frango" x "peixe") já são dois termos de diferença e
+nunca casa; negações e números diferentes também não ("quero" x "não quero").
+Mediação e mensagens com alerta de segurança ficam de fora, como no
+response_cache.
+"""
+import hashlib
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from logging_config import get_logger
+from safety import find_danger_keywords, fold_text
+
+logger = get_logger(__name__)
+
+# --- Configurações ---
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.65"))    # Jaccard mínimo para reaproveitar
+# Termos que só um dos lados tem (diferença simétrica): 1 aceita "hoje" a mais, mas não uma troca
+SEMANTIC_CACHE_MAX_TERM_DIFF = int(os.getenv("SEMANTIC_CACHE_MAX_TERM_DIFF", "1"))
+SEMANTIC_CACHE_NUM_PERM = int(os.getenv("SEMANTIC_CACHE_NUM_PERM", "64"))         # Tamanho da assinatura
+SEMANTIC_CACHE_BANDS = int(os.getenv("SEMANTIC_CACHE_BANDS", "16"))               # Faixas do LSH (NUM_PERM / BANDS linhas cada)
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_PER_SCOPE = int(os.getenv("SEMANTIC_CACHE_MAX_PER_SCOPE", "200"))  # Pares por casal/chat
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "2000"))
+SEMANTIC_CACHE_MIN_TERMS = int(os.getenv("SEMANTIC_CACHE_MIN_TERMS", "2"))        # "oi" fica com o response_cache
+SEMANTIC_CACHE_MAX_TERMS = int(os.getenv("SEMANTIC_CACHE_MAX_TERMS", "30"))       # Mensagem longa depende demais do contexto
+
+_PRIME = (1 << 61) - 1
+_WORD = re.compile(r"\w+")
+
+# Palavras que não mudam o pedido (já sem acento, como sai do fold_text)
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de da do das dos ao aos em no na nos nas num numa pra pro pras pros para por pelo pela
+com e ou que me te se eu tu voce vc vcs ele ela nos gente ai la ne ta to tb tambem ja so isso esse essa
+isto este esta aquele aquela meu minha seu sua nosso nossa mim ti lhe algum alguma qual quais como
+oi ola opa ei hein kk kkk rs favor pf pfv tem teria posso poderia pode podia consegue queria gostaria
+""".split())
+# Mudam o sentido mesmo com o resto igual: precisam bater dos dois lados
+NEGATIONS = frozenset({"nao", "nunca", "nem", "jamais", "nada", "ninguem", "nenhum", "nenhuma", "sem"})
+
+
+def _stem(term: str) -> str:
+    """
+    Só tira o plural ("dicas" -> "dica", "japoneses" -> "japones", "mulheres" -> "mulher").
+    Sem cortar o radical: "namorada" e "namorado" continuam termos diferentes.
+    """
+    if len(term) > 4 and term.endswith("es") and term[-3] in "rsz":
+        return term[:-2]
+    if len(term) > 3 and term.endswith("s"):
+        return term[:-1]
+    return term
+
+
+def extract_terms(text: str) -> list[str]:
+    return [_stem(word) for word in _WORD.findall(fold_text(text)) if word not in STOPWORDS]
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHasher:
+    """MinHash com permutações (a*h + b) mod p geradas de uma semente fixa (assinaturas estáveis)."""
+
+    def __init__(self, num_perm: int = SEMANTIC_CACHE_NUM_PERM, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, terms: frozenset) -> tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "big") for t in terms]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms)
+
+
+@dataclass
+class SemanticProbe:
+    """Mensagem já processada (termos, assinatura, escopo): usada no lookup e depois no add."""
+    scope: str
+    user_name: str
+    terms: frozenset
+    guard: tuple[frozenset, frozenset]  # (negações, números)
+    signature: tuple[int, ...]
+
+
+@dataclass
+class _Entry:
+    terms: frozenset
+    guard: tuple[frozenset, frozenset]
+    signature: tuple[int, ...]
+    reply: str
+    user_name: str
+    expires_at: float
+
+
+class _ScopeIndex:
+    """Índice LSH de um casal/chat: cada faixa da assinatura aponta para os ids das entradas."""
+
+    def __init__(self, bands: int, rows: int):
+        self.bands = bands
+        self.rows = rows
+        self.entries: OrderedDict[int, _Entry] = OrderedDict()
+        self.buckets: list[dict[tuple, set[int]]] = [{} for _ in range(bands)]
+
+    def _band_keys(self, signature: tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, entry_id: int, entry: _Entry):
+        self.entries[entry_id] = entry
+        for band, key in self._band_keys(entry.signature):
+            self.buckets[band].setdefault(key, set()).add(entry_id)
+
+    def remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        for band, key in self._band_keys(entry.signature):
+            ids = self.buckets[band].get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.buckets[band][key]
+
+    def candidates(self, signature: tuple[int, ...]) -> set[int]:
+        found: set[int] = set()
+        for band, key in self._band_keys(signature):
+            ids = self.buckets[band].get(key)
+            if ids:
+                found |= ids
+        return found
+
+
+class SemanticCache:
+    """
+    Um _ScopeIndex por casal (ou chat privado), com LRU de escopos e de pares.
+
+    - probe(): prepara a mensagem, ou None se ela não pode usar o cache
+    - lookup(): resposta de um prompt parecido o bastante (None = chame o Gemini)
+    - add(): guarda o par prompt→resposta gerado
+    """
+    def __init__(self, enabled: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_term_diff: int = SEMANTIC_CACHE_MAX_TERM_DIFF, num_perm: int = SEMANTIC_CACHE_NUM_PERM,
+                 bands: int = SEMANTIC_CACHE_BANDS,
+                 ttl: float = SEMANTIC_CACHE_TTL_SECONDS, max_per_scope: int = SEMANTIC_CACHE_MAX_PER_SCOPE,
+                 max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES):
+        if num_perm % bands:
+            raise ValueError("SEMANTIC_CACHE_NUM_PERM deve ser múltiplo de SEMANTIC_CACHE_BANDS")
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_term_diff = max_term_diff
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ttl = ttl
+        self.max_per_scope = max_per_scope
+        self.max_scopes = max_scopes
+        self._scopes: OrderedDict[str, _ScopeIndex] = OrderedDict()
+        self._ids = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.rejected = 0  # Candidatos do LSH descartados (Jaccard baixo, termo trocado, negação/número ou nome)
+        self.stored = 0
+        self.evictions = 0
+        self.candidates_checked = 0
+        self.total_lookup_us = 0.0
+
+    def probe(self, text: str, remote_jid: str, user_name: str, couple_context: Optional[dict] = None,
+              mediation: bool = False) -> Optional[SemanticProbe]:
+        if not self.enabled:
+            return None
+        terms = extract_terms(text)
+        unique = frozenset(terms)
+        if (mediation or len(unique) < SEMANTIC_CACHE_MIN_TERMS or len(terms) > SEMANTIC_CACHE_MAX_TERMS
+                or find_danger_keywords(text)):
+            self.skipped += 1
+            return None
+        scope = f"casal:{couple_context['couple_id']}" if couple_context else f"chat:{remote_jid}"
+        guard = (unique & NEGATIONS, frozenset(t for t in unique if t.isdigit()))
+        return SemanticProbe(scope, user_name, unique, guard, self.hasher.signature(unique))
+
+    def lookup(self, probe: SemanticProbe) -> Optional[str]:
+        started = time.perf_counter()
+        index = self._scopes.get(probe.scope)
+        best, best_score = None, 0.0
+        if index is not None:
+            now = time.monotonic()
+            for entry_id in index.candidates(probe.signature):
+                entry = index.entries[entry_id]
+                if entry.expires_at <= now:
+                    index.remove(entry_id)
+                    continue
+                self.candidates_checked += 1
+                score = jaccard(probe.terms, entry.terms)
+                if (score < self.threshold or len(probe.terms ^ entry.terms) > self.max_term_diff
+                        or entry.guard != probe.guard or not self._same_audience(entry, probe)):
+                    self.rejected += 1
+                    continue
+                if score > best_score:
+                    best, best_score = entry_id, score
+            self._scopes.move_to_end(probe.scope)
+        self.total_lookup_us += (time.perf_counter() - started) * 1_000_000
+        if best is None:
+            self.misses += 1
+            return None
+        index.entries.move_to_end(best)
+        self.hits += 1
+        logger.info("semantic_cache_hit", scope=probe.scope, similarity=round(best_score, 2))
+        return index.entries[best].reply
+
+    @staticmethod
+    def _same_audience(entry: _Entry, probe: SemanticProbe) -> bool:
+        """Resposta gerada para o parceiro só serve se não chamar o parceiro pelo nome."""
+        if entry.user_name == probe.user_name or not entry.user_name:
+            return True
+        return fold_text(entry.user_name.split()[0]) not in fold_text(entry.reply)
+
+    def add(self, probe: SemanticProbe, reply: str):
+        reply = reply.strip()
+        if not reply:
+            return
+        index = self._scopes.get(probe.scope)
+        if index is None:
+            index = self._scopes[probe.scope] = _ScopeIndex(self.bands, self.rows)
+            while len(self._scopes) > self.max_scopes:
+                _, dropped = self._scopes.popitem(last=False)
+                self.evictions += len(dropped.entries)
+        self._scopes.move_to_end(probe.scope)
+        self._ids += 1
+        index.add(self._ids, _Entry(probe.terms, probe.guard, probe.signature, reply, probe.user_name,
+                                    time.monotonic() + self.ttl))
+        self.stored += 1
+        while len(index.entries) > self.max_per_scope:
+            index.remove(next(iter(index.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self._scopes.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "scopes": len(self._scopes),
+            "entries": sum(len(index.entries) for index in self._scopes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "rejected": self.rejected,
+            "stored": self.stored,
+            "evictions": self.evictions,
+            "avg_candidates": round(self.candidates_checked / lookups, 2) if lookups else 0.0,
+            "avg_lookup_us": round(self.total_lookup_us / lookups, 1) if lookups else 0.0,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Instância global
+semantic_cache = SemanticCache()
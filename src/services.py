@@ -1,5 +1,7 @@
 import os
+import json
 import httpx
+from typing import AsyncIterator
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -8,6 +10,17 @@ from tenacity import (
 )
 import base64
 from logging_config import get_logger
+from http_clients import http_clients
+from circuit_breaker import CircuitOpenError, ModelRouter, GEMINI_FALLBACK_MODELS
+from prompt_budget import PROMPT_TOKEN_BUDGET, PromptPlan, estimate_tokens, prompt_usage
+from rate_limiter import (
+    gemini_limiter,
+    RateLimitShed,
+    PRIORITY_CHAT,
+    GEMINI_LIMITER_OUTPUT_TOKENS,
+)
+from response_cache import response_cache
+from semantic_cache import semantic_cache
 
 logger = get_logger(__name__)
 
@@ -19,6 +32,14 @@ INSTANCE_NAME = os.getenv("INSTANCE_NAME", "NosAi-Bot1")
 # --- Configurações Google Gemini (REST API Puro) ---
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("MODEL_NAME") or os.getenv("GEMINI_MODEL") or "gemini-2.0-flash-exp"
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+# Streaming (SSE): o primeiro balão sai antes de a geração terminar
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "false").lower() == "true"
+# Cadeia de modelos com circuit breaker (GEMINI_FALLBACK_MODELS, ex: "gemini-2.0-flash-lite")
+gemini_router = ModelRouter([GEMINI_MODEL, *GEMINI_FALLBACK_MODELS])
+
+# Resposta quando o limitador descarta a chamada (cota do Gemini esgotada)
+BUSY_REPLY = "Tô com muita gente falando comigo agora 😅 Me chama de novo daqui a pouquinho?"
 
 SYSTEM_PROMPT = """
 **[DISCLAIMER OBRIGATÓRIO - LEIA PRIMEIRO]**
@@ -84,27 +105,23 @@ Sua função é fortalecer a relação com conselhos pontuais e naturais.
 Seja empático, curioso e prático. Entenda primeiro, aconselhe depois.
 """
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((httpx.ConnectError, httpx.TimeoutException)),
-    reraise=True,
-)
-async def generate_ai_content_http(user_text: str, user_name: str, history_text: str = ""):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GOOGLE_API_KEY}"
-    
+def build_prompt_text(user_text: str, user_name: str, history_text: str = "") -> str:
     # Prompt combinado com histórico
     # FORÇAR BREVIDADE: Adiciona instrução no final para vencer o viés do histórico
-    full_prompt = (
+    return (
         f"{SYSTEM_PROMPT}\n\n"
         f"{history_text}\n\n"
         f"O usuário {user_name} disse: {user_text}\n"
         f"(IMPORTANTE: Responda como um amigo no WhatsApp. Máximo 2 frases curtas. Sem listas. Sem titubeios.)"
     )
 
-    payload = {
+# Parte fixa do prompt (SYSTEM_PROMPT + moldura), estimada uma vez só
+PROMPT_FIXED_TOKENS = estimate_tokens(build_prompt_text("", "", ""))
+
+def build_gemini_payload(user_text: str, user_name: str, history_text: str = "") -> dict:
+    return {
         "contents": [{
-            "parts": [{"text": full_prompt}]
+            "parts": [{"text": build_prompt_text(user_text, user_name, history_text)}]
         }],
         "generationConfig": {
             "temperature": 0.8,  # Mais criativo e empático
@@ -113,30 +130,105 @@ async def generate_ai_content_http(user_text: str, user_name: str, history_text:
             "topK": 40
         }
     }
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(url, json=payload, headers={"Content-Type": "application/json"})
-        response.raise_for_status()
-        return response.json()
 
-async def process_message(user_text: str, user_name: str, remote_jid: str = "unknown", couple_context: dict = None) -> str:
+def estimate_request_tokens(payload: dict) -> int:
+    """Tokens que a chamada deve consumir da cota: prompt estimado + reserva para a resposta."""
+    prompt = payload["contents"][0]["parts"][0]["text"]
+    return estimate_tokens(prompt) + GEMINI_LIMITER_OUTPUT_TOKENS
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception_type((httpx.ConnectError, httpx.TimeoutException)),
+    reraise=True,
+)
+async def generate_ai_content_http(user_text: str, user_name: str, history_text: str = "", priority: int = PRIORITY_CHAT):
+    return await call_gemini(build_gemini_payload(user_text, user_name, history_text), priority)
+
+async def call_gemini(payload: dict, priority: int = PRIORITY_CHAT) -> dict:
+    """generateContent passando pelo limitador (cota + prioridade) e pelos circuit breakers/fallback."""
+    cost = estimate_request_tokens(payload)
+
+    # Espera cota (RPM/TPM) na fila de prioridade; pode levantar RateLimitShed
+    await gemini_limiter.acquire(cost, priority)
+    # Modelo principal ou fallback, conforme os circuit breakers; o hedge só sai se houver cota livre.
+    # Cada reserva (a principal e a de cada hedge) é acertada só com o consumo da própria tentativa
+    return await gemini_router.call(
+        lambda model: _generate_with_model(model, payload),
+        hedge_allowed=lambda: gemini_limiter.try_acquire(cost),
+        settle=lambda hedge, outcome: _settle_attempt(cost, outcome),
+    )
+
+def _settle_attempt(cost: int, outcome):
+    """Acerta a reserva de uma tentativa (principal ou hedge) conforme o desfecho dela."""
+    if isinstance(outcome, dict):
+        # A reserva era uma estimativa: acerta a cota de TPM com o consumo informado pelo Gemini
+        gemini_limiter.settle(cost, outcome.get("usageMetadata", {}).get("totalTokenCount"))
+    elif isinstance(outcome, (httpx.HTTPStatusError, CircuitOpenError)):
+        gemini_limiter.settle(cost, 0)  # O Gemini respondeu com erro (ou nem foi chamado): nada gerado, devolve
+    # Cancelada (perdeu a corrida), timeout ou erro de rede: o pedido pode ter sido processado, a reserva fica
+
+async def _generate_with_model(model: str, payload: dict) -> dict:
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:generateContent?key={GOOGLE_API_KEY}"
+    client = http_clients.get("gemini")
+    response = await client.post(url, json=payload, headers={"Content-Type": "application/json"})
+    if response.status_code == 429:
+        gemini_limiter.note_throttled()
+    response.raise_for_status()
+    return response.json()
+
+async def stream_ai_content_http(user_text: str, user_name: str, history_text: str = "", priority: int = PRIORITY_CHAT,
+                                 usage: dict = None) -> AsyncIterator[str]:
+    """
+    Versão streaming (SSE) do generate_ai_content_http.
+    Gera os pedaços de texto conforme o Gemini vai produzindo.
+    O usageMetadata do stream é copiado para `usage`, se informado.
+    """
+    payload = build_gemini_payload(user_text, user_name, history_text)
+    cost = estimate_request_tokens(payload)
+    usage = {} if usage is None else usage
+
+    await gemini_limiter.acquire(cost, priority)
+    async for text in gemini_router.stream(lambda model: _stream_with_model(model, payload, usage)):
+        yield text
+    gemini_limiter.settle(cost, usage.get("totalTokenCount"))
+
+async def _stream_with_model(model: str, payload: dict, usage: dict) -> AsyncIterator[str]:
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={GOOGLE_API_KEY}"
+    client = http_clients.get("gemini")
+    async with client.stream("POST", url, json=payload, headers={"Content-Type": "application/json"}) as response:
+        if response.status_code == 429:
+            gemini_limiter.note_throttled()
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = json.loads(line[len("data:"):])
+            if "usageMetadata" in chunk:
+                usage.update(chunk["usageMetadata"])  # Vem acumulado; o último pedaço traz o total
+            for candidate in chunk.get("candidates", []):
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+
+async def _prepare_generation(user_text: str, user_name: str, remote_jid: str, couple_context: dict,
+                              log) -> tuple[str, str, PromptPlan]:
+    """
+    Etapas comuns antes de chamar o Gemini: guardrail, histórico e contexto do casal.
+    Retorna (mensagem_de_emergencia, historico, plano do prompt). Se a primeira vier preenchida, não gere nada.
+    """
     # Importação local para evitar ciclo se memory importar services (embora não importe agora)
     from memory import conversation_manager
-    from safety import should_block_message  # Import do módulo de segurança
-    
-    log = logger.bind(user_name=user_name, jid=remote_jid)
-    
-    # 🚨 GUARDRAIL: Verifica conteúdo perigoso ANTES de processar
-    should_block, emergency_msg = should_block_message(user_text)
+    from safety import evaluate_message  # Import do módulo de segurança
+
+    # 🚨 GUARDRAIL: Verifica conteúdo perigoso ANTES de processar (léxico + estágio 2 só se ambíguo)
+    should_block, emergency_msg = await evaluate_message(user_text)
     if should_block:
         log.critical("message_blocked_by_safety", user=user_name)
         # NÃO registra a mensagem perigosa na memória para evitar armazenar evidências sensíveis
-        return emergency_msg
-    
-    # 1. Recupera histórico
-    history_str = conversation_manager.get_formatted_history(remote_jid)
+        return emergency_msg, "", None
     
-    # 2. Injeta Contexto dos Casais (Nomes vs Números)
+    # 1. Injeta Contexto dos Casais (Nomes vs Números)
     context_instruction = ""
     if couple_context:
         # Ex: "Contexto: O usuário atual é Julio. O parceiro é Tainá (55279...)."
@@ -148,15 +240,70 @@ async def process_message(user_text: str, user_name: str, remote_jid: str = "unk
             f"Sempre se refira a eles pelos nomes. Se eles mencionarem '@...', entenda que é o parceiro.\n"
         )
     
+    # 2. Recupera histórico sob o orçamento: SYSTEM_PROMPT, contexto e mensagem atual sempre entram,
+    # o histórico fica com o que sobrar (mais novas primeiro). Hidrata do backend numa thread, se preciso.
+    await conversation_manager.load(remote_jid)
+    fixed_tokens = (PROMPT_FIXED_TOKENS + estimate_tokens(context_instruction)
+                    + estimate_tokens(user_text) + estimate_tokens(user_name))
+    history_str, kept, dropped, history_tokens = conversation_manager.get_history_within_budget(
+        remote_jid, PROMPT_TOKEN_BUDGET - fixed_tokens
+    )
+    if dropped:
+        log.info("prompt_history_truncated", kept_messages=kept, dropped_messages=dropped)
+    plan = PromptPlan(fixed_tokens + history_tokens, kept, dropped)
+    
     # 3. Registra mensagem do usuário na memória (só se passou pelo guardrail)
     conversation_manager.add_message(remote_jid, "user", user_text, user_name)
 
+    log.info("calling_gemini_rest", model=GEMINI_MODEL, history_len=len(history_str), prompt_tokens=plan.prompt_tokens)
+    full_text_start = f"{context_instruction}\n{history_str}" if couple_context else history_str
+    return "", full_text_start, plan
+
+def _lookup_cached_reply(user_text: str, user_name: str, remote_jid: str, couple_context: dict, priority: int,
+                         log) -> tuple[str, tuple]:
+    """
+    Tenta o cache exato de conversa fiada e depois o de quase-duplicatas.
+    Retorna (resposta ou "", chaves para guardar a resposta gerada no miss).
+    """
+    mediation = priority != PRIORITY_CHAT
+    cache_key = response_cache.key_for(user_text, remote_jid, user_name, couple_context, mediation=mediation)
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached:
+        log.info("response_cache_hit")
+        return cached, (None, None)
+    probe = semantic_cache.probe(user_text, remote_jid, user_name, couple_context, mediation=mediation)
+    cached = semantic_cache.lookup(probe) if probe else None
+    if cached:
+        return cached, (None, None)
+    return "", (cache_key, probe)
+
+def _store_cached_reply(cache_keys: tuple, reply: str):
+    cache_key, probe = cache_keys
+    if cache_key:
+        response_cache.put(cache_key, reply)
+    if probe:
+        semantic_cache.add(probe, reply)
+
+async def process_message(user_text: str, user_name: str, remote_jid: str = "unknown", couple_context: dict = None,
+                          priority: int = PRIORITY_CHAT) -> str:
+    from memory import conversation_manager
+    
+    log = logger.bind(user_name=user_name, jid=remote_jid)
+    
+    emergency_msg, full_text_start, plan = await _prepare_generation(user_text, user_name, remote_jid, couple_context, log)
+    if emergency_msg:
+        return emergency_msg
+
+    # Conversa fiada ou paráfrase recente pode vir do cache; mediação nunca
+    cached, cache_keys = _lookup_cached_reply(user_text, user_name, remote_jid, couple_context, priority, log)
+    if cached:
+        conversation_manager.add_message(remote_jid, "model", cached)
+        return cached
+
     try:
-        log.info("calling_gemini_rest", model=GEMINI_MODEL, history_len=len(history_str))
-        
-        # 3. Chamada REST com histórico E contexto
-        full_text_start = f"{context_instruction}\n{history_str}" if couple_context else history_str
-        data = await generate_ai_content_http(user_text, user_name, full_text_start)
+        # Chamada REST com histórico E contexto
+        data = await generate_ai_content_http(user_text, user_name, full_text_start, priority)
+        prompt_usage.record(plan, data.get("usageMetadata"), log)
         
         try:
             # Extrai texto do JSON complexo do Gemini
@@ -164,6 +311,7 @@ async def process_message(user_text: str, user_name: str, remote_jid: str = "unk
             
             # 4. Registra resposta da IA na memória
             conversation_manager.add_message(remote_jid, "model", ai_text)
+            _store_cached_reply(cache_keys, ai_text)
             
             return ai_text
         except (KeyError, IndexError) as e:
@@ -172,10 +320,69 @@ async def process_message(user_text: str, user_name: str, remote_jid: str = "unk
                 return "Sinto que tocamos em um ponto delicado. Vamos tentar falar de outra forma? 🌿"
             return "Fiquei sem palavras. Pode repetir?"
 
+    except RateLimitShed as e:
+        log.warning("gemini_request_shed", reason=str(e))
+        return BUSY_REPLY
     except Exception as e:
         log.error("gemini_rest_failed", error=str(e))
         return "Minha intuição falhou por um instante (erro técnico). Tente novamente! 🧠✨"
 
+async def process_message_stream(user_text: str, user_name: str, remote_jid: str = "unknown", couple_context: dict = None,
+                                 priority: int = PRIORITY_CHAT) -> AsyncIterator[str]:
+    """
+    Igual ao process_message, mas gera os balões prontos conforme o Gemini faz streaming.
+    O primeiro balão sai assim que aparece um <QUEBRA> (ou uma frase passa do limite),
+    sem esperar a geração inteira.
+    """
+    from memory import conversation_manager
+
+    log = logger.bind(user_name=user_name, jid=remote_jid)
+
+    emergency_msg, full_text_start, plan = await _prepare_generation(user_text, user_name, remote_jid, couple_context, log)
+    if emergency_msg:
+        yield emergency_msg
+        return
+
+    cached, cache_keys = _lookup_cached_reply(user_text, user_name, remote_jid, couple_context, priority, log)
+    if cached:
+        conversation_manager.add_message(remote_jid, "model", cached)
+        for balloon in split_long_message(cached):
+            yield balloon
+        return
+
+    splitter = BalloonSplitter()
+    full_text = ""
+    sent_any = False
+    usage = {}
+    try:
+        async for delta in stream_ai_content_http(user_text, user_name, full_text_start, priority, usage):
+            full_text += delta
+            for balloon in splitter.feed(delta):
+                sent_any = True
+                yield balloon
+        for balloon in splitter.flush():
+            sent_any = True
+            yield balloon
+        prompt_usage.record(plan, usage, log)
+    except RateLimitShed as e:
+        log.warning("gemini_request_shed", reason=str(e))
+        yield BUSY_REPLY
+        return
+    except Exception as e:
+        log.error("gemini_stream_failed", error=str(e), balloons_sent=sent_any)
+        if not sent_any:
+            yield "Minha intuição falhou por um instante (erro técnico). Tente novamente! 🧠✨"
+        return
+
+    if not full_text:
+        log.warning("gemini_stream_empty")
+        yield "Fiquei sem palavras. Pode repetir?"
+        return
+
+    # Registra a resposta completa na memória
+    conversation_manager.add_message(remote_jid, "model", full_text)
+    _store_cached_reply(cache_keys, full_text)
+
 # --- HUMAN DELAY & ANTI-BOT DETECTION ---
 import asyncio
 import random
@@ -238,6 +445,59 @@ def split_long_message(text: str, max_length: int = 500) -> list[str]:
     
     return chunks if chunks else [text]
 
+class BalloonSplitter:
+    """
+    Versão incremental do split_long_message para respostas em streaming.
+    Recebe pedaços de texto via feed() e devolve os balões que já estão fechados:
+    - tudo antes de um <QUEBRA> completo
+    - ou, se o buffer passar de max_length, as frases inteiras que cabem no limite
+    flush() devolve o que sobrou quando a geração termina.
+    """
+    MARKER = "<QUEBRA>"
+
+    def __init__(self, max_length: int = 500):
+        self.max_length = max_length
+        self.buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        self.buffer += text
+        balloons = []
+        while True:
+            if self.MARKER in self.buffer:
+                head, self.buffer = self.buffer.split(self.MARKER, 1)
+                if head.strip():
+                    balloons.append(head.strip())
+                continue
+            if len(self.buffer) > self.max_length:
+                # Corta na última fronteira de frase que cabe no limite
+                cut = self.buffer.rfind(". ", 0, self.max_length)
+                if cut == -1:
+                    cut = self.buffer.find(". ", self.max_length)
+                if cut == -1:
+                    break  # Frase ainda não terminou; espera mais texto
+                head, self.buffer = self.buffer[:cut + 1], self.buffer[cut + 2:]
+                if head.strip():
+                    balloons.append(head.strip())
+                continue
+            break
+        return balloons
+
+    def flush(self) -> list[str]:
+        remaining, self.buffer = self.buffer, ""
+        return split_long_message(remaining, self.max_length) if remaining.strip() else []
+
+class EvolutionSendError(Exception):
+    """A Evolution respondeu, mas não aceitou a mensagem (status fora de 2xx)."""
+
+
+async def _post_send_text(remote_jid: str, text: str, mentions: list[str] = None) -> httpx.Response:
+    url = f"{EVOLUTION_URL}/message/sendText/{INSTANCE_NAME}"
+    payload = {"number": remote_jid, "text": text, "delay": 1200, "linkPreview": True}
+    if mentions:
+        payload["mentions"] = mentions
+    headers = {"apikey": EVOLUTION_API_KEY, "Content-Type": "application/json"}
+    return await http_clients.get("evolution").post(url, json=payload, headers=headers)
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=2, max=10),
@@ -251,55 +511,36 @@ async def send_text(remote_jid: str, text: str, mentions: list[str] = None):
         return
     # ------------------
 
-    url = f"{EVOLUTION_URL}/message/sendText/{INSTANCE_NAME}"
     log = logger.bind(remote_jid=remote_jid, instance=INSTANCE_NAME)
     
     log.info("sending_whatsapp_message")
 
-    payload = {"number": remote_jid, "text": text, "delay": 1200, "linkPreview": True}
-    if mentions:
-        payload["mentions"] = mentions
-    headers = {"apikey": EVOLUTION_API_KEY, "Content-Type": "application/json"}
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code == 201:
-                log.info("message_sent_success")
-            else:
-                log.error("message_send_failed", status=response.status_code, body=response.text)
-        except Exception as e:
-            log.error("evolution_api_connection_error", error=str(e))
-            raise e
+    try:
+        response = await _post_send_text(remote_jid, text, mentions)
+        if response.status_code == 201:
+            log.info("message_sent_success")
+        else:
+            log.error("message_send_failed", status=response.status_code, body=response.text)
+    except Exception as e:
+        log.error("evolution_api_connection_error", error=str(e))
+        raise e
 
-async def send_text_human(remote_jid: str, text: str, mentions: list[str] = None):
+async def deliver_text(remote_jid: str, text: str, mentions: list[str] = None):
     """
-    Envia mensagem com delay humano e quebra automática de mensagens longas.
-    Usa send_text() internamente, mas adiciona comportamento anti-bot.
-    
-    Args:
-        remote_jid: JID do destinatário
-        text: Texto completo (pode conter <QUEBRA>)
-        mentions: Lista de JIDs para mencionar
+    Envio estrito usado pelo outbox: uma tentativa, sem retry interno, e levanta
+    exceção em qualquer falha (conexão ou status fora de 2xx) para o outbox
+    registrar e reagendar.
     """
-    log = logger.bind(remote_jid=remote_jid)
-    
-    # 1. Quebra mensagem em balões menores
-    chunks = split_long_message(text)
-    log.info("sending_with_human_delay", chunks_count=len(chunks))
-    
-    # 2. Envia cada balão com delay entre eles
-    for i, chunk in enumerate(chunks):
-        # Calcula delay baseado no tamanho do chunk
-        delay = calculate_human_delay(len(chunk))
-        
-        # Aguarda o delay (simula digitação)
-        if i > 0:  # Não espera antes do primeiro balão
-            log.debug("human_delay_wait", seconds=delay)
-            await asyncio.sleep(delay)
-        
-        # Envia o balão
-        await send_text(remote_jid, chunk, mentions)
+    # --- MOCK LOGIC ---
+    if os.getenv("MOCK_WHATSAPP", "false").lower() == "true":
+        logger.warning(f"MOCK_MODE: Skipping deliver_text to {remote_jid}")
+        return
+    # ------------------
+
+    response = await _post_send_text(remote_jid, text, mentions)
+    if not response.is_success:
+        raise EvolutionSendError(f"HTTP {response.status_code}: {response.text[:200]}")
+    logger.info("message_sent_success", remote_jid=remote_jid, instance=INSTANCE_NAME)
 
 
 async def create_whatsapp_group(subject: str, participants: list[str], description: str = None) -> str:
@@ -330,27 +571,27 @@ async def create_whatsapp_group(subject: str, participants: list[str], descripti
     
     headers = {"apikey": EVOLUTION_API_KEY, "Content-Type": "application/json"}
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code in (200, 201):
-                data = response.json()
-                # Dependendo da versão da Evolution, o retorno pode variar
-                # Geralmente retorna algo como { "id": "...", "subject": "..." } ou dentro de "group"
-                group_jid = data.get("id") or data.get("gid") or data.get("group", {}).get("id")
-                
-                if group_jid:
-                    log.info("group_created_success", group_jid=group_jid)
-                    return group_jid
-                else:
-                    log.error("group_creation_no_id", body=data)
-                    return None
+    client = http_clients.get("evolution")
+    try:
+        response = await client.post(url, json=payload, headers=headers)
+        if response.status_code in (200, 201):
+            data = response.json()
+            # Dependendo da versão da Evolution, o retorno pode variar
+            # Geralmente retorna algo como { "id": "...", "subject": "..." } ou dentro de "group"
+            group_jid = data.get("id") or data.get("gid") or data.get("group", {}).get("id")
+            
+            if group_jid:
+                log.info("group_created_success", group_jid=group_jid)
+                return group_jid
             else:
-                log.error("group_creation_failed", status=response.status_code, body=response.text)
+                log.error("group_creation_no_id", body=data)
                 return None
-        except Exception as e:
-            log.error("evolution_api_group_error", error=str(e))
+        else:
+            log.error("group_creation_failed", status=response.status_code, body=response.text)
             return None
+    except Exception as e:
+        log.error("evolution_api_group_error", error=str(e))
+        return None
 
 async def update_group_picture(group_jid: str, image_path: str):
     """
@@ -394,18 +635,18 @@ async def update_group_picture(group_jid: str, image_path: str):
         log.info("sending_picture_update_request", url=url)
         print(f"[DEBUG] Sending PUT request to {url}")
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.put(url, json=payload, headers=headers)
-            log.info("picture_update_response", status=response.status_code)
-            print(f"[DEBUG] Response status: {response.status_code}")
-            print(f"[DEBUG] Response body: {response.text}")
-            
-            if response.status_code in (200, 201):
-                log.info("group_picture_updated_success")
-                print("[DEBUG] Picture updated successfully!")
-            else:
-                log.error("group_picture_update_failed", status=response.status_code, body=response.text)
-                print(f"[DEBUG] Picture update FAILED: {response.status_code} - {response.text}")
+        client = http_clients.get("evolution")
+        response = await client.put(url, json=payload, headers=headers)
+        log.info("picture_update_response", status=response.status_code)
+        print(f"[DEBUG] Response status: {response.status_code}")
+        print(f"[DEBUG] Response body: {response.text}")
+        
+        if response.status_code in (200, 201):
+            log.info("group_picture_updated_success")
+            print("[DEBUG] Picture updated successfully!")
+        else:
+            log.error("group_picture_update_failed", status=response.status_code, body=response.text)
+            print(f"[DEBUG] Picture update FAILED: {response.status_code} - {response.text}")
                 
     except Exception as e:
         log.error("update_group_picture_error", error=str(e), exc_info=True)
@@ -0,0 +1,5 @@
+"""Os módulos do bot são importados direto de src/ (como no uvicorn main:app)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,53 @@
+"""Fronteiras do BalloonSplitter (balões do streaming do Gemini)."""
+from services import BalloonSplitter, split_long_message
+
+
+def test_marker_split_across_chunks():
+    splitter = BalloonSplitter(max_length=20)
+    assert splitter.feed("Oi<QUE") == []
+    assert splitter.feed("BRA>tudo bem") == ["Oi"]
+    assert splitter.flush() == ["tudo bem"]
+
+
+def test_empty_balloons_between_markers_are_dropped():
+    splitter = BalloonSplitter(max_length=20)
+    assert splitter.feed("<QUEBRA>  <QUEBRA>Olá<QUEBRA>") == ["Olá"]
+    assert splitter.flush() == []
+
+
+def test_buffer_at_max_length_is_not_cut():
+    splitter = BalloonSplitter(max_length=20)
+    assert splitter.feed("Frase um. Frase dois") == []  # Exatamente 20 caracteres
+    assert splitter.feed("!") == ["Frase um."]
+    assert splitter.buffer == "Frase dois!"
+
+
+def test_cuts_at_last_sentence_that_fits():
+    splitter = BalloonSplitter(max_length=20)
+    assert splitter.feed("Um. Dois. Tres quatro cinco") == ["Um. Dois."]
+    assert splitter.buffer == "Tres quatro cinco"
+
+
+def test_long_sentence_waits_for_its_end():
+    splitter = BalloonSplitter(max_length=10)
+    assert splitter.feed("Uma frase bem comprida") == []
+    assert splitter.feed(" que acaba aqui. Outra") == ["Uma frase bem comprida que acaba aqui."]
+    assert splitter.buffer == "Outra"
+
+
+def test_flush_matches_split_long_message():
+    text = "Primeira frase curta. Segunda frase. Terceira frase que fecha"
+    splitter = BalloonSplitter(max_length=500)
+    assert splitter.feed(text) == []
+    assert splitter.flush() == split_long_message(text, 500)
+    assert splitter.buffer == ""
+
+
+def test_streamed_balloons_match_whole_text():
+    text = "Oi, tudo bem?<QUEBRA>Vamos conversar. Com calma.<QUEBRA>Estou aqui"
+    splitter = BalloonSplitter(max_length=500)
+    balloons = []
+    for i in range(0, len(text), 3):
+        balloons += splitter.feed(text[i:i + 3])
+    balloons += splitter.flush()
+    assert balloons == split_long_message(text, 500)
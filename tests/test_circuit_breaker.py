@@ -0,0 +1,191 @@
+"""Transições do circuit breaker e cobrança das reservas no hedging do ModelRouter."""
+import asyncio
+
+import httpx
+import pytest
+
+import circuit_breaker
+import services
+from circuit_breaker import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError, ModelRouter,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker("gemini-test", window=4, min_calls=2, error_rate=0.5, latency_p95_ms=1000, open_seconds=30)
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://gemini.test")
+    return httpx.HTTPStatusError("erro", request=request, response=httpx.Response(status, request=request))
+
+
+def test_closed_open_half_open_closed(clock):
+    breaker = make_breaker()
+    breaker.record(False, 10)
+    assert breaker.state == STATE_CLOSED  # Abaixo de min_calls não avalia
+    breaker.record(True, 10)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()  # Uma chamada de teste por vez
+
+    breaker.record(True, 10)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.stats()["opened"] == 1
+
+
+def test_failed_or_slow_probe_reopens(clock):
+    breaker = make_breaker()
+    breaker.record(False, 10)
+    breaker.record(False, 10)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False, 10)
+    assert breaker.state == STATE_OPEN
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(True, 5000)  # Respondeu, mas acima do limite de latência
+    assert breaker.state == STATE_OPEN
+    assert breaker.opened == 3
+
+
+def test_released_probe_frees_the_slot(clock):
+    breaker = make_breaker()
+    breaker.record(False, 10)
+    breaker.record(False, 10)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()  # Chamada liberada que não aconteceu (ex: hedge sem cota)
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
+
+
+def test_opens_on_latency_p95(clock):
+    breaker = make_breaker()
+    breaker.record(True, 1500)
+    breaker.record(True, 1500)
+    assert breaker.state == STATE_OPEN
+
+
+def run_router(router: ModelRouter, delays: dict, failures: dict = None, hedge_allowed=lambda: True):
+    """Roda uma chamada; devolve (resultado ou exceção, [(hedge, desfecho)] de cada reserva acertada)."""
+    settled = []
+
+    async def request(model):
+        await asyncio.sleep(delays[model])
+        if failures and model in failures:
+            raise failures[model]
+        return {"model": model, "usageMetadata": {"totalTokenCount": 100}}
+
+    async def scenario():
+        try:
+            result = await router.call(request, hedge_allowed=hedge_allowed,
+                                       settle=lambda hedge, outcome: settled.append((hedge, outcome)))
+        except Exception as e:
+            result = e
+        await asyncio.sleep(0)  # Callbacks dos hedges cancelados
+        return result
+
+    return asyncio.run(scenario()), settled
+
+
+def test_hedge_win_bills_only_the_hedge():
+    router = ModelRouter(["a", "b"], hedge_after_ms=20)
+    result, settled = run_router(router, {"a": 0.5, "b": 0.01})
+    assert result["model"] == "b"
+    assert router.hedges == router.hedges_won == 1
+    usage = [(hedge, outcome["model"]) for hedge, outcome in settled if isinstance(outcome, dict)]
+    assert usage == [(True, "b")]
+    # A principal perdeu a corrida: acertada como cancelada (a reserva fica), nunca com o consumo do hedge
+    assert [(hedge, type(outcome)) for hedge, outcome in settled if not isinstance(outcome, dict)] == [
+        (False, asyncio.CancelledError)]
+
+
+def test_primary_win_cancels_hedge():
+    router = ModelRouter(["a", "b"], hedge_after_ms=20)
+    result, settled = run_router(router, {"a": 0.05, "b": 0.5})
+    assert result["model"] == "a"
+    assert router.hedges == 1 and router.hedges_won == 0
+    assert sorted((hedge, outcome["model"] if isinstance(outcome, dict) else type(outcome))
+                  for hedge, outcome in settled) == [(False, "a"), (True, asyncio.CancelledError)]
+
+
+def test_hedge_denied_without_quota_releases_breaker():
+    router = ModelRouter(["a", "b"], hedge_after_ms=20)
+    result, settled = run_router(router, {"a": 0.05, "b": 0.01}, hedge_allowed=lambda: False)
+    assert result["model"] == "a"
+    assert router.hedges == 0 and router.hedges_denied == 1
+    assert [(hedge, outcome["model"]) for hedge, outcome in settled] == [(False, "a")]
+
+
+def test_model_failure_falls_back_on_same_reservation():
+    router = ModelRouter(["a", "b"], hedge_after_ms=0)
+    result, settled = run_router(router, {"a": 0, "b": 0}, failures={"a": http_error(503)})
+    assert result["model"] == "b"
+    assert router.fallbacks == 1
+    assert [(hedge, outcome["model"]) for hedge, outcome in settled] == [(False, "b")]
+
+
+def test_client_error_is_not_retried_and_is_settled():
+    router = ModelRouter(["a", "b"], hedge_after_ms=0)
+    error = http_error(400)
+    result, settled = run_router(router, {"a": 0, "b": 0}, failures={"a": error})
+    assert result is error
+    assert settled == [(False, error)]
+    assert router.breakers["a"].calls == 0  # 400 não é falha do modelo
+
+
+def test_all_breakers_open_settles_with_circuit_error(clock):
+    router = ModelRouter(["a"], hedge_after_ms=0)
+    breaker = router.breakers["a"]
+    breaker._open("test")
+    result, settled = run_router(router, {"a": 0})
+    assert isinstance(result, CircuitOpenError)
+    assert len(settled) == 1 and isinstance(settled[0][1], CircuitOpenError)
+    assert router.rejected == 1
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.settled = []
+
+    def settle(self, reserved, actual):
+        self.settled.append((reserved, actual))
+
+
+@pytest.mark.parametrize("outcome, expected", [
+    ({"usageMetadata": {"totalTokenCount": 120}}, [(50, 120)]),
+    ({}, [(50, None)]),                      # Sem usageMetadata: a estimativa fica
+    (http_error(503), [(50, 0)]),            # O Gemini recusou: devolve a reserva
+    (CircuitOpenError("all models open"), [(50, 0)]),
+    (asyncio.CancelledError(), []),          # Perdeu a corrida: pode ter consumido, a reserva fica
+    (httpx.ReadTimeout("timeout"), []),
+])
+def test_settle_attempt(monkeypatch, outcome, expected):
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(services, "gemini_limiter", limiter)
+    services._settle_attempt(50, outcome)
+    assert limiter.settled == expected
@@ -0,0 +1,124 @@
+"""Verificação local do ID token do Google (JWKS via httpx.MockTransport)."""
+import asyncio
+import time
+import uuid
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+import google_auth
+from google_auth import GoogleIdTokenVerifier
+from http_clients import http_clients
+
+CLIENT_ID = "teste.apps.googleusercontent.com"
+CERTS_URL = "https://google.test/oauth2/v3/certs"
+
+
+class FakeGoogle:
+    """JWKS com uma chave RSA atual; rotate() troca a chave como o Google faz."""
+
+    def __init__(self):
+        self.requests = 0
+        self.down = False  # Simula o endpoint de certs fora do ar
+        self.rotate()
+
+    def rotate(self):
+        private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.pem = private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        self.kid = uuid.uuid4().hex
+        self.public = jwk.construct(self.pem, "RS256").public_key().to_dict()
+        self.public.update({"kid": self.kid, "use": "sig", "alg": "RS256"})
+
+    def token(self, audience: str = CLIENT_ID, ttl: int = 3600) -> str:
+        now = int(time.time())
+        claims = {"iss": "https://accounts.google.com", "aud": audience, "sub": "42",
+                  "email": "teste@nosai.online", "iat": now, "exp": now + ttl}
+        return jwt.encode(claims, self.pem, algorithm="RS256", headers={"kid": self.kid})
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.down:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"keys": [self.public]}, headers={"Cache-Control": "public, max-age=3600"})
+
+
+@pytest.fixture
+def google(monkeypatch):
+    fake = FakeGoogle()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    monkeypatch.setitem(http_clients._clients, "google", client)
+    yield fake
+    asyncio.run(client.aclose())
+
+
+def test_verifies_token_and_caches_keys(google):
+    async def scenario():
+        verifier = GoogleIdTokenVerifier(CERTS_URL)
+        first = await verifier.verify(google.token(), CLIENT_ID)
+        second = await verifier.verify(google.token(), CLIENT_ID)
+        return verifier, first, second
+
+    verifier, first, second = asyncio.run(scenario())
+    assert first["email"] == second["email"] == "teste@nosai.online"
+    assert google.requests == 1  # Segunda verificação sem rede (max-age ainda vale)
+    assert verifier.stats()["verified"] == 2
+    assert verifier.stats()["expires_in_s"] > 3500
+
+
+@pytest.mark.parametrize("make_token", [
+    lambda google: google.token(audience="outro.apps.googleusercontent.com"),
+    lambda google: google.token(ttl=-60),
+    lambda google: google.token()[:-4] + "AAAA",
+    lambda google: "nem-um-jwt",
+])
+def test_rejects_invalid_tokens(google, make_token):
+    verifier = GoogleIdTokenVerifier(CERTS_URL)
+    with pytest.raises(ValueError):
+        asyncio.run(verifier.verify(make_token(google), CLIENT_ID))
+    assert verifier.rejected == 1
+
+
+def test_refetches_keys_after_rotation(google, monkeypatch):
+    monkeypatch.setattr(google_auth, "GOOGLE_CERTS_MIN_REFETCH_SECONDS", 0)
+
+    async def scenario():
+        verifier = GoogleIdTokenVerifier(CERTS_URL)
+        await verifier.verify(google.token(), CLIENT_ID)
+        google.rotate()  # Antes do max-age: 'kid' novo força uma busca
+        return await verifier.verify(google.token(), CLIENT_ID)
+
+    claims = asyncio.run(scenario())
+    assert claims["sub"] == "42"
+    assert google.requests == 2
+
+
+def test_unknown_kid_refetch_is_rate_limited(google):
+    async def scenario():
+        verifier = GoogleIdTokenVerifier(CERTS_URL)
+        await verifier.verify(google.token(), CLIENT_ID)
+        google.rotate()
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await verifier.verify(google.token(), CLIENT_ID)
+
+    asyncio.run(scenario())
+    assert google.requests == 1  # Dentro de GOOGLE_CERTS_MIN_REFETCH_SECONDS não busca de novo
+
+
+def test_keeps_old_keys_when_refresh_fails(google):
+    async def scenario():
+        verifier = GoogleIdTokenVerifier(CERTS_URL)
+        await verifier.verify(google.token(), CLIENT_ID)
+        google.down = True
+        verifier._expires_at = 0.0  # Chaves vencidas: a próxima verificação tenta renovar
+        claims = await verifier.verify(google.token(), CLIENT_ID)
+        return verifier, claims
+
+    verifier, claims = asyncio.run(scenario())
+    assert claims["sub"] == "42"
+    assert verifier.fetch_failures == 1